@@ -0,0 +1,106 @@
+import os
+from collections import OrderedDict
+
+# Resolves image paths to the pre-scaled copies made by build_assets.py when
+# they exist, and keeps decoded textures so revisiting a screen never decodes
+# the same PNG twice. Screen backgrounds are few and stay for the whole app;
+# drink icons go through a small LRU cache sized by the carousel, because a
+# large menu would otherwise keep every icon it ever showed in GPU memory.
+BUILD_DIR = os.path.join('build', 'assets')
+ICON_ATLAS = os.path.join(BUILD_DIR, 'icons.atlas')
+
+_textures = {}
+
+
+def asset_source(path):
+    # Icons come out of the atlas, backgrounds from the pre-scaled copies, and
+    # anything that has not been built falls back to the original file
+    folder, name = os.path.split(path)
+    if folder == 'icons' and os.path.exists(ICON_ATLAS):
+        return 'atlas://' + os.path.join(BUILD_DIR, 'icons') + '/' + os.path.splitext(name)[0]
+    built = os.path.join(BUILD_DIR, path)
+    if os.path.exists(built):
+        return built
+    return path
+
+
+def texture(path):
+    cached = _textures.get(path)
+    if cached is None:
+        from kivy.core.image import Image as CoreImage
+        cached = _textures[path] = CoreImage(asset_source(path)).texture
+    return cached
+
+
+def preload(paths):
+    # Decode the first screens' images up front, before the first frame
+    for path in paths:
+        texture(path)
+
+
+class TextureCache:
+    # The capacity most recently used textures. One that falls out is dropped
+    # from Kivy's loader cache as well, so it is freed once no tile draws it
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._textures = OrderedDict()
+        self._loading = {}  # Path -> Loader proxy of images being decoded in the background
+
+    def __len__(self):
+        return len(self._textures)
+
+    def __contains__(self, path):
+        return path in self._textures
+
+    def get(self, path):
+        cached = self._textures.get(path)
+        if cached is None:
+            cached = self._load(path)
+        self._keep(path, cached)
+        return cached
+
+    def resize(self, capacity):
+        self.capacity = capacity
+        self._evict()
+
+    def prefetch(self, path):
+        # Decode an image on the Loader's thread and keep its texture, so a
+        # later get(path) on the UI thread finds it ready. Atlas icons share
+        # one page texture that the first of them loads
+        source = asset_source(path)
+        if path in self._textures or path in self._loading or source.startswith('atlas://'):
+            return
+        from kivy.loader import Loader
+
+        def loaded(proxy):
+            self._loading.pop(path, None)
+            if path not in self._textures:
+                self._keep(path, proxy.image.texture)
+
+        proxy = self._loading[path] = Loader.image(source)
+        if proxy.loaded:
+            loaded(proxy)
+        else:
+            proxy.bind(on_load=loaded, on_error=lambda proxy: self._loading.pop(path, None))
+
+    def _load(self, path):
+        from kivy.core.image import Image as CoreImage
+        return CoreImage(asset_source(path), nocache=True).texture
+
+    def _keep(self, path, texture):
+        self._textures[path] = texture
+        self._textures.move_to_end(path)
+        self._evict()
+
+    def _evict(self):
+        while len(self._textures) > self.capacity:
+            path, _ = self._textures.popitem(last=False)
+            self._release(path)
+
+    def _release(self, path):
+        from kivy.cache import Cache
+        Cache.remove('kv.loader', asset_source(path))
+
+
+# Drink icons; DrinkCarousel resizes it to its visible tiles plus look-ahead
+icons = TextureCache(capacity=12)
@@ -0,0 +1,97 @@
+import threading
+
+from cocktail_core import OrderRefused
+
+# Pours the same drink over and over for parties. The recipe is compiled once
+# and each pour goes straight to the order queue; between pours the only
+# interaction is confirming that a fresh cup is under the spout, unless
+# cup_swap_time is set, in which case the next pour simply starts after that
+# many seconds.
+
+
+class BatchRun:
+    def __init__(self, cocktail_maker, drink_name, count, on_cup_needed=None, on_progress=None, on_finished=None,
+                 cup_swap_time=None):
+        self.cocktail_maker = cocktail_maker
+        self.drink_name = drink_name
+        self.count = count
+        self.on_cup_needed = on_cup_needed  # Called with the batch after each pour but the last
+        self.on_progress = on_progress  # Called with the batch and the Order that just started
+        self.on_finished = on_finished  # Called with the batch when it ends, finished or not
+        self.cup_swap_time = cup_swap_time
+        self.poured = 0
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.cancelled = False
+        self.current = None
+        self._lock = threading.Lock()
+
+    @property
+    def clock(self):
+        return self.cocktail_maker.clock
+
+    def enough_for_all(self):
+        drink = self.cocktail_maker.catalog.drinks[self.drink_name]
+        return self.cocktail_maker.inventory.can_pour({beverage: ml * self.count for beverage, ml in drink.recipe.items()})
+
+    def start(self):
+        self.started_at = self.clock.now()
+        self._pour_next()
+
+    def cup_ready(self):
+        # A fresh cup is in place; pour the next one
+        with self._lock:
+            if self.cancelled or self.done or (self.current and self.current.finished_at is None):
+                return
+        self._pour_next()
+
+    def cancel(self):
+        # Pours already running finish, nothing new starts
+        with self._lock:
+            self.cancelled = True
+            pouring = self.current is not None and self.current.finished_at is None
+        if not pouring:
+            self._finish()
+
+    @property
+    def done(self):
+        return self.poured >= self.count
+
+    def drinks_per_minute(self):
+        end = self.finished_at if self.finished_at is not None else self.clock.now()
+        if self.started_at is None or end <= self.started_at:
+            return 0.0
+        return self.poured / (end - self.started_at) * 60
+
+    def _pour_next(self):
+        try:
+            order = self.cocktail_maker.order(self.drink_name, on_done=self._poured, on_failed=self._failed)
+        except OrderRefused as error:
+            self.error = error
+            self._finish()
+            return
+        with self._lock:
+            self.current = order
+        if self.on_progress:
+            self.on_progress(self, order)
+
+    def _poured(self, order):
+        with self._lock:
+            self.poured += 1
+            stop = self.cancelled or self.done
+        if stop:
+            self._finish()
+        elif self.cup_swap_time is not None:
+            self.cocktail_maker.engine.call_later(self.cup_swap_time, self.cup_ready)
+        elif self.on_cup_needed:
+            self.on_cup_needed(self)
+
+    def _failed(self, order):
+        self.error = order.error
+        self._finish()
+
+    def _finish(self):
+        self.finished_at = self.clock.now()
+        if self.on_finished:
+            self.on_finished(self)
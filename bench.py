@@ -0,0 +1,492 @@
+import argparse
+import gc
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from cocktail_core import simulated_maker
+from dispense import DispenseEngine
+from inventory import Inventory
+from order_queue import OrderScheduler
+from pour_plan import plan_pours
+from pump_driver import MonotonicClock, SimulatedPumpDriver, VirtualClock
+from telemetry import percentile
+from ui_profiler import build_id
+
+# Benchmarks of the order and dispense path on simulated pumps, so a slower
+# pour path shows up before the build reaches a party. Every scenario goes
+# through CocktailMaker.order, the order scheduler and the dispense engine:
+#   throughput  random orders on a virtual clock: drinks/hour and CPU per order
+#   makespan    each drink on its own: how long it takes against its plan
+#   realtime    pumps on the real clock with short pours: stop jitter and overrun
+#   memory      a long session under tracemalloc: peak and growth
+# Before any numbers are taken, the verify_ checks assert that the pour path
+# still does the right thing: the relay cap holds across pipelined orders,
+# plans are optimal, pours last as planned, no order overtakes an earlier one
+# on a shared pump, bottle levels survive a crash, and a long queue costs no
+# more per order than a short one.
+# Results are appended to bench_results.jsonl with the build they came from;
+#   python bench.py verify                   (only the checks)
+#   python bench.py run [--quick] [--no-save]
+#   python bench.py compare [BEFORE AFTER]   (builds, default the last two)
+#   python bench.py check                    (verify, run, compare, exit 1 on a failure or regression)
+BENCH_RESULTS_FILE = 'bench_results.jsonl'
+MAX_ACTIVE = 4
+
+# Metric -> (which way is better, relative change allowed, absolute change
+# allowed). The virtual-clock numbers are exact, so a small change there is real.
+# Real-clock tails catch one scheduler hiccup now and then; losing the
+# clock's spin-wait shows as milliseconds at the median
+METRICS = {
+    'throughput.drinks_per_hour': ('higher', 0.001, 0.0),
+    'throughput.mean_wait_s': ('lower', 0.001, 0.0),
+    'throughput.us_per_order': ('lower', 0.25, 5.0),
+    'makespan.total_s': ('lower', 0.001, 0.0),
+    'makespan.worst_overrun_s': ('lower', 0.0, 0.001),
+    'realtime.stop_jitter_p50_ms': ('lower', 0.5, 0.2),
+    'realtime.stop_jitter_p99_ms': ('lower', 1.0, 2.0),
+    'realtime.stop_jitter_max_ms': ('lower', 1.0, 5.0),
+    'realtime.makespan_overrun_max_ms': ('lower', 1.0, 5.0),
+    'memory.peak_kib': ('lower', 0.25, 64.0),
+    'memory.growth_kib': ('lower', 0.5, 64.0),
+}
+
+
+def bench_throughput(orders, seed=1, repeats=3):
+    # Best of a few runs for the wall time; the simulated results are the same each time
+    best = None
+    for _ in range(repeats):
+        with tempfile.TemporaryDirectory(prefix='cocktail-bench-') as scratch:
+            maker = simulated_maker(scratch, max_active=MAX_ACTIVE)
+            menu = [drink.name for drink in maker.catalog.available_drinks()]
+            rng = random.Random(seed)
+            started = time.perf_counter()
+            for _ in range(orders):
+                maker.order(rng.choice(menu))
+            maker.run_until_idle()
+            elapsed = time.perf_counter() - started
+            stats = maker.scheduler.stats()
+            simulated = maker.clock.now()
+            maker.shutdown()
+        if best is None or elapsed < best:
+            best = elapsed
+    return {
+        'orders': orders,
+        'drinks_per_hour': orders / simulated * 3600,
+        'mean_wait_s': stats['mean_wait'],
+        'us_per_order': best / orders * 1e6,
+    }
+
+
+def bench_makespan():
+    # One order at a time on idle pumps with primed lines, so each pour is
+    # only its own plan
+    total = 0.0
+    worst = 0.0
+    with tempfile.TemporaryDirectory(prefix='cocktail-bench-') as scratch:
+        maker = simulated_maker(scratch, max_active=MAX_ACTIVE)
+        maker.lines.mark_wet(maker.catalog.bottles.values())
+        drinks = maker.catalog.available_drinks()
+        for drink in drinks:
+            order = maker.order(drink.name)
+            maker.run_until_idle()
+            total += order.job.makespan
+            worst = max(worst, order.job.makespan - order.job.planned_makespan)
+        maker.shutdown()
+    return {'drinks': len(drinks), 'total_s': total, 'worst_overrun_s': worst}
+
+
+def bench_realtime(orders, pour_seconds=0.25, timeout=None):
+    # Threaded engine sleeping on the monotonic clock, as on the Pi, with the
+    # flow rates scaled so the longest ingredient takes pour_seconds
+    if timeout is None:
+        timeout = 10 + orders * pour_seconds * 4
+    with tempfile.TemporaryDirectory(prefix='cocktail-bench-') as scratch:
+        maker = simulated_maker(scratch, max_active=MAX_ACTIVE, clock=MonotonicClock())
+        longest = max(ml for drink in maker.catalog.drinks.values() for ml in drink.recipe.values())
+        for pin in maker.catalog.bottles.values():
+            maker.calibration.set_rate(pin, longest / pour_seconds)
+        maker.lines.mark_wet(maker.catalog.bottles.values())
+        menu = [drink.name for drink in maker.catalog.available_drinks()]
+        rng = random.Random(1)
+        finished = []
+        done = threading.Event()
+
+        def on_done(order):
+            finished.append(order)
+            if len(finished) == orders:
+                done.set()
+
+        try:
+            for _ in range(orders):
+                maker.order(rng.choice(menu), on_done=on_done)
+            # A dead or stuck engine fails the run instead of hanging it
+            if not done.wait(timeout):
+                raise RuntimeError(f"Only {len(finished)} of {orders} orders poured, engine failure: {maker.engine.failed}")
+        finally:
+            maker.shutdown()
+    jitter = sorted(abs(value) * 1000 for order in finished for value in order.job.stop_jitter.values())
+    overrun = max((order.job.makespan - order.job.planned_makespan) * 1000 for order in finished)
+    return {
+        'orders': orders,
+        'stop_jitter_p50_ms': percentile(jitter, 0.5),
+        'stop_jitter_p99_ms': percentile(jitter, 0.99),
+        'stop_jitter_max_ms': jitter[-1],
+        'makespan_overrun_max_ms': max(overrun, 0.0),
+    }
+
+
+def bench_memory(orders, chunk=500):
+    # Orders arrive in chunks that are poured before the next, like a long
+    # evening. Growth is over the second half only, once the caches and the
+    # bounded jitter and wait histories have filled
+    with tempfile.TemporaryDirectory(prefix='cocktail-bench-') as scratch:
+        maker = simulated_maker(scratch, max_active=MAX_ACTIVE)
+        menu = [drink.name for drink in maker.catalog.available_drinks()]
+        rng = random.Random(1)
+        tracemalloc.start()
+        try:
+            chunks = max(orders // chunk, 2)
+            for index in range(chunks):
+                for _ in range(chunk):
+                    maker.order(rng.choice(menu))
+                maker.run_until_idle()
+                maker.telemetry.flush()  # The app flushes on a timer
+                maker.driver.edges.clear()  # The simulated relays keep every edge; real ones do not
+                gc.collect()  # Orders and their jobs refer to each other; count only what survives
+                current, peak = tracemalloc.get_traced_memory()
+                if index == chunks // 2 - 1:
+                    baseline = current
+        finally:
+            tracemalloc.stop()
+        maker.shutdown()
+    return {'orders': orders, 'peak_kib': peak / 1024, 'growth_kib': max(current - baseline, 0) / 1024}
+
+
+class CheckFailed(AssertionError):
+    pass
+
+
+def expect(condition, message):
+    # Not assert, so the checks still run under python -O
+    if not condition:
+        raise CheckFailed(message)
+
+
+def random_orders(maker, orders, seed):
+    menu = [drink.name for drink in maker.catalog.available_drinks()]
+    rng = random.Random(seed)
+    return [maker.order(rng.choice(menu)) for _ in range(orders)]
+
+
+def verify_relay_cap(orders=300, seed=2):
+    # Replay every relay edge of a busy evening: never more pumps on than
+    # the cap, and every pump that went on came off again
+    with tempfile.TemporaryDirectory(prefix='cocktail-verify-') as scratch:
+        maker = simulated_maker(scratch, max_active=MAX_ACTIVE)
+        placed = random_orders(maker, orders, seed)
+        maker.run_until_idle()
+        edges = list(maker.driver.edges)
+        maker.shutdown()
+    expect(all(order.finished_at is not None for order in placed), "Orders left unpoured")
+    on = set()
+    for _, group in itertools.groupby(edges, key=lambda edge: edge.time):
+        group = list(group)
+        for edge in group:
+            if not edge.on:
+                expect(edge.pin in on, f"GPIO {edge.pin} switched off while off")
+                on.discard(edge.pin)
+        for edge in group:
+            if edge.on:
+                expect(edge.pin not in on, f"GPIO {edge.pin} switched on twice")
+                on.add(edge.pin)
+        expect(len(on) <= MAX_ACTIVE, f"{len(on)} pumps on at once, cap is {MAX_ACTIVE}")
+    expect(not on, f"GPIO {sorted(on)} left on")
+
+
+def best_makespan(durations, max_active):
+    # Brute force over every assignment of pours to relay slots
+    pins = list(durations)
+    best = None
+    for slots in itertools.product(range(max_active), repeat=len(pins)):
+        loads = [0.0] * max_active
+        for pin, slot in zip(pins, slots):
+            loads[slot] += durations[pin]
+        best = max(loads) if best is None else min(best, max(loads))
+    return best
+
+
+def verify_plans(cases=200, seed=3):
+    # Random recipes small enough to brute force: the plan pours each pin
+    # once for its full time, stays under the cap and is optimal
+    rng = random.Random(seed)
+    for _ in range(cases):
+        durations = {pin: rng.choice([rng.uniform(1, 60), float(rng.randint(1, 6) * 10)])
+                     for pin in rng.sample(range(30), rng.randint(1, 6))}
+        max_active = rng.randint(1, 4)
+        plan = plan_pours(durations, max_active)
+        expect(plan.durations == durations, f"Plan for {durations} changes the pours")
+        for step in plan.steps:
+            running = sum(1 for other in plan.steps if other.start <= step.start < other.start + other.duration)
+            expect(running <= max_active, f"Plan for {durations} runs {running} pumps, cap is {max_active}")
+        best = best_makespan(durations, max_active)
+        expect(abs(plan.makespan - best) < 1e-9,
+               f"Plan for {durations} under {max_active} takes {plan.makespan:.3f} s, best is {best:.3f} s")
+
+
+def verify_makespan():
+    # On a virtual clock each drink on idle pumps takes exactly its plan,
+    # and every pump runs exactly its compiled time
+    with tempfile.TemporaryDirectory(prefix='cocktail-verify-') as scratch:
+        maker = simulated_maker(scratch, max_active=MAX_ACTIVE)
+        maker.lines.mark_wet(maker.catalog.bottles.values())
+        for drink in maker.catalog.available_drinks():
+            maker.driver.edges.clear()
+            order = maker.order(drink.name)
+            maker.run_until_idle()
+            expect(abs(order.job.makespan - order.plan.makespan) < 1e-9,
+                   f"{drink.name} took {order.job.makespan:.3f} s, planned {order.plan.makespan:.3f} s")
+            started = {}
+            for edge in maker.driver.edges:
+                if edge.on:
+                    started[edge.pin] = edge.time
+                else:
+                    ran = edge.time - started.pop(edge.pin)
+                    expect(abs(ran - order.durations[edge.pin]) < 1e-9,
+                           f"{drink.name}: GPIO {edge.pin} ran {ran:.3f} s of {order.durations[edge.pin]:.3f} s")
+        maker.shutdown()
+
+
+def verify_queue_order(orders=300, seed=4):
+    # Orders that share a pump start in the order they were placed; only
+    # orders on other pumps may go ahead
+    with tempfile.TemporaryDirectory(prefix='cocktail-verify-') as scratch:
+        maker = simulated_maker(scratch, max_active=MAX_ACTIVE)
+        placed = random_orders(maker, orders, seed)
+        maker.run_until_idle()
+        maker.shutdown()
+    for index, earlier in enumerate(placed):
+        expect(earlier.finished_at is not None, f"Order {earlier.order_id} never poured")
+        for later in placed[index + 1:]:
+            if earlier.pins & later.pins:
+                expect(earlier.started_at <= later.started_at,
+                       f"Order {later.order_id} overtook order {earlier.order_id} on a shared pump")
+                expect(earlier.finished_at <= later.started_at,
+                       f"Orders {earlier.order_id} and {later.order_id} poured on one pump at once")
+
+
+def verify_recovery(operations=2000, seed=5):
+    # Random fills and pours with crashes in between, some in the middle of
+    # a log write: after every reopen the levels are what was written
+    rng = random.Random(seed)
+    beverages = ['Rum', 'Coke', 'Gin', 'Tonic']
+    expected = {}
+    with tempfile.TemporaryDirectory(prefix='cocktail-verify-') as scratch:
+        paths = os.path.join(scratch, 'inventory.json'), os.path.join(scratch, 'inventory.log')
+        inventory = Inventory(*paths)
+        inventory.compact_after = 50
+        for step in range(operations):
+            if rng.random() < 0.1:
+                beverage = rng.choice(beverages)
+                expected[beverage] = float(rng.randint(100, 1000))
+                inventory.set_level(beverage, expected[beverage])
+            else:
+                pour = {beverage: float(rng.randint(10, 60)) for beverage in rng.sample(beverages, 2)}
+                inventory.deduct(pour)
+                for beverage, ml in pour.items():
+                    if beverage in expected:
+                        expected[beverage] -= ml
+            if rng.random() < 0.02:
+                # Power cut: the log handle is dropped, maybe mid-line
+                inventory._log.close()
+                if rng.random() < 0.5:
+                    with open(paths[1], 'a') as f:
+                        f.write('{"op":"pour","ml":{"Rum":')
+                inventory = Inventory(*paths)
+                inventory.compact_after = 50
+                expect(inventory.levels == expected, f"After {step + 1} writes recovered {inventory.levels}, "
+                       f"expected {expected}")
+        inventory.close()
+        expect(Inventory(*paths).levels == expected, "Levels lost on a clean shutdown")
+
+
+def verify_queue_scaling(orders=1000, factor=8, repeats=2):
+    # Queue factor times as many orders, then pour them all: the cost per
+    # order of either step may rise a little, but a scheduler that scans or
+    # copies the whole queue for every start costs about twice as much or more
+    def per_order(count):
+        best = None
+        for _ in range(repeats):
+            driver = SimulatedPumpDriver(VirtualClock())
+            driver.setup(range(6))
+            engine = DispenseEngine(driver, max_active=MAX_ACTIVE)
+            scheduler = OrderScheduler(engine)
+            # Collections of whatever ran before would land in the timings
+            gc.collect()
+            gc.disable()
+            try:
+                started = time.perf_counter()
+                for index in range(count):
+                    scheduler.submit('bench', {index % 6: 10.0, (index + 1) % 6: 30.0})
+                queued = time.perf_counter()
+                engine.run_until_idle()
+                times = (queued - started) / count, (time.perf_counter() - queued) / count
+            finally:
+                gc.enable()
+            best = times if best is None else tuple(map(min, best, times))
+        return best
+
+    short, long = per_order(orders), per_order(orders * factor)
+    for step, few, many in zip(['Queueing', 'Pouring'], short, long):
+        expect(many < few * 2, f"{step} {orders * factor} orders takes {many * 1e6:.1f} us each, "
+               f"{orders} take {few * 1e6:.1f} us each")
+
+
+CHECKS = [verify_relay_cap, verify_plans, verify_makespan, verify_queue_order, verify_recovery, verify_queue_scaling]
+
+
+def verify():
+    # Names of the checks that failed, each with its message printed
+    failed = []
+    for check in CHECKS:
+        try:
+            check()
+        except CheckFailed as error:
+            print(f"  FAILED {check.__name__}: {error}")
+            failed.append(check.__name__)
+        else:
+            print(f"  ok     {check.__name__}")
+    return failed
+
+
+def run(quick=False):
+    scale = 0.2 if quick else 1
+    return {
+        'build': build_id(),
+        'recorded_at': time.time(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'quick': quick,
+        'throughput': bench_throughput(int(2000 * scale)),
+        'makespan': bench_makespan(),
+        'realtime': bench_realtime(int(100 * scale)),
+        'memory': bench_memory(int(10000 * scale)),
+    }
+
+
+def save(result, path=BENCH_RESULTS_FILE):
+    with open(path, 'a') as f:
+        f.write(json.dumps(result) + '\n')
+
+
+def load(path=BENCH_RESULTS_FILE):
+    try:
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def find(results, build):
+    # The latest result recorded for a build
+    for result in reversed(results):
+        if result['build'] == build:
+            return result
+    raise KeyError(f"No benchmark results for build {build!r}")
+
+
+def metric(result, name):
+    scenario, key = name.split('.')
+    return result.get(scenario, {}).get(key)
+
+
+def regressions(before, after):
+    # (metric, before, after, regressed) for every metric both results have
+    rows = []
+    for name, (better, relative, absolute) in METRICS.items():
+        old, new = metric(before, name), metric(after, name)
+        if old is None or new is None:
+            continue
+        worse = new - old if better == 'lower' else old - new
+        rows.append((name, old, new, worse > max(abs(old) * relative, absolute)))
+    return rows
+
+
+def print_result(result):
+    print(f"Build {result['build']} (Python {result['python']} on {result['machine']})")
+    for name in METRICS:
+        value = metric(result, name)
+        if value is not None:
+            print(f"  {name:<36} {value:12.3f}")
+
+
+def print_comparison(before, after):
+    print(f"{before['build']} -> {after['build']}")
+    if before.get('quick') != after.get('quick') or before.get('machine') != after.get('machine'):
+        print("  Warning: runs differ in --quick or machine, wall-clock numbers are not comparable")
+    rows = regressions(before, after)
+    for name, old, new, regressed in rows:
+        change = (new - old) / old * 100 if old else 0.0
+        print(f"  {name:<36} {old:12.3f} {new:12.3f}  {change:+7.1f}%" + ('  REGRESSION' if regressed else ''))
+    return [name for name, _, _, regressed in rows if regressed]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the pour path on simulated pumps")
+    parser.add_argument('--results', default=BENCH_RESULTS_FILE)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('verify')
+    for command in ('run', 'check'):
+        command_parser = commands.add_parser(command)
+        command_parser.add_argument('--quick', action='store_true', help="Fewer orders, for a quick look")
+        command_parser.add_argument('--no-save', action='store_true')
+    compare_parser = commands.add_parser('compare')
+    compare_parser.add_argument('builds', nargs='*', help="Two builds, default the last two results")
+    args = parser.parse_args(argv)
+
+    results = load(args.results)
+    if args.command == 'compare':
+        if len(args.builds) == 2:
+            before, after = find(results, args.builds[0]), find(results, args.builds[1])
+        elif len(results) >= 2:
+            before, after = results[-2], results[-1]
+        else:
+            print(f"Need two results in {args.results} or two builds to compare")
+            return 1
+        return 1 if print_comparison(before, after) else 0
+
+    if args.command in ('verify', 'check'):
+        failed = verify()
+        if failed:
+            print(f"{len(failed)} checks failed")
+            return 1
+        if args.command == 'verify':
+            return 0
+
+    result = run(quick=args.quick)
+    print_result(result)
+    if not args.no_save:
+        save(result, args.results)
+    if args.command == 'check':
+        # Against the latest run of another build under the same settings
+        earlier = [previous for previous in results if previous['build'] != result['build']
+                   and previous.get('quick') == result['quick'] and previous.get('machine') == result['machine']]
+        if not earlier:
+            print("Nothing to compare with yet")
+            return 0
+        regressed = print_comparison(earlier[-1], result)
+        if regressed:
+            print(f"{len(regressed)} regressions")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,63 @@
+import json
+import os
+import sys
+
+from PIL import Image
+
+# Pre-scales the screen backgrounds to the display resolution and packs the
+# drink icons, scaled to their on-screen tile size, into a Kivy atlas. The app
+# picks the results up from build/assets through assets.py, so the Pi no longer
+# decodes and rescales full-size PNGs at startup.
+BUILD_DIR = os.path.join('build', 'assets')
+BACKGROUNDS = ['screensaver.png', 'drinkbg.png', 'loading.png']
+ICON_DIR = 'icons'
+ATLAS_PAGE_SIZE = 1024
+ATLAS_PADDING = 2
+
+
+def scale_background(name, size):
+    with Image.open(name) as image:
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+        if image.size != size:
+            image = image.resize(size, Image.LANCZOS)
+        image.save(os.path.join(BUILD_DIR, name), optimize=True)
+
+
+def pack_icons(tile_size):
+    # Shelf packing: fill rows left to right and start a new page when full
+    names = sorted(name for name in os.listdir(ICON_DIR) if name.endswith('.png'))
+    step = tile_size + ATLAS_PADDING
+    per_row = max(ATLAS_PAGE_SIZE // step, 1)
+    per_page = per_row * per_row
+    meta = {}
+    for page_index in range(0, len(names), per_page):
+        page_names = names[page_index:page_index + per_page]
+        page_file = f'icons-{page_index // per_page}.png'
+        page = Image.new('RGBA', (ATLAS_PAGE_SIZE, ATLAS_PAGE_SIZE))
+        meta[page_file] = {}
+        for slot, name in enumerate(page_names):
+            x = (slot % per_row) * step
+            y = (slot // per_row) * step
+            with Image.open(os.path.join(ICON_DIR, name)) as icon:
+                page.paste(icon.convert('RGBA').resize((tile_size, tile_size), Image.LANCZOS), (x, y))
+            # Atlas coordinates have their origin at the bottom left
+            meta[page_file][os.path.splitext(name)[0]] = [x, ATLAS_PAGE_SIZE - y - tile_size, tile_size, tile_size]
+        page.save(os.path.join(BUILD_DIR, page_file), optimize=True)
+    with open(os.path.join(BUILD_DIR, 'icons.atlas'), 'w') as f:
+        json.dump(meta, f)
+    return len(names)
+
+
+def build(width, height):
+    os.makedirs(BUILD_DIR, exist_ok=True)
+    for name in BACKGROUNDS:
+        scale_background(name, (width, height))
+    # Tiles are a 2.5th of the screen width, see DrinkSelectionScreen
+    count = pack_icons(int(width / 2.5))
+    print(f"Built {len(BACKGROUNDS)} backgrounds and an atlas of {count} icons for {width}x{height} in {BUILD_DIR}")
+
+
+if __name__ == '__main__':
+    # Defaults to the 5-inch 800x480 display
+    width, height = (int(value) for value in sys.argv[1:3]) if len(sys.argv) > 2 else (800, 480)
+    build(width, height)
@@ -0,0 +1,114 @@
+import json
+import math
+import os
+import sys
+import threading
+
+# Recipes are written in millilitres; each pump's measured flow rate turns
+# them into on-times. A pump that has never been calibrated is assumed to run
+# at DEFAULT_FLOW_RATE, which matches the original 20 s / 60 s pours.
+DEFAULT_FLOW_RATE = 1.5  # ml per second
+CALIBRATION_FILE = 'calibration.json'
+
+
+class FlowCalibration:
+    def __init__(self, path=CALIBRATION_FILE):
+        self.path = path
+        self.rates = {}  # GPIO pin -> ml per second
+        self.version = 0  # Bumped on every change so compiled doses can be invalidated
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            data = json.load(f)
+        # A hand-edited file is taken whole or not at all; on a ValueError
+        # the rates in use stay as they were
+        if not isinstance(data, dict):
+            raise ValueError(f"{self.path} should map GPIO pins to ml per second")
+        try:
+            rates = {int(pin): float(rate) for pin, rate in data.items()}
+        except TypeError as error:
+            raise ValueError(f"Bad flow rate in {self.path}: {error}") from None
+        for pin, rate in rates.items():
+            if not 0 < rate < math.inf:
+                raise ValueError(f"Flow rate for GPIO {pin} must be positive")
+        with self._lock:
+            self.rates = rates
+            self.version += 1
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({str(pin): rate for pin, rate in sorted(self.rates.items())}, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def rate(self, pin):
+        return self.rates.get(pin, DEFAULT_FLOW_RATE)
+
+    def set_rate(self, pin, ml_per_second):
+        if ml_per_second <= 0:
+            raise ValueError(f"Flow rate for GPIO {pin} must be positive")
+        with self._lock:
+            self.rates[pin] = ml_per_second
+            self.version += 1
+
+    def record_measurement(self, pin, seconds, measured_ml):
+        # One timed run of a pump into a measuring jug
+        self.set_rate(pin, measured_ml / seconds)
+        return self.rates[pin]
+
+
+class DoseCompiler:
+    # Turns millilitre recipes into GPIO pin -> seconds, cached per drink and
+    # rebuilt when the calibration or the pin map changes
+    def __init__(self, calibration, pin_map):
+        self.calibration = calibration
+        self.pin_map = pin_map
+        self._cache = {}
+        self._cache_key = None
+
+    def invalidate(self):
+        self._cache.clear()
+
+    def compile(self, drink_name, recipe):
+        key = (self.calibration.version, tuple(sorted(self.pin_map.items())))
+        if key != self._cache_key:
+            self._cache.clear()
+            self._cache_key = key
+        durations = self._cache.get(drink_name)
+        if durations is None:
+            durations = {}
+            for beverage, ml in recipe.items():
+                pin = self.pin_map[beverage]
+                durations[pin] = ml / self.calibration.rate(pin)
+            self._cache[drink_name] = durations
+        return durations
+
+
+def run_calibration(driver, pins, calibration, seconds=10, ask=input):
+    # Run each pump for a fixed time and ask how much it poured
+    driver.setup(pins)
+    try:
+        for pin in pins:
+            ask(f"Place a measuring jug under GPIO {pin} and press Enter")
+            print(f"Running GPIO {pin} for {seconds} s")
+            driver.pump_on(pin)
+            driver.clock.sleep(seconds)
+            driver.pump_off(pin)
+            measured_ml = float(ask(f"Millilitres poured by GPIO {pin}: "))
+            rate = calibration.record_measurement(pin, seconds, measured_ml)
+            print(f"GPIO {pin}: {rate:.2f} ml/s")
+    finally:
+        driver.cleanup()
+    calibration.save()
+
+
+if __name__ == '__main__':
+    from pump_driver import create_driver
+
+    # Same relay pins as motortest.py unless given on the command line
+    motor_pins = [int(pin) for pin in sys.argv[1:]] or [2, 3, 4, 17, 27, 22, 10, 9]
+    run_calibration(create_driver(), motor_pins, FlowCalibration())
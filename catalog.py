@@ -0,0 +1,102 @@
+import json
+from collections import defaultdict
+
+# Recipes, icons and the bottle-to-pump mapping live in catalog.json. An index
+# from each ingredient to the drinks that use it keeps a per-drink count of
+# ingredients that are not loaded, so swapping a bottle only touches the
+# drinks that use it instead of rescanning the whole catalog.
+CATALOG_FILE = 'catalog.json'
+
+
+class Drink:
+    def __init__(self, name, icon, recipe):
+        self.name = name
+        self.icon = icon
+        self.recipe = dict(recipe)  # Beverage -> millilitres
+
+
+class Catalog:
+    def __init__(self, drinks, bottles):
+        self.drinks = {}  # Name -> Drink, in menu order
+        self.bottles = {}  # Loaded beverage -> GPIO pin
+        self._uses = defaultdict(list)  # Beverage -> names of drinks that need it
+        self._missing = {}  # Drink name -> number of its beverages not loaded
+        self._available = set()
+        self._position = {}  # Drink name -> menu position
+        for drink in drinks:
+            self.add_drink(drink)
+        for beverage, pin in bottles.items():
+            self.load_bottle(beverage, pin)
+
+    @classmethod
+    def load(cls, path=CATALOG_FILE):
+        with open(path) as f:
+            data = json.load(f)
+        if not isinstance(data, dict) or not isinstance(data.get('bottles', {}), dict):
+            raise ValueError(f"{path} should hold drinks and a beverage -> GPIO pin map of bottles")
+        drinks = [Drink(entry['name'], entry.get('icon'), entry['recipe']) for entry in data['drinks']]
+        for drink in drinks:
+            if not all(isinstance(ml, (int, float)) and ml > 0 for ml in drink.recipe.values()):
+                raise ValueError(f"Recipe of {drink.name!r} needs positive millilitres")
+        bottles = data.get('bottles', {})
+        if not all(isinstance(pin, int) for pin in bottles.values()):
+            raise ValueError(f"{path}: bottles need whole GPIO pin numbers")
+        return cls(drinks, bottles)
+
+    def add_drink(self, drink):
+        if drink.name in self.drinks:
+            raise ValueError(f"Duplicate drink {drink.name!r} in catalog")
+        self.drinks[drink.name] = drink
+        self._position[drink.name] = len(self._position)
+        for beverage in drink.recipe:
+            self._uses[beverage].append(drink.name)
+        self._missing[drink.name] = sum(1 for beverage in drink.recipe if beverage not in self.bottles)
+        if not self._missing[drink.name]:
+            self._available.add(drink.name)
+
+    def load_bottle(self, beverage, pin):
+        # Put a bottle on a pump, replacing whatever that pump was pouring
+        for loaded, loaded_pin in list(self.bottles.items()):
+            if loaded_pin == pin and loaded != beverage:
+                self.remove_bottle(loaded)
+        if beverage in self.bottles:
+            self.bottles[beverage] = pin
+            return
+        self.bottles[beverage] = pin
+        for name in self._uses.get(beverage, ()):
+            self._missing[name] -= 1
+            if not self._missing[name]:
+                self._available.add(name)
+
+    def remove_bottle(self, beverage):
+        if self.bottles.pop(beverage, None) is None:
+            return
+        for name in self._uses.get(beverage, ()):
+            self._missing[name] += 1
+            self._available.discard(name)
+
+    def is_available(self, drink_name):
+        return drink_name in self._available
+
+    def available_drinks(self):
+        # Makeable drinks in catalog order, without walking the unavailable ones
+        names = sorted(self._available, key=self._position.__getitem__)
+        return [self.drinks[name] for name in names]
+
+    def drinks_using(self, beverage):
+        return [self.drinks[name] for name in self._uses.get(beverage, ())]
+
+
+def diff(old, new):
+    # Names of drinks whose tile or pour differs between two catalogs, and the
+    # pins that now pour a different bottle (or none)
+    drinks = set()
+    for name in old.drinks.keys() | new.drinks.keys():
+        before, after = old.drinks.get(name), new.drinks.get(name)
+        if (before is None or after is None or before.recipe != after.recipe or before.icon != after.icon
+                or old.is_available(name) != new.is_available(name)):
+            drinks.add(name)
+    old_pins = {pin: beverage for beverage, pin in old.bottles.items()}
+    new_pins = {pin: beverage for beverage, pin in new.bottles.items()}
+    pins = {pin for pin in old_pins.keys() | new_pins.keys() if old_pins.get(pin) != new_pins.get(pin)}
+    return drinks, pins
@@ -0,0 +1,316 @@
+from kivy.app import App
+from kivy.uix.screenmanager import Screen
+from kivy.uix.behaviors import ButtonBehavior
+from kivy.uix.image import Image
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
+from kivy.animation import Animation
+from kivy.core.window import Window
+from kivy.graphics import Color, Rectangle
+from kivy.uix.popup import Popup
+from kivy.uix.label import Label
+from kivy.clock import Clock
+from kivy.uix.boxlayout import BoxLayout
+from kivy.uix.button import Button
+from cocktail_core import OrderRefused
+from batch import BatchRun
+from assets import icons, texture
+
+# The screens and popups cm_gui.py does not need for the first frame. The app
+# imports this module when it builds the menu, shortly after boot, so the
+# widget classes only used here load after the screensaver is up.
+
+
+class ImageButton(ButtonBehavior, Image):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.always_release = True
+
+    def on_press(self):
+        self.opacity *= 0.7
+
+    def on_release(self):
+        self.opacity = 1
+
+class DrinkTile(RecycleDataViewBehavior, ImageButton):
+    # One of the few tiles the carousel keeps alive; scrolling rebinds it to
+    # another drink instead of building a new widget. The icon comes from the
+    # icon cache that the carousel prefetches into
+    drink_name = None
+    icon = None
+    select = None
+
+    def refresh_view_attrs(self, rv, index, data):
+        self.opacity = 1
+        result = super().refresh_view_attrs(rv, index, data)
+        self.texture = icons.get(self.icon)
+        return result
+
+    def on_release(self):
+        super().on_release()
+        if self.select:
+            self.select(self.drink_name)
+
+class DrinkCarousel(RecycleView):
+    # Only the visible tiles exist as widgets; icons for the next few tiles
+    # either side are decoded in the background into the icon cache the tiles
+    # draw from, so scrolling them in does not decode on the UI thread. The
+    # cache holds just those, and icons scrolled further away are released
+    lookahead = 2
+
+    def __init__(self, tile_size, on_select, **kwargs):
+        super().__init__(**kwargs)
+        self.tile_size = tile_size
+        self.spacing = 30
+        self.on_select = on_select
+        self.do_scroll_x = True
+        self.do_scroll_y = False
+        self.viewclass = DrinkTile
+
+        self.layout = RecycleBoxLayout(orientation='horizontal', spacing=self.spacing, padding=(30, 100, 30, 30),
+                                       size_hint_x=None, default_size=(tile_size, tile_size),
+                                       default_size_hint=(None, None), default_pos_hint={'top': 1})
+        self.layout.bind(minimum_width=self.layout.setter('width'))
+        self.add_widget(self.layout)
+        self.bind(scroll_x=self.prefetch)
+
+    def set_drinks(self, drinks, pourable=None, changed=None):
+        # Drinks that fail pourable are shown greyed out and ignore taps. When
+        # only the drinks named in changed differ and the menu order is the
+        # same, just their tiles are rebuilt
+        data = []
+        for drink in drinks:
+            enabled = pourable is None or pourable(drink)
+            data.append({'icon': drink.icon, 'drink_name': drink.name, 'select': self.on_select,
+                         'allow_stretch': True, 'disabled': not enabled,
+                         'color': (1, 1, 1, 1) if enabled else (0.35, 0.35, 0.35, 1)})
+        if changed is not None and [entry['drink_name'] for entry in data] == [entry['drink_name'] for entry in self.data]:
+            for index, entry in enumerate(data):
+                if entry['drink_name'] in changed:
+                    self.data[index] = entry
+        else:
+            self.data = data
+        self.prefetch()
+
+    def prefetch(self, *args):
+        stride = self.tile_size + self.spacing
+        offset = max(self.layout.width - self.width, 0) * self.scroll_x
+        first = int(offset // stride)
+        last = first + int(self.width // stride) + 1
+        icons.resize(last - first + 1 + 2 * self.lookahead)
+        for index in range(max(first - self.lookahead, 0), min(last + self.lookahead, len(self.data) - 1) + 1):
+            if index < first or index > last:
+                icons.prefetch(self.data[index]['icon'])
+
+class ConfirmPopup(Popup):
+    def __init__(self, drink_name, on_confirm, on_batch=None, **kwargs):
+        super().__init__(**kwargs)
+        self.size_hint = (0.8, 0.4)
+        self.title = f'Confirm {drink_name}'
+        self.drink_name = drink_name
+        self.on_confirm = on_confirm
+        self.on_batch = on_batch
+
+        content = BoxLayout(orientation='vertical')
+        message = Label(text=f'Prepare {self.drink_name}?')
+        btn_layout = BoxLayout(size_hint_y=None, height='50dp')
+        
+        accept_btn = Button(text='Accept', on_release=self._on_accept)
+        decline_btn = Button(text='Decline', on_release=self.dismiss)
+        
+        btn_layout.add_widget(accept_btn)
+        if on_batch:
+            btn_layout.add_widget(Button(text='Batch', on_release=self._on_batch))
+        btn_layout.add_widget(decline_btn)
+        
+        content.add_widget(message)
+        content.add_widget(btn_layout)
+        
+        self.content = content
+
+    def _on_accept(self, instance):
+        self.dismiss()
+        self.on_confirm()
+
+    def _on_batch(self, instance):
+        self.dismiss()
+        BatchPopup(self.drink_name, self.on_batch).open()
+
+class BatchPopup(Popup):
+    # Pick how many of the same drink to pour in a row
+    def __init__(self, drink_name, on_start, count=12, **kwargs):
+        super().__init__(**kwargs)
+        self.size_hint = (0.8, 0.5)
+        self.title = f'Batch of {drink_name}'
+        self.on_start = on_start
+        self.count = count
+
+        content = BoxLayout(orientation='vertical')
+        counter = BoxLayout()
+        self.count_label = Label(text=str(count))
+        counter.add_widget(Button(text='-', on_release=lambda btn: self._change(-1)))
+        counter.add_widget(self.count_label)
+        counter.add_widget(Button(text='+', on_release=lambda btn: self._change(1)))
+        btn_layout = BoxLayout(size_hint_y=None, height='50dp')
+        btn_layout.add_widget(Button(text='Start', on_release=self._on_start))
+        btn_layout.add_widget(Button(text='Cancel', on_release=self.dismiss))
+        content.add_widget(counter)
+        content.add_widget(btn_layout)
+        self.content = content
+
+    def _change(self, step):
+        self.count = max(1, self.count + step)
+        self.count_label.text = str(self.count)
+
+    def _on_start(self, instance):
+        self.dismiss()
+        self.on_start(self.count)
+
+class CupSwapPopup(Popup):
+    # The only stop between pours of a batch
+    def __init__(self, batch, **kwargs):
+        super().__init__(**kwargs)
+        self.size_hint = (0.8, 0.4)
+        self.auto_dismiss = False
+        self.title = f'{batch.poured} of {batch.count} {batch.drink_name} poured'
+        self.batch = batch
+
+        content = BoxLayout(orientation='vertical')
+        content.add_widget(Label(text=f'Put a fresh cup in ({batch.drinks_per_minute():.1f} drinks/min)'))
+        btn_layout = BoxLayout(size_hint_y=None, height='50dp')
+        btn_layout.add_widget(Button(text='Next cup', on_release=self._on_next))
+        btn_layout.add_widget(Button(text='Stop', on_release=self._on_stop))
+        content.add_widget(btn_layout)
+        self.content = content
+
+    def _on_next(self, instance):
+        self.dismiss()
+        self.batch.cup_ready()
+
+    def _on_stop(self, instance):
+        self.dismiss()
+        self.batch.cancel()
+
+class DrinkSelectionScreen(Screen):
+    def __init__(self, cocktail_maker, **kwargs):
+        super().__init__(**kwargs)
+        self.cocktail_maker = cocktail_maker
+        # Load the background image
+        with self.canvas.before:
+            self.bg = Rectangle(texture=texture('drinkbg.png'), size=Window.size)   
+
+        self.carousel = DrinkCarousel(Window.width / 2.5, self.select_drink,
+                                      size_hint=(None, None), size=(Window.width, Window.height))
+        self.add_widget(self.carousel)
+        self.refresh_menu()
+
+    def refresh_menu(self, changed=None):
+        # Only drinks whose bottles are all loaded are shown; the catalog keeps
+        # that list up to date as bottles are swapped. Drinks a bottle is too
+        # low to finish, dry lines included, are greyed out. The catalog is
+        # looked up each time, as an edited catalog.json replaces it
+        self.carousel.set_drinks(self.cocktail_maker.catalog.available_drinks(),
+                                 pourable=lambda drink: self.cocktail_maker.can_make(drink.name), changed=changed)
+
+    def on_enter(self, *args):
+        super(DrinkSelectionScreen, self).on_enter(*args)
+        # Reset the inactivity timer every time the drink selection screen is entered
+        App.get_running_app().reset_inactivity_timer()
+    
+
+    def on_touch_down(self, touch):
+        App.get_running_app().reset_inactivity_timer()
+        return super().on_touch_down(touch)
+    
+
+    def select_drink(self, drink_name):
+        touched_at = self.cocktail_maker.telemetry.now()
+
+        def on_confirm():
+            self.prepare_drink(drink_name, touched_at)
+
+        def on_batch(count):
+            self.start_batch(drink_name, count)
+
+        # Show confirmation popup
+        popup = ConfirmPopup(drink_name, on_confirm, on_batch)
+        popup.open()
+
+    def start_batch(self, drink_name, count):
+        # Pour count drinks in a row, asking only for a cup swap between them
+        app = App.get_running_app()
+
+        def on_finished(batch):
+            def finish(dt):
+                app.batch_run = None
+                self.refresh_menu()
+                app.reset_inactivity_timer()
+                if batch.error:
+                    print(batch.error)
+                print(f"Batch of {batch.poured} {drink_name} at {batch.drinks_per_minute():.2f} drinks/minute")
+            Clock.schedule_once(finish, 0)
+
+        app.batch_run = BatchRun(self.cocktail_maker, drink_name, count,
+                                 on_cup_needed=lambda batch: Clock.schedule_once(lambda dt: CupSwapPopup(batch).open(), 0),
+                                 on_progress=lambda batch, order: app.on_order_started(order),
+                                 on_finished=on_finished)
+        app.batch_run.start()
+
+    def prepare_drink(self, drink_name, touched_at=None):
+        try:
+            order = self.cocktail_maker.order(drink_name, on_start=self.on_drink_started,
+                                              on_done=self.on_drink_poured, touched_at=touched_at,
+                                              on_failed=self.on_drink_failed)
+        except OrderRefused as error:
+            print(error)
+            return
+        print(f"Queued {drink_name} (#{order.order_id}), {self.cocktail_maker.scheduler.queue_depth} waiting")
+
+    def on_drink_started(self, order):
+        App.get_running_app().on_order_started(order)
+
+    def on_drink_failed(self, order):
+        print(f"{order.name} was not poured: {order.error}")
+
+    def on_drink_poured(self, order):
+        # Called from the dispense thread once the last motor is off; the app
+        # refreshes the menu for every change to the bottle levels
+        job = order.job
+        worst = max(job.stop_jitter.values()) * 1000
+        print(f"Poured {order.name} after waiting {order.wait_time:.1f} s: "
+              f"makespan {job.makespan:.1f} s (planned {job.planned_makespan:.1f} s), worst stop jitter {worst:.2f} ms")
+
+    
+
+
+class LoadingScreen(Screen):
+    def __init__(self, **kwargs):
+        super(LoadingScreen, self).__init__(**kwargs)
+        with self.canvas.before:
+            # Setup the loading bar with explicit dimensions and position
+            self.color_instruction = Color(0, 1, 0, 1)  # Green for the loading bar
+            # Adjust the position and size below as needed for your 5-inch display
+            self.loading_bar_position = (150, 130)  # Example position
+            self.loading_bar_height = 100  # Example height
+            self.loading_bar_width = Window.width - 295  # Example width, adjust as needed
+            self.loading_bar = Rectangle(pos=self.loading_bar_position, size=(0, self.loading_bar_height))
+            
+            # Background image
+            Color(1, 1, 1, 1)
+            self.bg = Rectangle(texture=texture('loading.png'), size=Window.size, pos=self.pos)
+
+    def start_loading_animation(self, duration):
+        # Start with a width of 0 and animate to the full width
+        self.loading_bar.size = (0, self.loading_bar_height)
+        anim = Animation(size=(self.loading_bar_width, self.loading_bar_height), duration=(duration))
+        anim.start(self.loading_bar)
+
+    def on_leave(self, *args):
+        Animation.cancel_all(self.loading_bar)
+
+    def update_bg(self, *args):
+        # Keep the background image fitting the screen
+        self.bg.size = self.size
+        self.bg.pos = self.pos
+        # The loading bar's position and size are fixed, so no need to update them here
@@ -0,0 +1,161 @@
+import argparse
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from batch import BatchRun
+from cocktail_core import CocktailMaker, OrderRefused, simulated_maker
+
+# Command line access to the dispense core without loading Kivy:
+#   python cocktail.py pour "Rum & Coke"
+#   python cocktail.py batch "Rum & Coke" 12
+#   python cocktail.py prime [9 27] [--seconds 5]
+#   python cocktail.py purge 9
+#   python cocktail.py bench --orders 1000
+
+
+def wait_for(maker, submit):
+    done = threading.Event()
+    order = submit(lambda order: done.set())
+    while not done.wait(0.5):
+        if maker.engine.failed is not None:
+            raise OrderRefused(f"The pumps were stopped after a driver error: {maker.engine.failed}")
+    return order
+
+
+def pour(args):
+    maker = CocktailMaker(max_active=args.max_active)
+    try:
+        order = wait_for(maker, lambda on_done: maker.order(args.drink, on_done=on_done))
+        print(f"Poured {args.drink} in {order.job.makespan:.1f} s")
+        latency = maker.engine.latency_report()
+        if latency:
+            print(f"Multi-pin relay switches took at most {latency['max_ms']:.3f} ms per call")
+    except OrderRefused as error:
+        print(error)
+        return 1
+    finally:
+        maker.shutdown()
+    return 0
+
+
+def batch(args):
+    maker = CocktailMaker(max_active=args.max_active)
+    cup_needed = threading.Event()
+    finished = threading.Event()
+    run = BatchRun(maker, args.drink, args.count, on_cup_needed=lambda run: cup_needed.set(),
+                   on_finished=lambda run: finished.set(), cup_swap_time=args.swap_time)
+    if not run.enough_for_all():
+        print(f"Warning: the bottles will run out before {args.count} {args.drink}")
+    try:
+        run.start()
+        while not finished.is_set():
+            if cup_needed.wait(0.1):
+                cup_needed.clear()
+                input(f"{run.poured} of {run.count} poured, put a fresh cup in and press Enter")
+                run.cup_ready()
+    except KeyboardInterrupt:
+        run.cancel()
+        finished.wait()
+    finally:
+        maker.shutdown()
+    if run.error:
+        print(run.error)
+    print(f"Poured {run.poured} {args.drink} at {run.drinks_per_minute():.2f} drinks/minute")
+    return 0 if run.poured == args.count else 1
+
+
+def prime(args):
+    maker = CocktailMaker(max_active=args.max_active)
+    try:
+        pins = args.pins or sorted(maker.catalog.bottles.values())
+        if args.seconds is not None:
+            wait_for(maker, lambda on_done: maker.prime(pins, args.seconds, on_done=on_done))
+        else:
+            if args.force:
+                maker.lines.mark_dry(pins)
+            pins = maker.lines.dry_pins(pins)
+            if not pins:
+                print("Every line is already primed, use --force to prime again")
+                return 0
+            order = wait_for(maker, lambda on_done: maker.prime_all(pins, on_done=on_done))
+            print(f"Filled the lines in {order.job.makespan:.1f} s")
+        print(f"Primed GPIO {', '.join(str(pin) for pin in pins)}")
+    except OrderRefused as error:
+        print(error)
+        return 1
+    finally:
+        maker.shutdown()
+    return 0
+
+
+def purge(args):
+    maker = CocktailMaker(max_active=args.max_active)
+    try:
+        wait_for(maker, lambda on_done: maker.purge(args.pins, on_done=on_done))
+        print(f"Purged GPIO {', '.join(str(pin) for pin in args.pins)}")
+    except OrderRefused as error:
+        print(error)
+        return 1
+    finally:
+        maker.shutdown()
+    return 0
+
+
+def bench(args):
+    # Simulated pumps on a virtual clock; state files go to a scratch directory
+    maker = simulated_maker(tempfile.mkdtemp(prefix='cocktail-bench-'), max_active=args.max_active)
+    menu = [drink.name for drink in maker.catalog.available_drinks()]
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    for _ in range(args.orders):
+        maker.order(rng.choice(menu))
+    maker.run_until_idle()
+    elapsed = time.perf_counter() - started
+    stats = maker.scheduler.stats()
+    simulated = maker.clock.now()
+    maker.shutdown()
+    print(f"{args.orders} orders in {simulated / 3600:.2f} simulated hours "
+          f"({args.orders / simulated * 3600:.1f} drinks/hour), mean wait {stats['mean_wait']:.0f} s, "
+          f"{elapsed:.3f} s wall time")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Automated cocktail maker without the touchscreen")
+    parser.add_argument('--max-active', type=int, default=4, help="Relays allowed on at once")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    pour_parser = commands.add_parser('pour', help="Pour one drink from the catalog")
+    pour_parser.add_argument('drink')
+    pour_parser.set_defaults(run=pour)
+
+    batch_parser = commands.add_parser('batch', help="Pour the same drink several times")
+    batch_parser.add_argument('drink')
+    batch_parser.add_argument('count', type=int)
+    batch_parser.add_argument('--swap-time', type=float, help="Seconds to swap cups instead of pressing Enter")
+    batch_parser.set_defaults(run=batch)
+
+    prime_parser = commands.add_parser('prime', help="Fill the dry lines, all of them at once")
+    prime_parser.add_argument('pins', nargs='*', type=int)
+    prime_parser.add_argument('--seconds', type=float, help="Run each pump this long instead")
+    prime_parser.add_argument('--force', action='store_true', help="Prime lines marked as wet as well")
+    prime_parser.set_defaults(run=prime)
+
+    purge_parser = commands.add_parser('purge', help="Empty lines whose bottles were removed")
+    purge_parser.add_argument('pins', nargs='+', type=int)
+    purge_parser.set_defaults(run=purge)
+
+    bench_parser = commands.add_parser('bench', help="Pour random orders on simulated pumps")
+    bench_parser.add_argument('--orders', type=int, default=1000)
+    bench_parser.add_argument('--seed', type=int, default=1)
+    bench_parser.set_defaults(run=bench)
+
+    args = parser.parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
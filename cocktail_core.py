@@ -0,0 +1,267 @@
+import os
+import threading
+import time
+
+from calibration import DoseCompiler, FlowCalibration
+from catalog import Catalog, diff
+from dispense import DispenseEngine
+from inventory import Inventory
+from order_history import OrderHistory
+from order_queue import OrderScheduler
+from pour_plan import plan_pours
+from priming import LineState
+from pump_driver import SimulatedPumpDriver, VirtualClock, create_driver
+from telemetry import Telemetry
+import telemetry
+
+# Everything needed to take an order and pour it, with no Kivy anywhere in the
+# import chain. The GUI, the command line tool and the simulations all drive
+# the machine through CocktailMaker.
+
+
+class OrderRefused(Exception):
+    pass
+
+
+class CocktailMaker:
+    def __init__(self, driver=None, catalog=None, calibration=None, inventory=None, telemetry_log=None,
+                 lines=None, history=None, max_active=None, threaded=True):
+        # Relays are set up here rather than at import time; pass a
+        # SimulatedPumpDriver to run away from the Pi
+        self.catalog = catalog or Catalog.load()
+        self.driver = driver or create_driver()
+        self.driver.setup(self.catalog.bottles.values())
+        self._setup_pins = set(self.catalog.bottles.values())  # Pins the driver has configured as outputs
+        self.telemetry = telemetry_log or Telemetry(self.driver.clock)
+        self.engine = DispenseEngine(self.driver, max_active=max_active)
+        self.engine.telemetry = self.telemetry
+        self.scheduler = OrderScheduler(self.engine)
+        self.compiler = DoseCompiler(calibration or FlowCalibration(), self.catalog.bottles)
+        self.inventory = inventory or Inventory()
+        self.lines = lines or LineState()
+        self.history = history or OrderHistory()
+        self.on_inventory_change = None  # Called after each reservation, deduction or release, from any thread
+        self._config_lock = threading.RLock()  # Held while an order is compiled or the catalog replaced
+        self.threaded = threaded
+        if threaded:
+            self.engine.start()
+
+    @property
+    def clock(self):
+        return self.driver.clock
+
+    @property
+    def calibration(self):
+        return self.compiler.calibration
+
+    def can_make(self, drink_name):
+        # Checked against what the order would really take, so a dry line's
+        # dead volume counts too
+        with self._config_lock:
+            drink = self.catalog.drinks.get(drink_name)
+            if drink is None or not self.catalog.is_available(drink_name):
+                return False
+            return self.inventory.can_pour(self._doses(drink)[2])
+
+    def _doses(self, drink):
+        # Pump seconds per pin, the dry-line part of them, and millilitres
+        # used per beverage. A dry line first has to fill its tubing; that
+        # comes out of the bottle too
+        durations = self.compiler.compile(drink.name, drink.recipe)
+        compensation = self.lines.compensation(durations, self.calibration)
+        used = dict(drink.recipe)
+        if compensation:
+            durations = {pin: seconds + compensation.get(pin, 0.0) for pin, seconds in durations.items()}
+            for beverage in drink.recipe:
+                pin = self.catalog.bottles[beverage]
+                if pin in compensation:
+                    used[beverage] += self.lines.dead_volume(pin)
+        return durations, compensation, used
+
+    def state(self):
+        # What a fleet coordinator needs to route orders here: bottles, levels,
+        # the queue, when each pump frees up and how long each drink takes
+        drinks = {}
+        for drink in self.catalog.available_drinks():
+            durations, _, used = self._doses(drink)
+            if self.inventory.can_pour(used):
+                drinks[drink.name] = {'pins': sorted(durations),
+                                      'seconds': plan_pours(durations, self.engine.max_active).makespan}
+        return {
+            'bottles': dict(self.catalog.bottles),
+            'levels': dict(self.inventory.levels),
+            'queue_depth': self.scheduler.queue_depth,
+            'pouring': len(self.scheduler.active),
+            'waiting': self.scheduler.waiting_ids(),
+            'pins_free_in': {str(pin): seconds for pin, seconds in self.scheduler.pins_free_in().items()},
+            'drinks': drinks,
+        }
+
+    def _setup(self, pins):
+        # Lines can be primed or purged on pumps with no bottle in the
+        # catalog. Setting a pin up drives its relay off, so pins already in
+        # use are left alone
+        new = [pin for pin in pins if pin not in self._setup_pins]
+        if new:
+            self.driver.setup(new)
+            self._setup_pins.update(new)
+
+    def _inventory_changed(self):
+        if self.on_inventory_change:
+            self.on_inventory_change()
+
+    def _check_pumps(self):
+        if self.engine.failed is not None:
+            raise OrderRefused(f"The pumps were stopped after a driver error: {self.engine.failed}")
+
+    def order(self, drink_name, on_start=None, on_done=None, touched_at=None, on_failed=None):
+        confirmed_at = self.telemetry.now()
+        ordered_at = time.time()
+        self._check_pumps()
+        # The catalog can be replaced between orders but not while one is compiled
+        with self._config_lock:
+            drink = self.catalog.drinks.get(drink_name)
+            if drink is None or not self.catalog.is_available(drink_name):
+                raise OrderRefused(f"{drink_name} is not on the menu")
+            durations, compensation, used = self._doses(drink)
+            if not self.inventory.reserve(used):
+                raise OrderRefused(f"Not enough left for {drink_name}")
+
+            def finished(order):
+                self.inventory.deduct(used, reserved=used)
+                self.history.record(drink_name, at=ordered_at)  # When it was asked for, for replays
+                self._inventory_changed()
+                if on_done:
+                    on_done(order)
+
+            def failed(order):
+                # The pumps were stopped before it was poured
+                self.inventory.release(used)
+                self._inventory_changed()
+                if on_failed:
+                    on_failed(order)
+
+            # The order queue starts the pumps as soon as they are free; pours that
+            # share no ingredients with the drink in progress run alongside it.
+            # Any later pour on these pins runs after this one, so they count as wet
+            try:
+                order = self.scheduler.submit(drink_name, durations, on_start=on_start, on_done=finished,
+                                              on_failed=failed)
+            except Exception:
+                self.inventory.release(used)
+                raise
+            order.reserved = used
+            self._inventory_changed()
+            self.lines.mark_wet(compensation)
+            if touched_at is not None:
+                self.telemetry.record(telemetry.TOUCH, order.order_id, at=touched_at)
+            self.telemetry.record(telemetry.CONFIRM, order.order_id, at=confirmed_at)
+            return order
+
+    def cancel(self, order):
+        # Withdraw an order that has not started pouring and give back the
+        # millilitres it was holding. False once it is pouring
+        if not self.scheduler.cancel(order):
+            return False
+        self.inventory.release(order.reserved)
+        self._inventory_changed()
+        return True
+
+    def swap_bottle(self, beverage, pin, ml=None):
+        # A freshly loaded bottle starts with an empty line. Setting the pin up
+        # switches its relay off, and a queued order would pour the new
+        # bottle, so pumps that are pouring or wanted are refused
+        with self._config_lock:
+            busy = self.scheduler.pins_in_use() & {pin, self.catalog.bottles.get(beverage)}
+            if busy:
+                raise OrderRefused(f"GPIO {min(busy)} is pouring or has orders waiting; swap the bottle after them")
+            self.driver.setup([pin])
+            self._setup_pins.add(pin)
+            self.catalog.load_bottle(beverage, pin)
+            self.lines.mark_dry([pin])
+        if ml is not None:
+            self.inventory.set_level(beverage, ml)
+
+    def replace_catalog(self, catalog):
+        # Switch to an edited catalog between two orders. Orders already queued
+        # or pouring keep the pump times they were compiled with; new ones use
+        # the new recipes. Moving bottles between pumps waits until nothing is
+        # pouring, since a queued order's pins would otherwise mean something
+        # else. Returns the changed drink names and pins, or None to try later
+        with self._config_lock:
+            drinks, pins = diff(self.catalog, catalog)
+            if pins and not self.scheduler.idle():
+                return None
+            self._setup(catalog.bottles.values())
+            self.lines.mark_dry([pin for pin in pins if pin in catalog.bottles.values()])
+            self.compiler = DoseCompiler(self.calibration, catalog.bottles)
+            self.catalog = catalog
+        return drinks, pins
+
+    def prime(self, pins, seconds, on_done=None):
+        # Run pumps for a fixed time, e.g. to rinse the lines
+        self._check_pumps()
+        self._setup(pins)
+        order = self.scheduler.submit('prime', {pin: seconds for pin in pins}, on_done=on_done)
+        self.lines.mark_wet(pins)
+        return order
+
+    def prime_all(self, pins=None, on_done=None):
+        # Fill every dry line in one go; the pour planner staggers the pumps
+        # under the power limit. Returns None when every line is already wet
+        self._check_pumps()
+        pins = self.lines.dry_pins(sorted(pins or self.catalog.bottles.values()))
+        if not pins:
+            return None
+        self._setup(pins)
+        beverages = {pin: beverage for beverage, pin in self.catalog.bottles.items()}
+        used = {beverages[pin]: self.lines.dead_volume(pin) for pin in pins if pin in beverages}
+
+        def finished(order):
+            self.inventory.deduct(used)
+            if on_done:
+                on_done(order)
+
+        order = self.scheduler.submit('prime', self.lines.fill_times(pins, self.calibration), on_done=finished)
+        self.lines.mark_wet(pins)
+        return order
+
+    def purge(self, pins, on_done=None):
+        # Run the lines with their bottles removed to push out what is left
+        self._check_pumps()
+        self._setup(pins)
+        order = self.scheduler.submit('purge', self.lines.fill_times(pins, self.calibration), on_done=on_done)
+        self.lines.mark_dry(pins)
+        return order
+
+    def run_until_idle(self):
+        # Only for unthreaded use, typically on a VirtualClock
+        self.engine.run_until_idle()
+
+    def shutdown(self):
+        # Leave every relay released
+        self.engine.shutdown()
+        self.driver.cleanup()
+        self.telemetry.flush()
+        self.inventory.close()
+        self.history.close()
+
+
+def simulated_maker(scratch, catalog=None, calibration=None, levels=None, max_active=None, clock=None):
+    # Simulated pumps with every state file in the scratch directory;
+    # benchmarks and simulations start from here. On the default virtual
+    # clock the engine is unthreaded and played back with run_until_idle;
+    # pass a MonotonicClock for a unit that pours in real time.
+    # levels seeds the bottle levels, e.g. from the real inventory
+    clock = clock or VirtualClock()
+    driver = SimulatedPumpDriver(clock)
+    inventory = Inventory(os.path.join(scratch, 'inventory.json'), os.path.join(scratch, 'inventory.log'))
+    for beverage, ml in (levels or {}).items():
+        inventory.set_level(beverage, ml)
+    return CocktailMaker(driver=driver, catalog=catalog,
+                         calibration=calibration or FlowCalibration(os.path.join(scratch, 'calibration.json')),
+                         inventory=inventory,
+                         telemetry_log=Telemetry(driver.clock, path=os.path.join(scratch, 'telemetry.bin')),
+                         lines=LineState(os.path.join(scratch, 'lines.json')),
+                         history=OrderHistory(os.path.join(scratch, 'orders.log')),
+                         max_active=max_active, threaded=not isinstance(clock, VirtualClock))
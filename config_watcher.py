@@ -0,0 +1,77 @@
+import os
+
+from calibration import CALIBRATION_FILE
+from catalog import CATALOG_FILE, Catalog
+
+# Picks up edits to catalog.json and calibration.json while the machine is
+# running. Nothing is restarted: a new calibration is read in place and the
+# next order compiles its pump times from it, and a new catalog is swapped in
+# between two orders by CocktailMaker.replace_catalog. An edit that moves
+# bottles to other pumps is held until nothing is pouring. A file that does
+# not parse (say, half saved) or holds the wrong shape is ignored until it
+# changes again, and what was loaded before stays in use.
+#
+# The files are the source of truth: a bottle swapped from the UI since the
+# catalog was loaded is undone by the next edit to catalog.json.
+
+
+class ConfigWatcher:
+    poll_interval = 1.0  # Seconds between checks when driven from a timer
+
+    def __init__(self, cocktail_maker, catalog_path=CATALOG_FILE, calibration_path=CALIBRATION_FILE,
+                 on_change=None):
+        self.cocktail_maker = cocktail_maker
+        self.catalog_path = catalog_path
+        self.calibration_path = calibration_path
+        self.on_change = on_change  # Called with the changed drink names and pins once applied
+        self.pending = None  # Parsed catalog waiting for the pumps to go idle
+        self.error = None  # Why the last edit was not applied
+        self._seen = {path: self._stamp(path) for path in (catalog_path, calibration_path)}
+
+    @staticmethod
+    def _stamp(path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _changed(self, path):
+        stamp = self._stamp(path)
+        if stamp == self._seen[path]:
+            return False
+        self._seen[path] = stamp
+        return stamp is not None
+
+    def poll(self):
+        # Cheap when nothing changed: two stat calls
+        if self._changed(self.calibration_path):
+            try:
+                self.cocktail_maker.calibration.load()
+                self.error = None
+            except (OSError, ValueError) as error:
+                self._failed(self.calibration_path, error)
+        if self._changed(self.catalog_path):
+            try:
+                self.pending = Catalog.load(self.catalog_path)
+                self.error = None
+            except (OSError, ValueError, KeyError, TypeError) as error:
+                self._failed(self.catalog_path, error)
+        if self.pending is not None:
+            self._apply()
+
+    def _failed(self, path, error):
+        self.error = f"Ignoring {path}: {error}"
+        print(self.error)
+
+    def _apply(self):
+        changes = self.cocktail_maker.replace_catalog(self.pending)
+        if changes is None:
+            return
+        self.pending = None
+        drinks, pins = changes
+        if drinks or pins:
+            print(f"Reloaded {self.catalog_path}: {len(drinks)} drinks and {len(pins)} pumps changed")
+        if self.on_change:
+            self.on_change(drinks, pins)
+
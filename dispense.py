@@ -0,0 +1,259 @@
+import heapq
+import itertools
+import threading
+import traceback
+from collections import defaultdict, deque
+
+import telemetry
+
+# Pumps are switched from a dedicated thread that sleeps on monotonic
+# deadlines, so pour lengths do not depend on the Kivy frame loop.
+PUMP_ON = 'on'
+PUMP_OFF = 'off'
+CALL = 'call'
+
+
+class DispenseJob:
+    def __init__(self, durations, on_done=None, offsets=None, tag=0, on_failed=None):
+        self.tag = tag  # Order id recorded with the telemetry events
+        self.durations = dict(durations)  # GPIO pin -> seconds on
+        self.offsets = dict(offsets or {})  # GPIO pin -> planned start after submit
+        self.on_done = on_done
+        self.on_failed = on_failed  # Called instead of on_done when the driver fails mid-pour
+        self.error = None  # The driver error that stopped this job
+        self.started_at = None
+        self.finished_at = None
+        self.remaining = set(self.durations)
+        self.stop_jitter = {}  # GPIO pin -> seconds between scheduled and actual off
+
+    @property
+    def done(self):
+        return not self.remaining
+
+    @property
+    def planned_makespan(self):
+        return max((self.offsets.get(pin, 0.0) + duration for pin, duration in self.durations.items()), default=0.0)
+
+    @property
+    def makespan(self):
+        if self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+
+class DispenseEngine:
+    jitter_history = 1000  # Stop jitter samples kept per pin
+
+    def __init__(self, driver, max_active=None):
+        self.driver = driver
+        self.clock = driver.clock
+        self.max_active = max_active  # Cap on relays switched on at once, None for no cap
+        self._active = set()
+        self._deferred = deque()  # Starts held back by the cap, first come first served
+        self._jobs = set()  # Dispensed and not finished yet
+        self._events = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self.stop_jitter = defaultdict(lambda: deque(maxlen=self.jitter_history))
+        self.switch_latency = deque(maxlen=self.jitter_history)  # Seconds spent in each multi-pin driver.switch call
+        self.telemetry = None  # Optional telemetry.Telemetry recording every relay edge
+        self.failed = None  # The driver error that stopped the engine, if any
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='dispense-engine', daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        # Never leave a pump running behind us
+        if self._active:
+            self.driver.switch(off=sorted(self._active))
+        self._active.clear()
+        self._deferred.clear()
+        self._events.clear()
+        self._jobs.clear()
+
+    def dispense(self, durations, on_done=None, offsets=None, tag=0, on_failed=None):
+        # Switch each pin on at its planned offset (now by default); pins with
+        # the same offset start together and the off deadline is set from the
+        # moment the relays actually close
+        job = DispenseJob(durations, on_done, offsets, tag, on_failed)
+        with self._cond:
+            now = self.clock.now()
+            job.started_at = now
+            self._jobs.add(job)
+            for pin in job.durations:
+                self._push(now + job.offsets.get(pin, 0.0), PUMP_ON, pin, job)
+            self._cond.notify()
+        return job
+
+    def call_later(self, delay, callback):
+        # Run callback on the timing thread after delay seconds of engine time,
+        # so it also plays back instantly on a VirtualClock
+        with self._cond:
+            self._push(self.clock.now() + delay, CALL, None, callback)
+            self._cond.notify()
+
+    def _push(self, deadline, action, pin, job):
+        heapq.heappush(self._events, (deadline, next(self._seq), action, pin, job))
+
+    def _pop_due(self, now):
+        due = []
+        with self._cond:
+            while self._events and self._events[0][0] <= now:
+                due.append(heapq.heappop(self._events))
+        return due
+
+    def _fire(self, events):
+        # Everything due at this instant goes out in one driver call, so the
+        # pins of a recipe open and close together rather than one by one
+        stops = []
+        calls = []
+        starting = list(self._deferred)
+        self._deferred.clear()
+        for deadline, _, action, pin, job in events:
+            if action == PUMP_OFF:
+                stops.append((deadline, pin, job))
+                self._active.discard(pin)
+            elif action == PUMP_ON:
+                starting.append((pin, job))
+            else:
+                calls.append(job)
+        if self.max_active:
+            # Over the power budget: the rest wait for the next pump to stop
+            room = max(self.max_active - len(self._active), 0)
+            self._deferred.extend(starting[room:])
+            starting = starting[:room]
+
+        if stops or starting:
+            try:
+                latency = self.driver.switch(on=[pin for pin, _ in starting], off=[pin for _, pin, _ in stops])
+            except Exception as error:
+                self._driver_failed(error, [pin for pin, _ in starting] + [pin for _, pin, _ in stops])
+                return
+            if len(stops) + len(starting) > 1:
+                self.switch_latency.append(latency)
+        now = self.clock.now()
+
+        # Off deadlines run from the moment the relays actually closed
+        with self._cond:
+            for pin, job in starting:
+                self._push(now + job.durations[pin], PUMP_OFF, pin, job)
+        finished = []
+        for pin, job in starting:
+            self._active.add(pin)
+            if self.telemetry:
+                self.telemetry.record(telemetry.PUMP_ON, job.tag, pin)
+        for deadline, pin, job in stops:
+            if self.telemetry:
+                self.telemetry.record(telemetry.PUMP_OFF, job.tag, pin)
+            jitter = now - deadline
+            job.stop_jitter[pin] = jitter
+            self.stop_jitter[pin].append(jitter)
+            job.remaining.discard(pin)
+            if job.done:
+                job.finished_at = now
+                finished.append(job)
+                if self.telemetry:
+                    self.telemetry.record(telemetry.DONE, job.tag)
+        if finished:
+            with self._cond:
+                self._jobs.difference_update(finished)
+        # A failing callback is logged; the pumps of every other pour still
+        # have to stop on time
+        for callback in calls:
+            self._run_callback(callback)
+        for job in finished:
+            if job.on_done:
+                self._run_callback(job.on_done, job)
+
+    def _run_callback(self, callback, *args):
+        try:
+            callback(*args)
+        except Exception:
+            print("Dispense callback failed:")
+            traceback.print_exc()
+
+    def _driver_failed(self, error, pins):
+        # The relays are in an unknown state: release every pin we may have
+        # touched, one at a time, and stop pouring altogether. Every job that
+        # has not finished fails, so its owner can give back what it held
+        print(f"Pump driver failed, stopping every pump: {error!r}")
+        self.failed = error
+        for pin in sorted(self._active | set(pins)):
+            try:
+                self.driver.pump_off(pin)
+            except Exception as off_error:
+                print(f"Could not switch off GPIO {pin}: {off_error!r}")
+        self._active.clear()
+        self._deferred.clear()
+        with self._cond:
+            self._events.clear()
+            self._running = False
+            self._cond.notify()
+            jobs = sorted(self._jobs, key=lambda job: job.started_at)
+            self._jobs.clear()
+        for job in jobs:
+            job.error = error
+            if job.on_failed:
+                self._run_callback(job.on_failed, job)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._events:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                deadline = self._events[0][0]
+                spin_time = getattr(self.clock, 'spin_time', 0)
+                if deadline - self.clock.now() > spin_time:
+                    # Coarse wait; a new, earlier event wakes us up again
+                    self.clock.wait(self._cond, deadline - spin_time)
+                    continue
+            self.clock.sleep_until(deadline)
+            self._fire(self._pop_due(self.clock.now()))
+
+    def run_until_idle(self):
+        # Process every pending event inline; with a VirtualClock this plays a
+        # whole pour back instantly, which is what simulations and load tests use
+        while True:
+            with self._cond:
+                if not self._events:
+                    return
+                deadline = self._events[0][0]
+            self.clock.sleep_until(deadline)
+            self._fire(self._pop_due(self.clock.now()))
+
+    def latency_report(self):
+        # Time taken by the driver calls that switch several pins, in
+        # milliseconds. The edges of one call land within it, so a pin's pour
+        # is off by at most this much, which matters most in short pours
+        samples = list(self.switch_latency)
+        if not samples:
+            return None
+        return {
+            'count': len(samples),
+            'mean_ms': sum(samples) / len(samples) * 1000,
+            'max_ms': max(samples) * 1000,
+        }
+
+    def jitter_report(self):
+        # Per-pin stop jitter in milliseconds
+        report = {}
+        for pin, samples in self.stop_jitter.items():
+            if samples:
+                report[pin] = {
+                    'count': len(samples),
+                    'mean_ms': sum(samples) / len(samples) * 1000,
+                    'max_ms': max(samples) * 1000,
+                }
+        return report
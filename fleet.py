@@ -0,0 +1,368 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+
+from order_server import MAX_HEADER_BYTES, BadRequest, parse_order, read_body, read_request, respond
+
+# Runs a venue with several machines as one. The coordinator polls every
+# unit's order server for its bottles, levels and when each of its pumps
+# frees up, and sends each order to the unit that would finish it soonest.
+# Between polls it books the orders it sent itself, so a burst of orders
+# spreads out instead of piling onto whichever unit looked idle last.
+#
+# A unit that stops answering is taken out of rotation, and its orders that
+# had not started pouring are placed again elsewhere. When it comes back those
+# orders are withdrawn from it, so nobody gets their drink twice.
+#
+# Phones talk to the coordinator with the same API as a single machine:
+#   GET  /menu, POST /orders {"drink": ...}, GET /orders/<id>
+#   GET  /units         what the coordinator knows about each unit
+#
+#   python fleet.py --unit bar1=192.168.1.20:8080 --unit bar2=192.168.1.21:8080
+#   python fleet.py --simulate 3   (simulated units on Unix sockets, for testing)
+
+
+class UnitUnavailable(Exception):
+    pass
+
+
+class Unit:
+    def __init__(self, name, address):
+        self.name = name
+        self.address = address  # 'host:port' or 'unix:/path/to/socket'
+        self.alive = False
+        self.state = None  # Last /state reply
+        self.polled_at = None
+        self.pins_free_in = {}  # GPIO pin -> seconds after polled_at, including orders booked since
+        self.rerouted = set()  # Order ids here whose drinks went elsewhere while it was unreachable
+
+    async def request(self, method, path, payload=None, timeout=2.0):
+        # (status code, decoded JSON body); UnitUnavailable when it cannot be reached
+        try:
+            return await asyncio.wait_for(self._request(method, path, payload), timeout)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                ValueError) as error:
+            raise UnitUnavailable(f"{self.name}: {str(error) or type(error).__name__}") from error
+
+    async def _request(self, method, path, payload):
+        if self.address.startswith('unix:'):
+            reader, writer = await asyncio.open_unix_connection(self.address[len('unix:'):])
+        else:
+            host, port = self.address.rsplit(':', 1)
+            reader, writer = await asyncio.open_connection(host, int(port))
+        try:
+            body = json.dumps(payload).encode() if payload is not None else b''
+            writer.write(f'{method} {path} HTTP/1.1\r\nHost: {self.name}\r\n'
+                         f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n'
+                         f'Connection: close\r\n\r\n'.encode() + body)
+            await writer.drain()
+            head = await reader.readuntil(b'\r\n\r\n')
+            if len(head) > MAX_HEADER_BYTES:
+                raise ValueError("Response headers too large")
+            status_line, *header_lines = head.decode('latin-1').split('\r\n')
+            code = int(status_line.split(' ', 2)[1])
+            length = 0
+            for line in header_lines:
+                name, _, value = line.partition(':')
+                if name.strip().lower() == 'content-length':
+                    length = int(value)
+            return code, json.loads(await reader.readexactly(length))
+        finally:
+            writer.close()
+
+    def update(self, state):
+        self.state = state
+        self.polled_at = time.monotonic()
+        self.pins_free_in = {int(pin): seconds for pin, seconds in state['pins_free_in'].items()}
+        self.alive = True
+
+    def finish_in(self, drink_name):
+        # Seconds until the drink would be done here, None if it cannot be made
+        if not self.alive or drink_name not in self.state['drinks']:
+            return None
+        drink = self.state['drinks'][drink_name]
+        elapsed = time.monotonic() - self.polled_at
+        start = max([self.pins_free_in.get(pin, 0.0) - elapsed for pin in drink['pins']] + [0.0])
+        return start + drink['seconds']
+
+    def book(self, drink_name):
+        # Until the next poll, count the order just sent as holding its pumps
+        end = self.finish_in(drink_name) + time.monotonic() - self.polled_at
+        for pin in self.state['drinks'][drink_name]['pins']:
+            self.pins_free_in[pin] = end
+
+    def summary(self):
+        summary = {'unit': self.name, 'address': self.address, 'alive': self.alive}
+        if self.state:
+            summary.update({key: self.state[key] for key in ('bottles', 'levels', 'queue_depth', 'pouring')})
+            summary['menu'] = sorted(self.state['drinks'])
+        return summary
+
+
+class FleetOrder:
+    def __init__(self, order_id, drink_name):
+        self.order_id = order_id
+        self.drink_name = drink_name
+        self.unit = None
+        self.unit_order_id = None
+        self.placed_at = None
+        self.queued = False  # Last known not to have started pouring
+        self.moves = 0  # Times it was placed again after its unit dropped out
+        self.failed = False
+
+
+class FleetCoordinator:
+    poll_interval = 1.0  # Seconds between /state polls of every unit
+    request_timeout = 2.0  # A unit slower than this to answer counts as gone
+    history = 500  # Orders still answerable by id
+
+    def __init__(self, units, host='0.0.0.0', port=8090, path=None):
+        self.units = list(units)
+        self.host = host
+        self.port = port
+        self.path = path  # Listen on this Unix socket instead of host and port
+        self.orders = {}  # Fleet order id -> FleetOrder
+        self._ids = itertools.count(1)
+        self._routing = None
+        self._server = None
+        self._poller = None
+
+    # Lifecycle
+
+    async def start(self):
+        # One routing decision at a time, so bookings never race
+        self._routing = asyncio.Lock()
+        await self.poll()
+        if self.path:
+            self._server = await asyncio.start_unix_server(self.serve_connection, self.path)
+        else:
+            self._server = await asyncio.start_server(self.serve_connection, self.host, self.port)
+        self._poller = asyncio.ensure_future(self._poll_loop())
+        return self._server
+
+    async def close(self):
+        if self._poller:
+            self._poller.cancel()
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _poll_loop(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            await self.poll()
+
+    async def poll(self):
+        await asyncio.gather(*(self._poll_unit(unit) for unit in self.units))
+
+    async def _poll_unit(self, unit):
+        asked_at = time.monotonic()
+        try:
+            code, state = await unit.request('GET', '/state', timeout=self.request_timeout)
+        except UnitUnavailable:
+            if unit.alive:
+                await self._unit_lost(unit)
+            return
+        if code != 200:
+            return
+        returning = not unit.alive and unit.state is not None
+        async with self._routing:
+            unit.update(state)
+            waiting = set(state['waiting'])
+            for order in self.orders.values():
+                if order.unit is not unit:
+                    continue
+                if order.placed_at < asked_at:
+                    if order.queued:
+                        order.queued = order.unit_order_id in waiting
+                elif order.drink_name in state['drinks']:
+                    unit.book(order.drink_name)  # Sent after the unit answered
+        if returning and unit.rerouted:
+            await self._withdraw(unit)
+
+    # Routing
+
+    async def place(self, drink_name):
+        # The FleetOrder, or None when no unit can make the drink
+        async with self._routing:
+            order = FleetOrder(next(self._ids), drink_name)
+            if not await self._route(order):
+                return None
+            self.orders[order.order_id] = order
+            for order_id in list(self.orders)[:-self.history]:
+                del self.orders[order_id]
+            return order
+
+    async def _route(self, order, exclude=()):
+        tried = set(exclude)
+        while True:
+            candidates = [(unit.finish_in(order.drink_name), index, unit) for index, unit in enumerate(self.units)
+                          if unit not in tried]
+            candidates = [candidate for candidate in candidates if candidate[0] is not None]
+            if not candidates:
+                return False
+            _, _, unit = min(candidates)
+            tried.add(unit)
+            try:
+                code, reply = await unit.request('POST', '/orders', {'drink': order.drink_name},
+                                                 timeout=self.request_timeout)
+            except UnitUnavailable:
+                # Its own queued orders move once this routing is done
+                if unit.alive:
+                    unit.alive = False
+                    asyncio.ensure_future(self._unit_lost(unit))
+                continue
+            if code == 202:
+                unit.book(order.drink_name)
+                order.unit = unit
+                order.unit_order_id = reply['order']
+                order.placed_at = time.monotonic()
+                order.queued = reply['status'] == 'queued'
+                return True
+            # Ran out since the last poll; don't offer it there again until then
+            unit.state['drinks'].pop(order.drink_name, None)
+
+    async def _unit_lost(self, unit):
+        # Drinks it never started go to the next best unit
+        async with self._routing:
+            unit.alive = False
+            for order in list(self.orders.values()):
+                if order.unit is not unit or not order.queued:
+                    continue
+                unit.rerouted.add(order.unit_order_id)
+                order.moves += 1
+                if not await self._route(order, exclude=[unit]):
+                    order.failed = True
+                    order.queued = False
+
+    async def _withdraw(self, unit):
+        for unit_order_id in sorted(unit.rerouted):
+            try:
+                await unit.request('DELETE', f'/orders/{unit_order_id}', timeout=self.request_timeout)
+            except UnitUnavailable:
+                return  # Gone again; try once it is back
+            unit.rerouted.discard(unit_order_id)
+
+    async def status(self, order):
+        status = {'order': order.order_id, 'drink': order.drink_name, 'unit': order.unit.name}
+        if order.failed:
+            status['status'] = 'failed'
+            return status
+        try:
+            code, reply = await order.unit.request('GET', f'/orders/{order.unit_order_id}',
+                                                   timeout=self.request_timeout)
+        except UnitUnavailable:
+            code = None
+        if code != 200:
+            status['status'] = 'unknown'
+            return status
+        status.update(status=reply['status'], position=reply['position'])
+        return status
+
+    # HTTP
+
+    async def serve_connection(self, reader, writer):
+        try:
+            await self._handle(reader, writer)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            pass  # Shutting down with the client still connected
+        finally:
+            writer.close()
+
+    async def _handle(self, reader, writer):
+        try:
+            method, path, headers = await read_request(reader)
+            if method == 'GET' and path == '/menu':
+                await respond(writer, 200, sorted({name for unit in self.units if unit.alive
+                                                   for name in unit.state['drinks']}))
+            elif method == 'GET' and path == '/units':
+                await respond(writer, 200, [unit.summary() for unit in self.units])
+            elif method == 'POST' and path == '/orders':
+                drink_name = parse_order(await read_body(reader, headers))
+                order = await self.place(drink_name)
+                if order is None:
+                    await respond(writer, 409, {'error': f"No unit can make {drink_name} now"})
+                else:
+                    await respond(writer, 202, {'order': order.order_id, 'drink': drink_name, 'unit': order.unit.name,
+                                                'status': 'queued' if order.queued else 'pouring',
+                                                'ready_in': order.unit.finish_in(drink_name)})
+            elif method == 'GET' and path.startswith('/orders/'):
+                order_id = path.rsplit('/', 1)[1]
+                order = self.orders.get(int(order_id)) if order_id.isdigit() else None
+                if order is None:
+                    await respond(writer, 404, {'error': 'No such order'})
+                else:
+                    await respond(writer, 200, await self.status(order))
+            else:
+                await respond(writer, 404, {'error': 'Not found'})
+        except BadRequest as error:
+            await respond(writer, error.code, {'error': str(error)})
+
+
+def simulated_units(count, max_active=None):
+    # Units with simulated pumps pouring in real time, each behind its own
+    # order server on a Unix socket; returns (units, servers)
+    from cocktail_core import simulated_maker
+    from order_server import OrderServer
+    from pump_driver import MonotonicClock
+
+    units, servers = [], []
+    for number in range(1, count + 1):
+        scratch = tempfile.mkdtemp(prefix=f'cocktail-unit{number}-')
+        maker = simulated_maker(scratch, max_active=max_active, clock=MonotonicClock())
+        maker.lines.mark_wet(maker.catalog.bottles.values())
+        server = OrderServer(maker, path=os.path.join(scratch, 'orders.sock'))
+        server.start_in_thread()
+        servers.append(server)
+        units.append(Unit(f'sim{number}', 'unix:' + server.path))
+    return units, servers
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Send orders to whichever machine finishes them first")
+    parser.add_argument('--unit', action='append', default=[], metavar='NAME=HOST:PORT',
+                        help="A machine's order server, or NAME=unix:/path for a Unix socket")
+    parser.add_argument('--simulate', type=int, default=0, metavar='N', help="Add N simulated units")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8090)
+    args = parser.parse_args(argv)
+
+    units = []
+    for spec in args.unit:
+        name, _, address = spec.partition('=')
+        units.append(Unit(name, address))
+    simulated, servers = simulated_units(args.simulate, max_active=4)
+    units.extend(simulated)
+    if not units:
+        parser.error("no units given")
+
+    coordinator = FleetCoordinator(units, args.host, args.port)
+
+    async def serve():
+        await coordinator.start()
+        print(f"Coordinating {len(units)} units on port {args.port}")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await coordinator.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers:
+            server.stop()
+            server.cocktail_maker.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
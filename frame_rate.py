@@ -0,0 +1,23 @@
+# Kivy has no public way to change the frame rate cap of a running app:
+# Config's graphics/maxfps is only read when the Clock is created. The Clock
+# keeps the cap in its private _max_fps and reads it on every frame, which is
+# what the screensaver's idle mode relies on. This is the only place that
+# touches it; checked against Kivy 2.0 to 2.3. Should a release drop the
+# attribute, the cap is left alone and a warning printed once.
+_warned = False
+
+
+def max_fps(clock):
+    # The cap in frames per second, 0 when uncapped or unknown
+    return getattr(clock, '_max_fps', 0)
+
+
+def set_max_fps(clock, fps):
+    global _warned
+    if not hasattr(clock, '_max_fps'):
+        if not _warned:
+            print("This Kivy version has no Clock._max_fps; the frame rate stays as configured")
+            _warned = True
+        return False
+    clock._max_fps = fps
+    return True
@@ -0,0 +1,190 @@
+import json
+import os
+import sys
+import threading
+import time
+
+# Millilitres left in each bottle. Every change is appended to a write-ahead
+# log as one JSON line; the log is flushed on every write but only fsynced
+# once fsync_every records or fsync_interval seconds have built up, so the SD
+# card sees one sync per batch of pours. Once the log grows past
+# compact_after records it is folded into the snapshot file and truncated.
+# Entries carry a sequence number so a crash between writing the snapshot and
+# truncating the log never applies a pour twice, and a torn last line after a
+# power cut is ignored on replay.
+INVENTORY_FILE = 'inventory.json'
+INVENTORY_LOG = 'inventory.log'
+
+
+class Inventory:
+    fsync_every = 8
+    fsync_interval = 5.0
+    compact_after = 500
+
+    def __init__(self, path=INVENTORY_FILE, log_path=INVENTORY_LOG):
+        self.path = path
+        self.log_path = log_path
+        self.levels = {}  # Beverage -> millilitres left
+        self.reserved = {}  # Beverage -> millilitres promised to accepted orders not yet poured
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._log_records = 0
+        self._seq = 0
+        self._recover()
+        self._log = open(self.log_path, 'a')
+
+    def _recover(self):
+        self.levels, self._seq, self._log_records, good_bytes = _replay(self.path, self.log_path)
+        if os.path.exists(self.log_path) and good_bytes < os.path.getsize(self.log_path):
+            # Cut the torn tail off so new entries start on a clean line
+            os.truncate(self.log_path, good_bytes)
+
+    def _append(self, entry):
+        self._seq += 1
+        entry['seq'] = self._seq
+        _apply(self.levels, entry)
+        self._log.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        self._log.flush()
+        self._unsynced += 1
+        self._log_records += 1
+        if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+            self._sync()
+        if self._log_records >= self.compact_after:
+            self._compact()
+
+    def _sync(self):
+        if self._unsynced:
+            os.fsync(self._log.fileno())
+            self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _compact(self):
+        # Write the snapshot atomically, then start an empty log
+        self._sync()
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'seq': self._seq, 'levels': self.levels}, f, indent=2, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._log.close()
+        self._log = open(self.log_path, 'w')
+        self._log_records = 0
+
+    def set_level(self, beverage, ml):
+        # A fresh bottle was loaded, or a level was corrected by hand
+        with self._lock:
+            self._append({'op': 'set', 'beverage': beverage, 'ml': float(ml)})
+
+    def deduct(self, recipe, reserved=None):
+        # Beverage -> millilitres actually poured; reserved is what the order
+        # held back when it was accepted, released now it is in the log
+        with self._lock:
+            if reserved:
+                self._release(reserved)
+            self._append({'op': 'pour', 'ml': {beverage: float(ml) for beverage, ml in recipe.items()}})
+
+    def reserve(self, recipe):
+        # Hold back what an accepted order is going to pour, so orders queued
+        # behind it cannot count on the same millilitres. Returns False, with
+        # nothing held, when a bottle cannot cover it
+        with self._lock:
+            if not self.can_pour(recipe):
+                return False
+            for beverage, ml in recipe.items():
+                self.reserved[beverage] = self.reserved.get(beverage, 0.0) + ml
+            return True
+
+    def release(self, recipe):
+        # An accepted order was withdrawn before pouring
+        with self._lock:
+            self._release(recipe)
+
+    def _release(self, recipe):
+        for beverage, ml in recipe.items():
+            left = self.reserved.get(beverage, 0.0) - ml
+            if left > 1e-9:
+                self.reserved[beverage] = left
+            else:
+                self.reserved.pop(beverage, None)
+
+    def level(self, beverage):
+        return self.levels.get(beverage)
+
+    def available(self, beverage):
+        # Millilitres left that no accepted order is waiting for, None if unmeasured
+        left = self.levels.get(beverage)
+        if left is None:
+            return None
+        return left - self.reserved.get(beverage, 0.0)
+
+    def can_pour(self, recipe):
+        # Beverages that have never been measured are assumed to be enough
+        for beverage, ml in recipe.items():
+            left = self.available(beverage)
+            if left is not None and left < ml:
+                return False
+        return True
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    def close(self):
+        with self._lock:
+            self._sync()
+            self._log.close()
+
+
+def read_levels(path=INVENTORY_FILE, log_path=INVENTORY_LOG):
+    # The levels a restart would recover, for tools such as simulator.py;
+    # nothing is written, not even the repair of a torn log
+    return _replay(path, log_path)[0]
+
+
+def _replay(path, log_path):
+    # Levels, last sequence number, log records and the length of the log up
+    # to a torn last line, from the snapshot and the log
+    levels = {}
+    seq = 0
+    records = 0
+    good_bytes = 0
+    if os.path.exists(path):
+        with open(path) as f:
+            snapshot = json.load(f)
+        seq = snapshot['seq']
+        levels = {beverage: float(ml) for beverage, ml in snapshot['levels'].items()}
+    if os.path.exists(log_path):
+        with open(log_path, 'rb') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break  # Torn write at the end of the log
+                good_bytes += len(line)
+                records += 1
+                if entry['seq'] > seq:
+                    _apply(levels, entry)
+                    seq = entry['seq']
+    return levels, seq, records, good_bytes
+
+
+def _apply(levels, entry):
+    if entry['op'] == 'set':
+        levels[entry['beverage']] = entry['ml']
+    elif entry['op'] == 'pour':
+        for beverage, ml in entry['ml'].items():
+            # Bottles nobody has measured stay untracked
+            if beverage in levels:
+                levels[beverage] -= ml
+
+
+if __name__ == '__main__':
+    # python inventory.py [set <beverage> <ml>]
+    inventory = Inventory()
+    if len(sys.argv) == 4 and sys.argv[1] == 'set':
+        inventory.set_level(sys.argv[2], float(sys.argv[3]))
+    for beverage, ml in sorted(inventory.levels.items()):
+        print(f"{beverage}: {ml:.0f} ml")
+    inventory.close()
@@ -0,0 +1,192 @@
+import itertools
+import threading
+from collections import Counter, deque
+
+from pour_plan import plan_pours
+
+# Orders wait here until every pump they need is free. An order that is
+# blocked keeps its pumps reserved, so later orders may only overtake it when
+# they share no ingredients with it; nobody starves behind a stream of
+# unrelated drinks.
+
+
+class Order:
+    def __init__(self, order_id, name, durations, on_start=None, on_done=None, on_failed=None):
+        self.order_id = order_id
+        self.name = name
+        self.durations = dict(durations)  # GPIO pin -> seconds on
+        self.pins = frozenset(self.durations)
+        self.on_start = on_start
+        self.on_done = on_done
+        self.on_failed = on_failed  # Called instead of on_done when the pumps were stopped
+        self.enqueued_at = None
+        self.started_at = None
+        self.finished_at = None
+        self.cancelled = False
+        self.error = None  # The driver error that stopped the pumps before it was poured
+        self.reserved = {}  # Beverage -> millilitres held back in the inventory until poured
+        self.plan = None
+        self.job = None
+
+    @property
+    def wait_time(self):
+        if self.started_at is None:
+            return None
+        return self.started_at - self.enqueued_at
+
+
+class OrderScheduler:
+    wait_history = 500  # Recent wait times kept for the statistics
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.clock = engine.clock
+        self._ids = itertools.count(1)
+        self._lock = threading.RLock()
+        self._waiting = deque()
+        self._busy_pins = set()
+        self._waiting_pins = Counter()  # GPIO pin -> waiting orders that need it
+        self.active = {}  # order id -> Order currently pouring
+        self.wait_times = deque(maxlen=self.wait_history)
+        self.completed = 0
+
+    def submit(self, name, durations, on_start=None, on_done=None, on_failed=None):
+        with self._lock:
+            order = Order(next(self._ids), name, durations, on_start, on_done, on_failed)
+            order.enqueued_at = self.clock.now()
+            self._waiting.append(order)
+            self._waiting_pins.update(order.pins)
+            started = self._dispatch()
+        self._notify_started(started)
+        return order
+
+    def cancel(self, order):
+        # Only orders that have not started pouring can be withdrawn
+        with self._lock:
+            if order not in self._waiting:
+                return False
+            self._waiting.remove(order)
+            self._waiting_pins.subtract(order.pins)
+            order.cancelled = True
+            started = self._dispatch()
+        self._notify_started(started)
+        return True
+
+    def _dispatch(self):
+        started = []
+        reserved = set(self._busy_pins)
+        wanted = {pin for pin, count in self._waiting_pins.items() if count > 0}
+        ready = []
+        for index, order in enumerate(self._waiting):
+            if wanted <= reserved:
+                break  # Every pump a waiting order needs is taken; a long queue stops here
+            if not order.pins & reserved:
+                ready.append(index)
+            reserved |= order.pins
+        # Only the scanned head of the queue is touched, so a drain stays
+        # linear however long the queue is
+        taken = []
+        for index in reversed(ready):
+            taken.append(self._waiting[index])
+            del self._waiting[index]
+        for order in reversed(taken):
+            self._waiting_pins.subtract(order.pins)
+            self._busy_pins |= order.pins
+            self.active[order.order_id] = order
+            order.started_at = self.clock.now()
+            self.wait_times.append(order.wait_time)
+            # Stagger the starts so the recipe alone never exceeds the pump cap
+            order.plan = plan_pours(order.durations, self.engine.max_active)
+            order.job = self.engine.dispense(order.durations, on_done=lambda job, order=order: self._finished(order),
+                                             offsets=order.plan.offsets, tag=order.order_id,
+                                             on_failed=lambda job, order=order: self._failed(order, job.error))
+            started.append(order)
+        return started
+
+    def _notify_started(self, orders):
+        # Callbacks run outside the lock so they may submit or inspect freely
+        for order in orders:
+            if order.on_start:
+                order.on_start(order)
+
+    def _finished(self, order):
+        with self._lock:
+            order.finished_at = self.clock.now()
+            self._busy_pins -= order.pins
+            del self.active[order.order_id]
+            self.completed += 1
+            started = self._dispatch()
+        try:
+            if order.on_done:
+                order.on_done(order)
+        finally:
+            # The orders this one made room for have started either way
+            self._notify_started(started)
+
+    def _failed(self, order, error):
+        # The engine stopped every pump under this order. Nothing can pour any
+        # more, so the orders still waiting fail with it and free their pins
+        with self._lock:
+            self._busy_pins -= order.pins
+            self.active.pop(order.order_id, None)
+            failed = [order] + list(self._waiting)
+            self._waiting.clear()
+            self._waiting_pins.clear()
+        for failing in failed:
+            failing.error = error
+            if failing.on_failed:
+                failing.on_failed(failing)
+
+    @property
+    def queue_depth(self):
+        return len(self._waiting)
+
+    def position(self, order):
+        # 1-based place in the waiting line, 0 once it is pouring or done
+        with self._lock:
+            for index, waiting in enumerate(self._waiting):
+                if waiting is order:
+                    return index + 1
+        return 0
+
+    def waiting_ids(self):
+        with self._lock:
+            return [order.order_id for order in self._waiting]
+
+    def pins_free_in(self):
+        # Seconds from now until each busy or reserved pump is free, following
+        # the queue as it stands: pouring orders run out their plans and each
+        # waiting order takes its pumps once they are all free
+        with self._lock:
+            now = self.clock.now()
+            free = {}
+            for order in self.active.values():
+                end = max(order.started_at + order.plan.makespan - now, 0.0)
+                for pin in order.pins:
+                    free[pin] = end
+            for order in self._waiting:
+                start = max(free.get(pin, 0.0) for pin in order.pins)
+                end = start + plan_pours(order.durations, self.engine.max_active).makespan
+                for pin in order.pins:
+                    free[pin] = end
+            return free
+
+    def pins_in_use(self):
+        # Pumps pouring now or wanted by a waiting order
+        with self._lock:
+            return self._busy_pins | {pin for pin, count in self._waiting_pins.items() if count > 0}
+
+    def idle(self):
+        with self._lock:
+            return not self._waiting and not self.active
+
+    def stats(self):
+        with self._lock:
+            waits = sorted(self.wait_times)
+            return {
+                'queue_depth': len(self._waiting),
+                'pouring': len(self.active),
+                'completed': self.completed,
+                'mean_wait': sum(waits) / len(waits) if waits else 0.0,
+                'max_wait': waits[-1] if waits else 0.0,
+            }
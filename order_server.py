@@ -0,0 +1,360 @@
+import asyncio
+import base64
+import functools
+import hashlib
+import json
+import struct
+import threading
+from collections import deque
+
+from cocktail_core import OrderRefused
+
+# Lets phones on the local network order from the catalog. Plain HTTP serves
+# the menu and takes orders; a WebSocket on /ws takes orders too and pushes
+# every status change (queue position, pouring, done) to the client that placed
+# them. The server runs its own asyncio loop in a background thread, so neither
+# the Kivy loop nor the dispense thread ever waits on a phone.
+#
+#   GET  /menu          -> ["Rum & Coke", ...]
+#   POST /orders        {"drink": "Rum & Coke"} -> {"order": 7, "status": "queued", "position": 2}
+#   GET  /orders/<id>   -> {"order": 7, "status": "pouring", "position": 0}
+#   DELETE /orders/<id> withdraws an order that has not started pouring
+#   GET  /state         bottles, levels and pump availability, for fleet.py
+#   GET  /ws            WebSocket; send {"drink": ...}, receive status messages
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+MAX_HEADER_BYTES = 8192
+MAX_BODY_BYTES = 4096
+
+HTTP_REASONS = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found', 409: 'Conflict',
+                413: 'Payload Too Large', 503: 'Service Unavailable'}
+
+
+class WebSocketClosed(Exception):
+    pass
+
+
+class BadRequest(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+async def read_request(reader):
+    # (method, path, lower-cased headers) of one HTTP request
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except asyncio.LimitOverrunError:
+        raise BadRequest(413, 'Headers too large')
+    if len(head) > MAX_HEADER_BYTES:
+        raise BadRequest(413, 'Headers too large')
+    request_line, *header_lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, path, _ = request_line.split(' ', 2)
+    except ValueError:
+        raise BadRequest(400, 'Bad request line')
+    headers = {}
+    for line in header_lines:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    return method, path, headers
+
+
+async def read_body(reader, headers):
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise BadRequest(400, 'Bad Content-Length')
+    if length < 0:
+        raise BadRequest(400, 'Bad Content-Length')
+    if length > MAX_BODY_BYTES:
+        raise BadRequest(413, 'Body too large')
+    return await reader.readexactly(length)
+
+
+def parse_order(body):
+    # The drink name in an order, {"drink": name}
+    try:
+        drink_name = json.loads(body)['drink']
+    except (ValueError, KeyError, TypeError):
+        drink_name = None
+    if not isinstance(drink_name, str):
+        raise BadRequest(400, 'Expected {"drink": name}')
+    return drink_name
+
+
+async def respond(writer, code, payload):
+    body = json.dumps(payload).encode()
+    writer.write(f'HTTP/1.1 {code} {HTTP_REASONS[code]}\r\n'
+                 f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n'
+                 f'Connection: close\r\n\r\n'.encode() + body)
+    await writer.drain()
+
+
+async def read_frame(reader):
+    # Returns (opcode, payload) of one client frame; clients always mask
+    first, second = await reader.readexactly(2)
+    opcode = first & 0x0f
+    length = second & 0x7f
+    if length == 126:
+        length, = struct.unpack('>H', await reader.readexactly(2))
+    elif length == 127:
+        length, = struct.unpack('>Q', await reader.readexactly(8))
+    if length > MAX_BODY_BYTES:
+        raise WebSocketClosed("Frame too large")
+    mask = await reader.readexactly(4) if second & 0x80 else b'\0\0\0\0'
+    payload = await reader.readexactly(length)
+    return opcode, bytes(byte ^ mask[index % 4] for index, byte in enumerate(payload))
+
+
+def encode_frame(payload, opcode=0x1):
+    header = bytes([0x80 | opcode])
+    length = len(payload)
+    if length < 126:
+        header += bytes([length])
+    elif length < 1 << 16:
+        header += bytes([126]) + struct.pack('>H', length)
+    else:
+        header += bytes([127]) + struct.pack('>Q', length)
+    return header + payload
+
+
+class OrderServer:
+    max_clients = 64  # Connections served at once; the rest get a 503
+    client_backlog = 32  # Status messages buffered per slow WebSocket client
+    history = 200  # Finished orders still answerable by id
+
+    def __init__(self, cocktail_maker, host='0.0.0.0', port=8080, on_start=None, on_done=None, path=None):
+        self.cocktail_maker = cocktail_maker
+        self.host = host
+        self.port = port
+        self.path = path  # Listen on this Unix socket instead of host and port
+        self.on_start = on_start  # Forwarded from the dispense thread, e.g. to show the loading screen
+        self.on_done = on_done
+        self.orders = {}  # Order id -> Order placed through this server
+        self._finished = deque()
+        self._subscribers = {}  # Order id -> outgoing queues of the WebSockets that placed it
+        self._slots = None
+        self._server = None
+        self.loop = None
+        self._thread = None
+
+    # Lifecycle
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self._slots = asyncio.Semaphore(self.max_clients)
+        if self.path:
+            self._server = await asyncio.start_unix_server(self.serve_connection, self.path)
+        else:
+            self._server = await asyncio.start_server(self.serve_connection, self.host, self.port)
+        return self._server
+
+    async def close(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def start_in_thread(self):
+        # Run next to the Kivy app on a loop of our own
+        started = threading.Event()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start())
+            started.set()
+            loop.run_forever()
+            loop.run_until_complete(self.close())
+            loop.close()
+
+        self._thread = threading.Thread(target=run, name='order-server', daemon=True)
+        self._thread.start()
+        started.wait()
+
+    def stop(self):
+        if self._thread:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+            self._thread = None
+
+    # Orders
+
+    async def place_order(self, drink_name):
+        # Accepting an order writes to the SD card (the inventory log and the
+        # order history), so it runs on the loop's executor and other phones
+        # are served meanwhile
+        order = await self.loop.run_in_executor(None, functools.partial(
+            self.cocktail_maker.order, drink_name,
+            on_start=lambda order: self._from_dispense_thread(self._order_started, order),
+            on_done=lambda order: self._from_dispense_thread(self._order_done, order),
+            on_failed=lambda order: self._from_dispense_thread(self._retire, order)))
+        self.orders[order.order_id] = order
+        return order
+
+    @staticmethod
+    def _settled(order):
+        # Poured, withdrawn or failed: no status change is coming any more
+        return order.finished_at is not None or order.cancelled or order.error is not None
+
+    def _from_dispense_thread(self, callback, order):
+        try:
+            self.loop.call_soon_threadsafe(callback, order)
+        except RuntimeError:
+            pass  # Server stopped while the pumps run on; nobody is listening
+
+    def status(self, order):
+        if order.finished_at is not None:
+            state = 'done'
+        elif order.error is not None:
+            state = 'failed'
+        elif order.cancelled:
+            state = 'cancelled'
+        elif order.started_at is not None:
+            state = 'pouring'
+        else:
+            state = 'queued'
+        return {'order': order.order_id, 'drink': order.name, 'status': state,
+                'position': self.cocktail_maker.scheduler.position(order)}
+
+    def _order_started(self, order):
+        self._publish(order)
+        # Everyone behind it moved up the queue
+        for order_id in self._subscribers:
+            waiting = self.orders.get(order_id)
+            if waiting is not None and waiting.started_at is None:
+                self._publish(waiting)
+        if self.on_start:
+            self.on_start(order)
+
+    def _order_done(self, order):
+        self._retire(order)
+        if self.on_done:
+            self.on_done(order)
+
+    def _retire(self, order):
+        # Its last status goes out, and it stays answerable by id until
+        # history more orders have been poured, withdrawn or failed
+        self._publish(order)
+        self._subscribers.pop(order.order_id, None)
+        self._finished.append(order.order_id)
+        while len(self._finished) > self.history:
+            self.orders.pop(self._finished.popleft(), None)
+
+    def _publish(self, order):
+        message = json.dumps(self.status(order))
+        for queue in self._subscribers.get(order.order_id, ()):
+            self._offer(queue, message)
+
+    @staticmethod
+    def _offer(queue, message):
+        if queue.full():
+            queue.get_nowait()  # A slow phone loses the oldest update, never blocks the rest
+        queue.put_nowait(message)
+
+    # HTTP
+
+    async def serve_connection(self, reader, writer):
+        # tests/test_order_server.py drives this directly with in-memory streams
+        if self._slots.locked():
+            await respond(writer, 503, {'error': 'Too many connections'})
+            writer.close()
+            return
+        async with self._slots:
+            try:
+                await self._handle(reader, writer)
+            except (asyncio.IncompleteReadError, ConnectionError, WebSocketClosed):
+                pass
+            except asyncio.CancelledError:
+                pass  # Server shutting down with the client still connected
+            finally:
+                writer.close()
+
+    async def _handle(self, reader, writer):
+        try:
+            method, path, headers = await read_request(reader)
+            if path == '/ws' and headers.get('upgrade', '').lower() == 'websocket':
+                await self._websocket(reader, writer, headers)
+                return
+            if method == 'GET' and path == '/menu':
+                await respond(writer, 200, [drink.name for drink in self.cocktail_maker.catalog.available_drinks()
+                                            if self.cocktail_maker.can_make(drink.name)])
+            elif method == 'GET' and path == '/state':
+                await respond(writer, 200, self.cocktail_maker.state())
+            elif method == 'POST' and path == '/orders':
+                await self._order_request(writer, await read_body(reader, headers))
+            elif method in ('GET', 'DELETE') and path.startswith('/orders/'):
+                order_id = path.rsplit('/', 1)[1]
+                order = self.orders.get(int(order_id)) if order_id.isdigit() else None
+                if order is None:
+                    await respond(writer, 404, {'error': 'No such order'})
+                elif method == 'DELETE' and not self.cocktail_maker.cancel(order):
+                    await respond(writer, 409, {'error': 'Already pouring'})
+                else:
+                    if method == 'DELETE':
+                        self._retire(order)
+                    await respond(writer, 200, self.status(order))
+            else:
+                await respond(writer, 404, {'error': 'Not found'})
+        except BadRequest as error:
+            await respond(writer, error.code, {'error': str(error)})
+
+    async def _order_request(self, writer, body):
+        drink_name = parse_order(body)
+        try:
+            order = await self.place_order(drink_name)
+        except OrderRefused as error:
+            await respond(writer, 409, {'error': str(error)})
+            return
+        await respond(writer, 202, self.status(order))
+
+    # WebSocket
+
+    async def _websocket(self, reader, writer, headers):
+        key = headers.get('sec-websocket-key')
+        if not key:
+            await respond(writer, 400, {'error': 'Missing Sec-WebSocket-Key'})
+            return
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+        writer.write(f'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                     f'Sec-WebSocket-Accept: {accept}\r\n\r\n'.encode())
+        await writer.drain()
+
+        outgoing = asyncio.Queue(self.client_backlog)
+        sender = asyncio.ensure_future(self._send_loop(writer, outgoing))
+        placed = []
+        try:
+            while True:
+                opcode, payload = await read_frame(reader)
+                if opcode == 0x8:  # Close
+                    writer.write(encode_frame(b'', 0x8))
+                    break
+                if opcode == 0x9:  # Ping
+                    writer.write(encode_frame(payload, 0xA))
+                    continue
+                if opcode != 0x1:
+                    continue
+                try:
+                    order = await self.place_order(parse_order(payload))
+                except (BadRequest, OrderRefused) as error:
+                    self._offer(outgoing, json.dumps({'error': str(error)}))
+                    continue
+                # An order can be poured before the executor hands it back,
+                # and then nothing more is published for it
+                if not self._settled(order):
+                    placed.append(order.order_id)
+                    self._subscribers.setdefault(order.order_id, []).append(outgoing)
+                self._offer(outgoing, json.dumps(self.status(order)))
+        finally:
+            for order_id in placed:
+                queues = self._subscribers.get(order_id)
+                if queues and outgoing in queues:
+                    queues.remove(outgoing)
+            sender.cancel()
+            await writer.drain()
+
+    async def _send_loop(self, writer, outgoing):
+        while True:
+            message = await outgoing.get()
+            writer.write(encode_frame(message.encode()))
+            await writer.drain()
@@ -0,0 +1,90 @@
+from collections import namedtuple
+
+# Packs the pours of one recipe under a cap on how many relays may be on at
+# once, to keep the shared supply from browning out. Starts are planned
+# offsets rather than fixed sleeps, so a pump starts the moment a slot frees.
+PourStep = namedtuple('PourStep', ['pin', 'start', 'duration'])
+
+EXACT_SEARCH_LIMIT = 8  # Recipes up to this many pumps are planned optimally
+
+
+class PourPlan:
+    def __init__(self, steps):
+        self.steps = sorted(steps, key=lambda step: (step.start, step.pin))
+
+    @property
+    def offsets(self):
+        return {step.pin: step.start for step in self.steps}
+
+    @property
+    def durations(self):
+        return {step.pin: step.duration for step in self.steps}
+
+    @property
+    def makespan(self):
+        return max((step.start + step.duration for step in self.steps), default=0.0)
+
+
+def _pack(order, durations, max_active):
+    # List scheduling: each pour takes the slot that frees up first
+    slots = [0.0] * max_active
+    steps = []
+    for pin in order:
+        slot = min(range(max_active), key=slots.__getitem__)
+        steps.append(PourStep(pin, slots[slot], durations[pin]))
+        slots[slot] += durations[pin]
+    return steps
+
+
+def _best_assignment(pins, durations, max_active, bound):
+    # Exact makespan by branch and bound over slot loads; tiny for a recipe
+    pins = sorted(pins, key=lambda pin: -durations[pin])
+    best = [bound, None]
+    loads = [0.0] * max_active
+    assignment = {}
+
+    def search(index):
+        if index == len(pins):
+            makespan = max(loads)
+            if makespan < best[0]:
+                best[0], best[1] = makespan, dict(assignment)
+            return
+        pin = pins[index]
+        seen = set()
+        for slot in range(max_active):
+            # Slots with equal load are interchangeable
+            if loads[slot] in seen or loads[slot] + durations[pin] >= best[0]:
+                continue
+            seen.add(loads[slot])
+            loads[slot] += durations[pin]
+            assignment[pin] = slot
+            search(index + 1)
+            loads[slot] -= durations[pin]
+            del assignment[pin]
+
+    search(0)
+    return best[1]
+
+
+def plan_pours(durations, max_active=None):
+    if not durations:
+        return PourPlan([])
+    if not max_active or max_active >= len(durations):
+        return PourPlan([PourStep(pin, 0.0, duration) for pin, duration in durations.items()])
+
+    # Longest pours first is within 4/3 of optimal and usually exact
+    order = sorted(durations, key=lambda pin: (-durations[pin], pin))
+    plan = PourPlan(_pack(order, durations, max_active))
+    if len(durations) > EXACT_SEARCH_LIMIT:
+        return plan
+
+    assignment = _best_assignment(durations, durations, max_active, plan.makespan)
+    if assignment is None:
+        return plan
+    steps = []
+    slots = [0.0] * max_active
+    for pin in order:
+        slot = assignment[pin]
+        steps.append(PourStep(pin, slots[slot], durations[pin]))
+        slots[slot] += durations[pin]
+    return PourPlan(steps)
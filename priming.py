@@ -0,0 +1,56 @@
+import json
+import os
+
+# Whether each pump's tubing is full of liquid. A dry line swallows its dead
+# volume before anything reaches the cup, so the first pour after a bottle is
+# loaded gets that much extra pump time, and only that pour. Purging runs a
+# line with the bottle removed to push out what is left and marks it dry.
+# States survive restarts in lines.json, along with per-pin dead volumes.
+LINES_FILE = 'lines.json'
+DEFAULT_DEAD_VOLUME = 8.0  # Millilitres held by one pump's tubing
+
+
+class LineState:
+    def __init__(self, path=LINES_FILE):
+        self.path = path
+        self.dead_volumes = {}  # GPIO pin -> millilitres, DEFAULT_DEAD_VOLUME if missing
+        self.wet = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.dead_volumes = {int(pin): float(ml) for pin, ml in data.get('dead_volume', {}).items()}
+            self.wet = set(data.get('wet', []))
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'dead_volume': {str(pin): ml for pin, ml in sorted(self.dead_volumes.items())},
+                       'wet': sorted(self.wet)}, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def dead_volume(self, pin):
+        return self.dead_volumes.get(pin, DEFAULT_DEAD_VOLUME)
+
+    def is_wet(self, pin):
+        return pin in self.wet
+
+    def dry_pins(self, pins):
+        return [pin for pin in pins if pin not in self.wet]
+
+    def mark_wet(self, pins):
+        if not set(pins) <= self.wet:
+            self.wet.update(pins)
+            self.save()
+
+    def mark_dry(self, pins):
+        if self.wet & set(pins):
+            self.wet.difference_update(pins)
+            self.save()
+
+    def fill_times(self, pins, calibration):
+        # Seconds each pin needs to fill (or empty) its tubing
+        return {pin: self.dead_volume(pin) / calibration.rate(pin) for pin in pins}
+
+    def compensation(self, pins, calibration):
+        # Extra seconds for the dry pins among pins; wet ones need nothing
+        return self.fill_times(self.dry_pins(pins), calibration)
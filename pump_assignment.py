@@ -0,0 +1,243 @@
+import argparse
+import sys
+from collections import defaultdict
+
+from calibration import FlowCalibration
+from catalog import Catalog
+from order_history import ORDER_HISTORY_FILE, read_counts
+
+# Recommends which bottle goes on which pump. Demand comes from the order
+# history (every drink counts once when there is none). The ingredient set is
+# found by local search starting from what is loaded now, so bottles only move
+# when that serves more orders; each swap has to win at least swap_penalty
+# orders. Per-drink counts of missing ingredients make every candidate move
+# cost only the drinks that use the two bottles involved, which keeps
+# catalogs of thousands of recipes fast enough for the Pi.
+#
+#   python pump_assignment.py [--history orders.log] [--pins 2 3 4 17 27 22 10 9]
+MOTOR_PINS = [2, 3, 4, 17, 27, 22, 10, 9]  # Relay pins wired on the machine, see motortest.py
+
+
+class Recommendation:
+    def __init__(self, assignment, served, total, swaps, rebalanced):
+        self.assignment = assignment  # Beverage -> GPIO pin with as few moves as possible
+        self.served = served  # Orders in the history the assignment can make
+        self.total = total
+        self.swaps = swaps  # (beverage taken off, beverage put on, GPIO pin)
+        self.rebalanced = rebalanced  # Beverage -> GPIO pin with the busiest beverages on the fastest pumps
+
+
+class AssignmentSearch:
+    def __init__(self, catalog, demand, pin_count, swap_penalty=0.5):
+        self.catalog = catalog
+        self.pin_count = pin_count
+        self.swap_penalty = swap_penalty
+        self.demand = {name: demand.get(name, 0) for name in catalog.drinks}
+        self.uses = defaultdict(list)  # Beverage -> drinks with demand that need it
+        for name, drink in catalog.drinks.items():
+            if self.demand[name]:
+                for beverage in drink.recipe:
+                    self.uses[beverage].append(name)
+
+    def _missing(self, loaded):
+        return {name: sum(1 for beverage in drink.recipe if beverage not in loaded)
+                for name, drink in self.catalog.drinks.items() if self.demand[name]}
+
+    def _gain_add(self, missing, beverage):
+        return sum(self.demand[name] for name in self.uses[beverage] if missing[name] == 1)
+
+    def _loss_remove(self, missing, beverage):
+        return sum(self.demand[name] for name in self.uses[beverage] if missing[name] == 0)
+
+    def _swap_delta(self, missing, out, into, gain, loss):
+        # Demand gained by replacing out with into. Drinks that need both only
+        # ever lacked into, so they stay unserved
+        both = sum(self.demand[name] for name in self.uses[into]
+                   if missing[name] == 1 and out in self.catalog.drinks[name].recipe)
+        return gain - both - loss
+
+    def _apply(self, missing, loaded, out=None, into=None):
+        if out is not None:
+            loaded.discard(out)
+            for name in self.uses[out]:
+                missing[name] += 1
+        if into is not None:
+            loaded.add(into)
+            for name in self.uses[into]:
+                missing[name] -= 1
+
+    def search(self, current):
+        loaded = set(current)
+        missing = self._missing(loaded)
+        candidates = [beverage for beverage in self.uses if beverage not in loaded]
+        while True:
+            best = (0, None, None)
+            if len(loaded) < self.pin_count:
+                # Free pumps: load whatever serves most
+                for into in candidates:
+                    gain = self._gain_add(missing, into)
+                    if gain > best[0]:
+                        best = (gain, None, into)
+            else:
+                # Best gains first; once a gain minus the cheapest removal
+                # cannot beat the best swap found, no later candidate can either
+                losses = sorted((self._loss_remove(missing, out), out) for out in loaded)
+                gains = sorted(((self._gain_add(missing, into), into) for into in candidates), reverse=True)
+                for gain, into in gains:
+                    if gain - losses[0][0] - self.swap_penalty <= best[0]:
+                        break
+                    for loss, out in losses:
+                        if gain - loss - self.swap_penalty <= best[0]:
+                            break
+                        delta = self._swap_delta(missing, out, into, gain, loss) - self.swap_penalty
+                        if delta > best[0]:
+                            best = (delta, out, into)
+            if best[2] is None:
+                best = self._pair_move(missing, loaded)
+            if best[2] is None:
+                return loaded
+            gain, out, into = best
+            if isinstance(into, tuple):
+                # Two bottles in, two out, for a drink no single swap can reach
+                for single_out, single_into in zip(out, into):
+                    self._apply(missing, loaded, single_out, single_into)
+                    candidates.remove(single_into)
+                    if single_out is not None:
+                        candidates.append(single_out)
+            else:
+                self._apply(missing, loaded, out, into)
+                candidates.remove(into)
+                if out is not None:
+                    candidates.append(out)
+
+    def _pair_move(self, missing, loaded):
+        # Drinks missing two bottles: swap both in for the two least useful
+        # ones (or onto free pumps). Pairs are tried by an upper bound on what
+        # they can gain, so most are never evaluated in full
+        pairs = defaultdict(int)
+        needed = defaultdict(set)  # Loaded bottles the drinks missing this pair also use
+        for name, count in missing.items():
+            if count == 2:
+                recipe = self.catalog.drinks[name].recipe
+                into = tuple(sorted(beverage for beverage in recipe if beverage not in loaded))
+                pairs[into] += self.demand[name]
+                needed[into].update(beverage for beverage in recipe if beverage in loaded)
+        if not pairs:
+            return (0, None, None)
+        singles = {}  # Beverage -> drinks missing only it
+        single = {}
+        for into in pairs:
+            for beverage in into:
+                if beverage not in singles:
+                    singles[beverage] = [name for name in self.uses[beverage] if missing[name] == 1]
+                    single[beverage] = sum(self.demand[name] for name in singles[beverage])
+        bounds = sorted(((demand + single[into[0]] + single[into[1]], into) for into, demand in pairs.items()),
+                        reverse=True)
+        losses = sorted((self._loss_remove(missing, beverage), beverage) for beverage in loaded)
+        free = self.pin_count - len(loaded)
+        least_cost = (losses[0][0] if free < 2 else 0) + self.swap_penalty * max(0, 2 - free)
+
+        best = (0, None, None)
+        lost = {}  # Removed bottles -> demand they serve now; most pairs push out the same two
+        for bound, into in bounds:
+            if bound - least_cost <= best[0]:
+                break
+            out = ([None] * free + [beverage for _, beverage in losses if beverage not in needed[into]])[:2]
+            if len(out) < 2:
+                continue
+            removed = frozenset(beverage for beverage in out if beverage is not None)
+            # The bound is what the pair gains as long as nothing it needs is
+            # removed. Drinks missing just the pair never use a removed bottle;
+            # drinks missing one of the two may
+            conflicts = {name for beverage in into for name in singles[beverage]
+                         if removed & self.catalog.drinks[name].recipe.keys()}
+            if removed not in lost:
+                lost[removed] = sum(self.demand[name] for name in {name for beverage in removed
+                                                                   for name in self.uses[beverage]
+                                                                   if missing[name] == 0})
+            delta = (bound - sum(self.demand[name] for name in conflicts) - lost[removed]
+                     - self.swap_penalty * len(removed))
+            if delta > best[0]:
+                best = (delta, tuple(out), into)
+        return best
+
+    def served(self, loaded):
+        return sum(demand for name, demand in self.demand.items()
+                   if demand and all(beverage in loaded for beverage in self.catalog.drinks[name].recipe))
+
+
+def beverage_volumes(catalog, demand):
+    # Millilitres of each beverage the demand pours
+    volumes = defaultdict(float)
+    for name, count in demand.items():
+        drink = catalog.drinks.get(name)
+        if drink:
+            for beverage, ml in drink.recipe.items():
+                volumes[beverage] += count * ml
+    return volumes
+
+
+def recommend(catalog, demand, pins, calibration, swap_penalty=0.5):
+    if not any(demand.get(name) for name in catalog.drinks):
+        demand = {name: 1 for name in catalog.drinks}
+    search = AssignmentSearch(catalog, demand, len(pins), swap_penalty)
+    current = {beverage: pin for beverage, pin in catalog.bottles.items() if pin in pins}
+    chosen = search.search(current)
+    volumes = beverage_volumes(catalog, demand)
+
+    # Bottles that stay keep their pumps; new ones take the freed pumps,
+    # busiest on the fastest
+    assignment = {beverage: pin for beverage, pin in current.items() if beverage in chosen}
+    free_pins = sorted((pin for pin in pins if pin not in assignment.values()),
+                       key=lambda pin: -calibration.rate(pin))
+    removed = sorted((beverage for beverage in current if beverage not in chosen), key=lambda beverage: current[beverage])
+    added = sorted((beverage for beverage in chosen if beverage not in current), key=lambda beverage: -volumes[beverage])
+    swaps = []
+    for beverage, pin in zip(added, free_pins):
+        assignment[beverage] = pin
+        taken_off = next((old for old in removed if current[old] == pin), None)
+        swaps.append((taken_off, beverage, pin))
+
+    by_volume = sorted(chosen, key=lambda beverage: -volumes[beverage])
+    by_speed = sorted(pins, key=lambda pin: -calibration.rate(pin))
+    rebalanced = dict(zip(by_volume, by_speed))
+    return Recommendation(assignment, search.served(chosen), sum(demand.values()), swaps, rebalanced)
+
+
+def pump_seconds(assignment, volumes, calibration):
+    return sum(volumes[beverage] / calibration.rate(pin) for beverage, pin in assignment.items())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recommend which bottle goes on which pump")
+    parser.add_argument('--history', default=ORDER_HISTORY_FILE)
+    parser.add_argument('--pins', nargs='+', type=int, default=MOTOR_PINS)
+    parser.add_argument('--swap-penalty', type=float, default=0.5, help="Orders a bottle swap has to gain")
+    args = parser.parse_args(argv)
+
+    catalog = Catalog.load()
+    calibration = FlowCalibration()
+    demand = read_counts(args.history)
+    result = recommend(catalog, demand, args.pins, calibration, args.swap_penalty)
+
+    print(f"Serves {result.served} of {result.total} orders from {args.history}")
+    if not result.swaps:
+        print("Keep the bottles where they are")
+    for taken_off, put_on, pin in result.swaps:
+        print(f"GPIO {pin}: {'take off ' + taken_off + ', ' if taken_off else ''}load {put_on}")
+    for beverage, pin in sorted(result.assignment.items(), key=lambda item: item[1]):
+        print(f"  GPIO {pin:>2}: {beverage}")
+
+    volumes = beverage_volumes(catalog, demand or {name: 1 for name in catalog.drinks})
+    before = pump_seconds(result.assignment, volumes, calibration)
+    after = pump_seconds(result.rebalanced, volumes, calibration)
+    if before - after >= 1:
+        moves = {beverage: pin for beverage, pin in result.rebalanced.items() if result.assignment.get(beverage) != pin}
+        print(f"Busiest bottles on the fastest pumps would save {before - after:.0f} pump-seconds over this history:")
+        for beverage, pin in sorted(moves.items(), key=lambda item: item[1]):
+            print(f"  GPIO {pin:>2}: {beverage}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,256 @@
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+
+# The relay board is active-low: LOW switches a pump on, HIGH switches it off.
+RelayEdge = namedtuple('RelayEdge', ['time', 'pin', 'on'])
+
+# SoCs whose GPIO bank 0 is exposed the same way through /dev/gpiomem; the
+# Pi 5 (bcm2712) drives its pins through the RP1 instead
+BCM_GPIO_SOCS = (b'brcm,bcm2835', b'brcm,bcm2836', b'brcm,bcm2837', b'brcm,bcm2711')
+
+
+class MonotonicClock:
+    # Wall-clock independent time source used on the real machine
+    spin_time = 0.002  # Busy-wait the last couple of milliseconds for precision
+
+    def now(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        self.sleep_until(self.now() + seconds)
+
+    def sleep_until(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining > self.spin_time:
+            time.sleep(remaining - self.spin_time)
+        while time.monotonic() < deadline:
+            pass
+
+    def wait(self, condition, deadline):
+        # Block on a held condition until roughly the deadline or a notify
+        timeout = deadline - time.monotonic()
+        if timeout > 0:
+            condition.wait(timeout)
+
+
+class VirtualClock:
+    # Time only moves when someone sleeps or advances it, so a simulated
+    # night of orders runs as fast as the CPU allows
+    def __init__(self, start=0.0):
+        self._now = start
+        self._lock = threading.Lock()
+
+    def now(self):
+        return self._now
+
+    def advance(self, seconds):
+        with self._lock:
+            self._now += max(seconds, 0)
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def sleep_until(self, deadline):
+        with self._lock:
+            if deadline > self._now:
+                self._now = deadline
+
+    def wait(self, condition, deadline):
+        self.sleep_until(deadline)
+
+
+class PumpDriver:
+    clock = None
+
+    def setup(self, pins):
+        raise NotImplementedError
+
+    def pump_on(self, pin):
+        raise NotImplementedError
+
+    def pump_off(self, pin):
+        raise NotImplementedError
+
+    def switch(self, on=(), off=()):
+        # Switch pins off, then others on, as close to one instant as the
+        # hardware allows. Returns the call latency: seconds spent in the
+        # call, an upper bound on the spread between the first and last edge
+        # and so on how far any pin's pour is off
+        started = time.perf_counter()
+        for pin in off:
+            self.pump_off(pin)
+        for pin in on:
+            self.pump_on(pin)
+        return time.perf_counter() - started
+
+    def cleanup(self):
+        pass
+
+
+class GPIOBank:
+    # GPIO bank 0 of a BCM283x/BCM2711 mapped through /dev/gpiomem. Writing a
+    # pin mask to GPSET0 or GPCLR0 drives every pin in it in one bus write.
+    # Stopping some pumps and starting others takes two writes, one to each
+    # register, so the two groups are a few bus cycles apart
+    GPSET0 = 0x1c
+    GPCLR0 = 0x28
+
+    def __init__(self, path='/dev/gpiomem'):
+        fd = os.open(path, os.O_RDWR | os.O_SYNC)
+        try:
+            self._mem = mmap.mmap(fd, 4096, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+
+    @classmethod
+    def open(cls):
+        # None where the registers are not laid out as expected
+        try:
+            with open('/proc/device-tree/compatible', 'rb') as f:
+                compatible = f.read().split(b'\0')
+            if not any(soc in compatible for soc in BCM_GPIO_SOCS):
+                return None
+            return cls()
+        except OSError:
+            return None
+
+    def write(self, set_mask=0, clear_mask=0):
+        # Set first: on the active-low relays that stops pumps before others start
+        if set_mask:
+            struct.pack_into('<I', self._mem, self.GPSET0, set_mask)
+        if clear_mask:
+            struct.pack_into('<I', self._mem, self.GPCLR0, clear_mask)
+
+    def close(self):
+        self._mem.close()
+
+
+class RPiGPIODriver(PumpDriver):
+    def __init__(self):
+        # Imported here so the rest of the app can load away from a Pi
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        self.clock = MonotonicClock()
+        GPIO.setmode(GPIO.BCM)  # Use Broadcom pin numbering
+        self.bank = GPIOBank.open()  # Multi-pin switching in one write per register, None to fall back to RPi.GPIO
+        self._masks = {}  # Frozen set of pins -> bank 0 mask, so each recipe's mask is built once
+
+    def setup(self, pins):
+        for pin in pins:
+            self.GPIO.setup(pin, self.GPIO.OUT)
+            self.GPIO.output(pin, self.GPIO.HIGH)  # HIGH signal deactivates relay
+
+    def pump_on(self, pin):
+        self.GPIO.output(pin, self.GPIO.LOW)  # Relay is triggered by LOW signal
+
+    def pump_off(self, pin):
+        self.GPIO.output(pin, self.GPIO.HIGH)
+
+    def pin_mask(self, pins):
+        pins = frozenset(pins)
+        mask = self._masks.get(pins)
+        if mask is None:
+            mask = 0
+            for pin in pins:
+                if pin >= 32:
+                    raise ValueError(f"GPIO {pin} is not in bank 0")
+                mask |= 1 << pin
+            self._masks[pins] = mask
+        return mask
+
+    def switch(self, on=(), off=()):
+        started = time.perf_counter()
+        if self.bank is not None:
+            # Active-low: setting a bit stops a pump, clearing it starts one
+            self.bank.write(set_mask=self.pin_mask(off), clear_mask=self.pin_mask(on))
+        else:
+            if off:
+                self.GPIO.output(list(off), self.GPIO.HIGH)
+            if on:
+                self.GPIO.output(list(on), self.GPIO.LOW)
+        return time.perf_counter() - started
+
+    def cleanup(self):
+        if self.bank is not None:
+            self.bank.close()
+        self.GPIO.cleanup()
+
+
+class SimulatedPumpDriver(PumpDriver):
+    def __init__(self, clock=None):
+        self.clock = clock or VirtualClock()
+        self.edges = []
+        self.pins = set()
+        self._on = set()
+        self._lock = threading.Lock()
+
+    def setup(self, pins):
+        with self._lock:
+            self.pins.update(pins)
+            self._on.difference_update(pins)
+
+    def _switch(self, pin, on):
+        with self._lock:
+            if pin not in self.pins:
+                raise ValueError(f"GPIO {pin} has not been set up")
+            if on:
+                self._on.add(pin)
+            else:
+                self._on.discard(pin)
+            self.edges.append(RelayEdge(self.clock.now(), pin, on))
+
+    def pump_on(self, pin):
+        self._switch(pin, True)
+
+    def pump_off(self, pin):
+        self._switch(pin, False)
+
+    def switch(self, on=(), off=()):
+        # Simulated relays all move at the same instant
+        with self._lock:
+            now = self.clock.now()
+            for pins, state in ((off, False), (on, True)):
+                for pin in pins:
+                    if pin not in self.pins:
+                        raise ValueError(f"GPIO {pin} has not been set up")
+                    if state:
+                        self._on.add(pin)
+                    else:
+                        self._on.discard(pin)
+                    self.edges.append(RelayEdge(now, pin, state))
+        return 0.0
+
+    def is_on(self, pin):
+        return pin in self._on
+
+    def active_pins(self):
+        with self._lock:
+            return set(self._on)
+
+    def cleanup(self):
+        with self._lock:
+            for pin in sorted(self._on):
+                self.edges.append(RelayEdge(self.clock.now(), pin, False))
+            self._on.clear()
+
+
+def create_driver(name=None, clock=None):
+    # COCKTAIL_PUMP_DRIVER selects 'gpio' or 'sim'; 'auto' (the default) uses
+    # the relays when RPi.GPIO is importable and the simulator otherwise.
+    # Simulated pumps follow real time unless a VirtualClock is passed in.
+    name = name or os.environ.get('COCKTAIL_PUMP_DRIVER', 'auto')
+    if name == 'gpio':
+        return RPiGPIODriver()
+    if name == 'sim':
+        return SimulatedPumpDriver(clock or MonotonicClock())
+    if name == 'auto':
+        try:
+            return RPiGPIODriver()
+        except ImportError:
+            print("RPi.GPIO not available, using simulated pumps")
+            return SimulatedPumpDriver(clock or MonotonicClock())
+    raise ValueError(f"Unknown pump driver {name!r}")
@@ -0,0 +1,245 @@
+import argparse
+import sys
+import tempfile
+
+import numpy as np
+
+from calibration import DoseCompiler, FlowCalibration
+from catalog import Catalog
+from cocktail_core import OrderRefused, simulated_maker
+from inventory import read_levels
+from order_history import ORDER_HISTORY_FILE, read_counts, read_orders
+from pour_plan import plan_pours
+
+# Capacity planning before an event: how long do guests wait at a given
+# arrival rate, and when does each bottle run out? Thousands of Monte Carlo
+# runs are stepped together, one order at a time, as NumPy arrays with a row
+# per run, so a sweep across arrival rates takes seconds.
+#
+# The model is the order queue itself: an order starts once every pump it
+# needs is free and holds all of them until its whole pour plan is done. A
+# blocked order keeps its pumps reserved, so the start of order n is simply
+# the later of its arrival and the time its pumps are next free. What the
+# model leaves out is the engine's cap on relays across concurrent orders
+# (each recipe is still planned under it); --check replays one run per rate
+# through the real scheduler on simulated pumps to show how much that matters.
+# Lines are assumed primed.
+#
+#   python simulator.py --rates 60 90 120 150 --hours 4 --runs 2000
+#   python simulator.py --replay orders.log
+
+
+class Menu:
+    # The catalog compiled once into arrays indexed by drink and pump
+    def __init__(self, catalog, calibration, max_active=None, popularity=None):
+        self.names = [drink.name for drink in catalog.available_drinks()]
+        self.beverages = sorted(catalog.bottles, key=catalog.bottles.get)
+        pins = [catalog.bottles[beverage] for beverage in self.beverages]
+        compiler = DoseCompiler(calibration, catalog.bottles)
+        self.uses = np.zeros((len(self.names), len(pins)), dtype=bool)
+        self.ml = np.zeros((len(self.names), len(pins)))
+        self.makespan = np.zeros(len(self.names))
+        for index, name in enumerate(self.names):
+            recipe = catalog.drinks[name].recipe
+            for beverage, ml in recipe.items():
+                column = self.beverages.index(beverage)
+                self.uses[index, column] = True
+                self.ml[index, column] = ml
+            self.makespan[index] = plan_pours(compiler.compile(name, recipe), max_active).makespan
+        # Drinks are ordered as often as they were in the past; one extra
+        # order each keeps drinks new to the menu in play
+        weights = np.array([(popularity or {}).get(name, 0) + 1 for name in self.names], dtype=float)
+        self.weights = weights / weights.sum()
+
+    def index(self, drink_name):
+        return self.names.index(drink_name)
+
+
+class SimulationResult:
+    def __init__(self, menu, arrivals, drinks, waits, runout, finished, hours):
+        self.menu = menu
+        self.arrivals = arrivals  # (runs, orders) seconds after opening, inf for padding
+        self.drinks = drinks  # Menu index of what each order asked for
+        self.waits = waits  # Seconds each order waited for its pumps, nan if refused or padding
+        self.runout = runout  # (runs, bottles) first time a bottle could not cover an order, inf if never
+        self.finished = finished  # When each run's last pour was done
+        self.hours = hours
+
+    @property
+    def runs(self):
+        return len(self.arrivals)
+
+    def served_per_hour(self):
+        # Over the event, or until the queue drained if that took longer
+        open_hours = np.maximum(self.finished, self.hours * 3600).sum() / 3600
+        return np.count_nonzero(~np.isnan(self.waits)) / open_hours
+
+    def refused_fraction(self):
+        placed = np.count_nonzero(np.isfinite(self.arrivals))
+        return 1 - np.count_nonzero(~np.isnan(self.waits)) / placed if placed else 0.0
+
+    def wait_percentile(self, q):
+        waits = self.waits[~np.isnan(self.waits)]
+        return float(np.percentile(waits, q)) if len(waits) else 0.0
+
+    def runouts(self):
+        # Bottle -> (share of runs it ran out in, median time it did)
+        result = {}
+        for column, beverage in enumerate(self.menu.beverages):
+            times = self.runout[:, column]
+            ran_out = times[np.isfinite(times)]
+            if len(ran_out):
+                result[beverage] = (len(ran_out) / self.runs, float(np.median(ran_out)))
+        return result
+
+
+def bottle_levels(menu, levels):
+    # Untracked bottles never run out
+    return np.array([levels.get(beverage, np.inf) for beverage in menu.beverages])
+
+
+def poisson_orders(menu, rate, hours, runs, rng):
+    # Arrival times of rate guests/hour over the event and what each orders,
+    # padded with inf to the longest run
+    expected = rate * hours
+    longest = int(expected + 6 * np.sqrt(expected) + 10)
+    arrivals = np.cumsum(rng.exponential(3600.0 / rate, (runs, longest)), axis=1)
+    arrivals[arrivals > hours * 3600] = np.inf
+    drinks = rng.choice(len(menu.names), size=(runs, longest), p=menu.weights)
+    return arrivals, drinks
+
+
+def simulate(menu, arrivals, drinks, levels, hours):
+    runs, orders = arrivals.shape
+    free_at = np.zeros((runs, len(menu.beverages)))  # When each pump's current order lets go of it
+    left = np.broadcast_to(levels, free_at.shape).copy()
+    waits = np.full((runs, orders), np.nan)
+    runout = np.full(free_at.shape, np.inf)
+    finished = np.zeros(runs)
+    for n in range(orders):
+        placed = np.isfinite(arrivals[:, n])
+        at = np.where(placed, arrivals[:, n], 0.0)
+        uses = menu.uses[drinks[:, n]]
+        need = menu.ml[drinks[:, n]]
+        short = (need > left) & placed[:, None]
+        runout = np.where(short & np.isinf(runout), at[:, None], runout)
+        poured = placed & ~short.any(axis=1)
+        start = np.maximum(at, np.where(uses, free_at, 0.0).max(axis=1))
+        end = start + menu.makespan[drinks[:, n]]
+        taken = uses & poured[:, None]
+        free_at = np.where(taken, end[:, None], free_at)
+        left = np.where(poured[:, None], left - need, left)
+        waits[:, n] = np.where(poured, start - at, np.nan)
+        finished = np.where(poured, np.maximum(finished, end), finished)
+    return SimulationResult(menu, arrivals, drinks, waits, runout, finished, hours)
+
+
+def sweep(menu, rates, hours, runs, levels, seed=1):
+    # Every rate's runs go through one simulate call; rate -> SimulationResult
+    rng = np.random.default_rng(seed)
+    streams = [poisson_orders(menu, rate, hours, runs, rng) for rate in rates]
+    width = max(arrivals.shape[1] for arrivals, _ in streams)
+    arrivals = np.full((runs * len(rates), width), np.inf)
+    drinks = np.zeros(arrivals.shape, dtype=int)
+    for index, (rate_arrivals, rate_drinks) in enumerate(streams):
+        rows = slice(index * runs, (index + 1) * runs)
+        arrivals[rows, :rate_arrivals.shape[1]] = rate_arrivals
+        drinks[rows, :rate_drinks.shape[1]] = rate_drinks
+    combined = simulate(menu, arrivals, drinks, levels, hours)
+    results = {}
+    for index, rate in enumerate(rates):
+        rows = slice(index * runs, (index + 1) * runs)
+        results[rate] = SimulationResult(menu, combined.arrivals[rows], combined.drinks[rows],
+                                         combined.waits[rows], combined.runout[rows], combined.finished[rows], hours)
+    return results
+
+
+def replay_stream(menu, path=ORDER_HISTORY_FILE):
+    # A logged evening as a single run; drinks no longer on the menu are left out
+    orders = [(at, drink_name) for at, drink_name in read_orders(path) if drink_name in menu.names]
+    if not orders:
+        return None, None, 0.0
+    opened = orders[0][0]
+    arrivals = np.array([[at - opened for at, _ in orders]])
+    drinks = np.array([[menu.index(drink_name) for _, drink_name in orders]])
+    return arrivals, drinks, arrivals[0, -1] / 3600
+
+
+def exact_waits(catalog, calibration, menu, levels, arrivals, drinks, max_active):
+    # One run through the real scheduler and engine on simulated pumps
+    maker = simulated_maker(tempfile.mkdtemp(prefix='cocktail-sim-'), catalog=catalog, calibration=calibration,
+                            levels={beverage: ml for beverage, ml in zip(menu.beverages, levels) if np.isfinite(ml)},
+                            max_active=max_active)
+    maker.lines.mark_wet(catalog.bottles.values())
+    waits = []
+
+    def place(drink_name):
+        try:
+            maker.order(drink_name, on_start=lambda order: waits.append(order.wait_time))
+        except OrderRefused:
+            pass
+
+    for at, drink in zip(arrivals, drinks):
+        if np.isfinite(at):
+            maker.engine.call_later(at, lambda drink_name=menu.names[drink]: place(drink_name))
+    maker.run_until_idle()
+    maker.shutdown()
+    return np.array(waits)
+
+
+def check(catalog, calibration, menu, levels, result, max_active):
+    modelled = result.waits[0][~np.isnan(result.waits[0])]
+    waits = exact_waits(catalog, calibration, menu, levels, result.arrivals[0], result.drinks[0], max_active)
+    print(f"  first run: wait p95 {np.percentile(modelled, 95) if len(modelled) else 0:.0f} s modelled, "
+          f"{np.percentile(waits, 95) if len(waits) else 0:.0f} s on the real scheduler")
+
+
+def print_result(label, result):
+    print(f"{label}: {result.served_per_hour():.1f} drinks/hour, wait p50 {result.wait_percentile(50):.0f} s, "
+          f"p95 {result.wait_percentile(95):.0f} s, {result.refused_fraction():.1%} refused")
+    for beverage, (share, median) in sorted(result.runouts().items(), key=lambda item: item[1][1]):
+        print(f"  {beverage} runs out in {share:.0%} of runs, after {median / 3600:.1f} h (median)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate waits and bottle levels for an event")
+    parser.add_argument('--rates', nargs='+', type=float, default=[60, 90, 120, 150], help="Guests per hour")
+    parser.add_argument('--hours', type=float, default=4.0)
+    parser.add_argument('--runs', type=int, default=2000)
+    parser.add_argument('--max-active', type=int, default=4, help="Relays allowed on at once")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--history', default=ORDER_HISTORY_FILE, help="Past orders that set drink popularity")
+    parser.add_argument('--replay', metavar='ORDERS_LOG', help="Replay a logged evening instead")
+    parser.add_argument('--flow', nargs='+', default=[], metavar='PIN=ML_PER_S', help="Override flow rates")
+    parser.add_argument('--check', action='store_true', help="Compare one run per rate with the real scheduler")
+    args = parser.parse_args(argv)
+
+    catalog = Catalog.load()
+    calibration = FlowCalibration()
+    for override in args.flow:
+        pin, rate = override.split('=')
+        calibration.set_rate(int(pin), float(rate))  # Only in memory; calibration.json is not saved
+    menu = Menu(catalog, calibration, args.max_active, read_counts(args.history))
+    # The machine's own bottle levels, read without touching its inventory files
+    levels = bottle_levels(menu, read_levels())
+
+    if args.replay:
+        arrivals, drinks, hours = replay_stream(menu, args.replay)
+        if arrivals is None:
+            print(f"No orders for drinks on the menu in {args.replay}")
+            return 1
+        print_result(f"Replay of {arrivals.shape[1]} orders", simulate(menu, arrivals, drinks, levels, hours))
+        if args.check:
+            check(catalog, calibration, menu, levels, simulate(menu, arrivals, drinks, levels, hours), args.max_active)
+        return 0
+
+    results = sweep(menu, args.rates, args.hours, args.runs, levels, args.seed)
+    for rate, result in results.items():
+        print_result(f"{rate:g} guests/hour", result)
+        if args.check:
+            check(catalog, calibration, menu, levels, result, args.max_active)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,152 @@
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections import defaultdict
+
+# Order and pump events go into a fixed-size ring of preallocated arrays, so
+# recording is a handful of stores with no allocation. flush() appends the
+# records gathered since the last flush to a compact binary file in one write;
+# if the ring wraps before a flush the oldest records are dropped and counted.
+TELEMETRY_FILE = 'telemetry.bin'
+RECORD = struct.Struct('<dBih')  # time, event, order id, GPIO pin
+
+TOUCH = 1  # Drink tile tapped
+CONFIRM = 2  # ConfirmPopup accepted
+PUMP_ON = 3
+PUMP_OFF = 4
+DONE = 5  # Last pump of the order switched off
+SESSION = 6  # App started; order ids start again from 1
+
+EVENT_NAMES = {TOUCH: 'touch', CONFIRM: 'confirm', PUMP_ON: 'pump_on', PUMP_OFF: 'pump_off', DONE: 'done',
+               SESSION: 'session'}
+
+
+class Telemetry:
+    def __init__(self, clock=None, capacity=4096, path=TELEMETRY_FILE):
+        self.now = clock.now if clock else time.monotonic
+        self.capacity = capacity
+        self.path = path
+        self._times = array('d', bytes(8 * capacity))
+        self._events = array('B', bytes(capacity))
+        self._orders = array('i', bytes(4 * capacity))
+        self._pins = array('h', bytes(2 * capacity))
+        self._written = 0  # Records ever recorded
+        self._flushed = 0  # Records ever handed to the file
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self.record(SESSION)
+
+    def record(self, event, order_id=0, pin=0, at=None):
+        with self._lock:
+            slot = self._written % self.capacity
+            self._times[slot] = self.now() if at is None else at
+            self._events[slot] = event
+            self._orders[slot] = order_id
+            self._pins[slot] = pin
+            self._written += 1
+
+    def flush(self):
+        with self._lock:
+            start = max(self._flushed, self._written - self.capacity)
+            self.dropped += start - self._flushed
+            chunk = b''.join(
+                RECORD.pack(self._times[i % self.capacity], self._events[i % self.capacity],
+                            self._orders[i % self.capacity], self._pins[i % self.capacity])
+                for i in range(start, self._written))
+            self._flushed = self._written
+        if chunk:
+            with open(self.path, 'ab') as f:
+                f.write(chunk)
+        return len(chunk) // RECORD.size
+
+
+def read_records(path=TELEMETRY_FILE):
+    with open(path, 'rb') as f:
+        data = f.read()
+    usable = len(data) - len(data) % RECORD.size  # Ignore a torn final record
+    return [RECORD.unpack_from(data, offset) for offset in range(0, usable, RECORD.size)]
+
+
+def percentile(values, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not values:
+        return None
+    index = min(int(fraction * len(values) + 0.5), len(values)) - 1
+    return values[max(index, 0)]
+
+
+def summarize(records):
+    latencies = []
+    pours = []
+    touches = {}
+    first_on = {}
+    last_off = {}
+    pump_started = {}
+    pump_time = defaultdict(float)
+    orders = 0
+    span = 0.0  # Monotonic time restarts with every boot, so spans add up per session
+    session_start = session_end = None
+
+    def close_session():
+        nonlocal orders, span
+        if session_start is not None:
+            span += session_end - session_start
+        orders += len(first_on)
+        latencies.extend(first_on[order] - touches[order] for order in first_on if order in touches)
+        pours.extend(last_off[order] - first_on[order] for order in last_off if order in first_on)
+        for dictionary in (touches, first_on, last_off, pump_started):
+            dictionary.clear()
+
+    for at, event, order_id, pin in records:
+        if event == SESSION:
+            close_session()
+            session_start = at
+        elif event == TOUCH:
+            touches[order_id] = at
+        elif event == PUMP_ON:
+            first_on.setdefault(order_id, at)
+            pump_started[pin] = at
+        elif event == PUMP_OFF:
+            last_off[order_id] = at
+            if pin in pump_started:
+                pump_time[pin] += at - pump_started.pop(pin)
+        session_end = at
+    close_session()
+
+    latencies.sort()
+    pours.sort()
+    return {
+        'orders': orders,
+        'touch_to_pour': (percentile(latencies, 0.5), percentile(latencies, 0.95)),
+        'pour_duration': (percentile(pours, 0.5), percentile(pours, 0.95)),
+        'duty_cycle': {pin: on / span for pin, on in sorted(pump_time.items())} if span > 0 else {},
+    }
+
+
+def print_summary(path=TELEMETRY_FILE):
+    if not os.path.exists(path):
+        print(f"No telemetry recorded at {path}")
+        return
+    summary = summarize(read_records(path))
+
+    def seconds(value):
+        return '-' if value is None else f"{value:.2f} s"
+
+    print(f"Orders poured: {summary['orders']}")
+    p50, p95 = summary['touch_to_pour']
+    print(f"Touch to first pump: p50 {seconds(p50)}, p95 {seconds(p95)}")
+    p50, p95 = summary['pour_duration']
+    print(f"Pour duration: p50 {seconds(p50)}, p95 {seconds(p95)}")
+    for pin, duty in summary['duty_cycle'].items():
+        print(f"GPIO {pin} duty cycle: {duty:.1%}")
+
+
+if __name__ == '__main__':
+    # python telemetry.py summary [file]
+    if len(sys.argv) < 2 or sys.argv[1] != 'summary':
+        print("usage: python telemetry.py summary [file]")
+        sys.exit(1)
+    print_summary(sys.argv[2] if len(sys.argv) > 2 else TELEMETRY_FILE)
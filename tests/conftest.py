@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the top of the repository, next to catalog.json
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from catalog import Catalog  # noqa: E402
+from cocktail_core import simulated_maker  # noqa: E402
+
+
+@pytest.fixture
+def catalog():
+    return Catalog.load(os.path.join(REPO, 'catalog.json'))
+
+
+@pytest.fixture
+def maker(tmp_path, catalog):
+    # Simulated pumps on a virtual clock with primed lines, state in tmp_path
+    maker = simulated_maker(str(tmp_path), catalog=catalog, max_active=4)
+    maker.lines.mark_wet(catalog.bottles.values())
+    yield maker
+    maker.shutdown()
@@ -0,0 +1,77 @@
+import asyncio
+import json
+import os
+import struct
+
+# Stand-ins for the asyncio streams a server hands to serve_connection, so
+# the HTTP and WebSocket handlers can be driven without a socket.
+
+
+class MemoryWriter:
+    def __init__(self):
+        self.data = bytearray()
+        self.closed = False
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def memory_reader(data=b'', eof=True):
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    if eof:
+        reader.feed_eof()
+    return reader
+
+
+def http_request(method, path, body=b'', headers=None):
+    headers = dict(headers or {})
+    if body and 'Content-Length' not in headers:
+        headers['Content-Length'] = str(len(body))
+    head = f'{method} {path} HTTP/1.1\r\n' + ''.join(f'{name}: {value}\r\n' for name, value in headers.items())
+    return head.encode() + b'\r\n' + body
+
+
+def parse_response(data):
+    # (status code, decoded JSON body)
+    head, _, body = bytes(data).partition(b'\r\n\r\n')
+    return int(head.split(b' ', 2)[1]), json.loads(body)
+
+
+async def http(server, method, path, body=b'', headers=None):
+    writer = MemoryWriter()
+    await server.serve_connection(memory_reader(http_request(method, path, body, headers)), writer)
+    assert writer.closed
+    return parse_response(writer.data)
+
+
+def client_frame(payload, opcode=0x1):
+    # Masked, as browsers send them
+    mask = os.urandom(4)
+    header = bytes([0x80 | opcode])
+    if len(payload) < 126:
+        header += bytes([0x80 | len(payload)])
+    else:
+        header += bytes([0x80 | 126]) + struct.pack('>H', len(payload))
+    return header + mask + bytes(byte ^ mask[index % 4] for index, byte in enumerate(payload))
+
+
+def server_frames(data):
+    # (opcode, payload) of every unmasked frame in data
+    frames = []
+    data = bytes(data)
+    while data:
+        opcode, length = data[0] & 0x0f, data[1] & 0x7f
+        offset = 2
+        if length == 126:
+            length, = struct.unpack('>H', data[2:4])
+            offset = 4
+        frames.append((opcode, data[offset:offset + length]))
+        data = data[offset + length:]
+    return frames
@@ -0,0 +1,40 @@
+from assets import TextureCache
+
+
+class CountingCache(TextureCache):
+    # Stands in for Kivy: a texture is just the path, and releases are listed
+    def __init__(self, capacity):
+        super().__init__(capacity)
+        self.loads = []
+        self.released = []
+
+    def _load(self, path):
+        self.loads.append(path)
+        return path
+
+    def _release(self, path):
+        self.released.append(path)
+
+
+def test_scrolling_a_large_menu_keeps_the_cache_bounded():
+    cache = CountingCache(capacity=8)
+    paths = [f'icons/drink{index}.png' for index in range(500)]
+    for first in range(len(paths) - 3):
+        for path in paths[first:first + 4]:  # Four tiles on screen
+            assert cache.get(path) == path
+        assert len(cache) <= 8
+    assert len(cache.loads) == 500  # Each icon decoded once on the way through
+    assert len(cache.released) == 492
+    assert paths[0] in cache.released and paths[-1] in cache
+
+
+def test_least_recently_used_icons_go_first():
+    cache = CountingCache(capacity=2)
+    cache.get('a')
+    cache.get('b')
+    cache.get('a')
+    cache.get('c')
+    assert cache.released == ['b']
+    cache.resize(1)
+    assert cache.released == ['b', 'a']
+    assert 'c' in cache
@@ -0,0 +1,51 @@
+from batch import BatchRun
+from cocktail_core import OrderRefused
+
+
+def stock(maker, **levels):
+    for beverage, ml in levels.items():
+        maker.inventory.set_level(beverage, ml)
+
+
+def test_enough_for_all_covers_the_whole_batch(maker):
+    stock(maker, Rum=100, Coke=1000)
+    assert BatchRun(maker, 'Rum & Coke', 3).enough_for_all()
+    assert not BatchRun(maker, 'Rum & Coke', 4).enough_for_all()
+
+
+def test_timed_cup_swaps_pour_the_whole_batch(maker):
+    stock(maker, Rum=1000, Coke=1000)
+    finished = []
+    batch = BatchRun(maker, 'Rum & Coke', 3, on_finished=finished.append, cup_swap_time=5)
+    batch.start()
+    maker.run_until_idle()
+    assert batch.poured == 3
+    assert batch.error is None
+    assert finished == [batch]
+    assert maker.inventory.levels == {'Rum': 910, 'Coke': 730}
+    assert batch.drinks_per_minute() > 0
+
+
+def test_each_pour_waits_for_a_fresh_cup(maker):
+    cups = []
+    batch = BatchRun(maker, 'Rum & Coke', 2, on_cup_needed=cups.append)
+    batch.start()
+    maker.run_until_idle()
+    assert (batch.poured, cups) == (1, [batch])
+    batch.cup_ready()
+    maker.run_until_idle()
+    assert batch.done
+    assert cups == [batch]  # Not asked again after the last pour
+
+
+def test_batch_stops_when_a_bottle_runs_out(maker):
+    stock(maker, Rum=70, Coke=1000)
+    finished = []
+    batch = BatchRun(maker, 'Rum & Coke', 5, on_finished=finished.append, cup_swap_time=5)
+    assert not batch.enough_for_all()
+    batch.start()
+    maker.run_until_idle()
+    assert batch.poured == 2
+    assert isinstance(batch.error, OrderRefused)
+    assert finished == [batch]
+    assert maker.inventory.levels['Rum'] == 10
@@ -0,0 +1,33 @@
+import pytest
+
+import bench
+from conftest import REPO
+
+
+@pytest.fixture(autouse=True)
+def in_repo(monkeypatch):
+    monkeypatch.chdir(REPO)  # The checks pour from catalog.json
+
+
+@pytest.mark.parametrize('check', bench.CHECKS, ids=lambda check: check.__name__)
+def test_pour_path_check(check):
+    check()
+
+
+def test_best_makespan_brute_force():
+    assert bench.best_makespan({1: 30.0, 2: 20.0, 3: 20.0, 4: 10.0}, 2) == 40.0
+
+
+def test_realtime_run_fails_instead_of_hanging(monkeypatch):
+    # An engine that takes orders and never pours them
+    from dispense import DispenseEngine
+    monkeypatch.setattr(DispenseEngine, 'dispense', lambda self, *args, **kwargs: None)
+    with pytest.raises(RuntimeError):
+        bench.bench_realtime(2, pour_seconds=0.01, timeout=0.5)
+
+
+def test_regressions_are_flagged():
+    before = {'throughput': {'drinks_per_hour': 100.0, 'us_per_order': 100.0}}
+    after = {'throughput': {'drinks_per_hour': 99.0, 'us_per_order': 110.0}}
+    flagged = {name for name, _, _, regressed in bench.regressions(before, after) if regressed}
+    assert flagged == {'throughput.drinks_per_hour'}
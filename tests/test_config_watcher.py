@@ -0,0 +1,98 @@
+import json
+import os
+
+import pytest
+
+from config_watcher import ConfigWatcher
+from conftest import REPO
+
+
+@pytest.fixture
+def watched(tmp_path, maker):
+    # The maker's catalog copied next to its calibration, and a watcher on both
+    catalog_path = tmp_path / 'catalog.json'
+    catalog_path.write_text(open(os.path.join(REPO, 'catalog.json')).read())
+    changes = []
+    watcher = ConfigWatcher(maker, str(catalog_path), maker.calibration.path,
+                            on_change=lambda drinks, pins: changes.append((drinks, pins)))
+    return watcher, changes
+
+
+def edit(path, text):
+    # Stamped a second later, as a save in an editor would be
+    stamp = os.stat(path).st_mtime_ns + 1_000_000_000 if os.path.exists(path) else 0
+    with open(path, 'w') as f:
+        f.write(text)
+    if stamp:
+        os.utime(path, ns=(stamp, stamp))
+
+
+def edit_catalog(watcher, change):
+    with open(watcher.catalog_path) as f:
+        data = json.load(f)
+    change(data)
+    edit(watcher.catalog_path, json.dumps(data))
+
+
+def test_recipe_edits_reach_the_next_order(watched, maker):
+    watcher, changes = watched
+    watcher.poll()
+    assert changes == []
+    edit_catalog(watcher, lambda data: data['drinks'][0]['recipe'].update(Rum=45))
+    watcher.poll()
+    assert changes == [({'Rum & Coke'}, set())]
+    assert maker.catalog.drinks['Rum & Coke'].recipe['Rum'] == 45
+    assert maker.order('Rum & Coke').durations[9] == 45 / maker.calibration.rate(9)
+
+
+def test_moving_a_bottle_waits_until_nothing_pours(watched, maker):
+    watcher, changes = watched
+    maker.order('Rum & Coke')
+    edit_catalog(watcher, lambda data: data['bottles'].update(Rum=5))
+    watcher.poll()
+    assert watcher.pending is not None
+    assert maker.catalog.bottles['Rum'] == 9
+    maker.run_until_idle()
+    watcher.poll()
+    assert watcher.pending is None
+    assert maker.catalog.bottles['Rum'] == 5
+    assert changes[0][1] == {5, 9}
+
+
+def test_calibration_edits_apply_in_place(watched, maker):
+    watcher, _ = watched
+    version = maker.calibration.version
+    edit(maker.calibration.path, '{"9": 3.0}')
+    watcher.poll()
+    assert maker.calibration.rate(9) == 3.0
+    assert maker.calibration.version > version
+    assert maker.order('Rum & Coke').durations[9] == 10.0
+
+
+@pytest.mark.parametrize('text', ['[1.5, 2.0]', '7', '{"9": null}', '{"9": 0}', '{"9": "fast"}', '{"pump": 2}',
+                                  '{"9": 2.'])
+def test_a_malformed_calibration_keeps_the_old_rates(watched, maker, text):
+    watcher, _ = watched
+    edit(maker.calibration.path, '{"9": 3.0}')
+    watcher.poll()
+    edit(maker.calibration.path, text)
+    watcher.poll()
+    assert watcher.error.startswith('Ignoring')
+    assert maker.calibration.rates == {9: 3.0}
+    edit(maker.calibration.path, '{"9": 2.0}')
+    watcher.poll()
+    assert watcher.error is None
+    assert maker.calibration.rates == {9: 2.0}
+
+
+@pytest.mark.parametrize('text', ['[]', '{"drinks": 3}', '{"drinks": [["Rum & Coke"]]}', '{"drinks": [{"name": "X"}]}',
+                                  '{"drinks": [], "bottles": ["Rum"]}', '{"drinks": [], "bottles": {"Rum": "nine"}}',
+                                  '{"drinks": [{"name": "X", "recipe": {"Rum": "lots"}}]}', '{"drinks": ['])
+def test_a_malformed_catalog_is_ignored(watched, maker, text):
+    watcher, changes = watched
+    catalog = maker.catalog
+    edit(watcher.catalog_path, text)
+    watcher.poll()
+    assert watcher.error.startswith('Ignoring')
+    assert maker.catalog is catalog
+    assert changes == []
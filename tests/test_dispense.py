@@ -0,0 +1,30 @@
+import pytest
+
+from cocktail_core import OrderRefused
+
+
+def broken_switch(on=(), off=()):
+    raise OSError("relay board unplugged")
+
+
+def test_a_failing_driver_fails_every_outstanding_order(maker):
+    maker.inventory.set_level('Rum', 1000)
+    maker.inventory.set_level('Vodka', 1000)
+    failed = []
+    orders = [maker.order(name, on_failed=failed.append)
+              for name in ('Rum & Coke', 'Vodka Cranberry', 'Cranberry Rum')]
+    assert [order.started_at is not None for order in orders] == [True, True, False]
+    assert maker.inventory.reserved == {'Rum': 60, 'Coke': 90, 'Vodka': 30, 'Cranberry': 180}
+
+    maker.driver.switch = broken_switch  # pump_off still works, as after a glitch on the bus
+    maker.run_until_idle()
+
+    assert sorted(order.order_id for order in failed) == [order.order_id for order in orders]
+    assert all(isinstance(order.error, OSError) and order.finished_at is None for order in orders)
+    assert maker.scheduler.idle()
+    assert maker.scheduler.pins_free_in() == {}
+    assert maker.inventory.reserved == {}
+    assert maker.inventory.levels == {'Rum': 1000, 'Vodka': 1000}
+    assert maker.driver.active_pins() == set()
+    with pytest.raises(OrderRefused):
+        maker.order('Rum & Coke')
@@ -0,0 +1,69 @@
+import asyncio
+
+from conftest import REPO
+from fleet import FleetCoordinator, simulated_units
+from memory_streams import http
+
+
+def run_fleet(tmp_path, monkeypatch, scenario, count=2):
+    # Simulated units pouring in real time behind order servers on Unix sockets
+    monkeypatch.chdir(REPO)  # They load catalog.json from the working directory
+    units, servers = simulated_units(count, max_active=4)
+    coordinator = FleetCoordinator(units, path=str(tmp_path / 'fleet.sock'))
+
+    async def main():
+        await coordinator.start()
+        try:
+            await scenario(coordinator, units, servers)
+        finally:
+            await coordinator.close()
+
+    try:
+        asyncio.run(main())
+    finally:
+        for server in servers:
+            server.stop()
+            server.cocktail_maker.shutdown()
+
+
+def test_orders_spread_over_the_units(tmp_path, monkeypatch):
+    async def scenario(coordinator, units, servers):
+        orders = [await coordinator.place('Rum & Coke') for _ in range(4)]
+        assert {order.unit.name for order in orders} == {unit.name for unit in units}
+        code, status = await http(coordinator, 'GET', f'/orders/{orders[0].order_id}')
+        assert code == 200 and status['status'] == 'pouring'
+
+    run_fleet(tmp_path, monkeypatch, scenario)
+
+
+def test_queued_orders_move_when_a_unit_stops_answering(tmp_path, monkeypatch):
+    async def scenario(coordinator, units, servers):
+        # One Rum & Coke pours on each unit, the rest wait behind it
+        orders = [await coordinator.place('Rum & Coke') for _ in range(6)]
+        lost, remaining = units
+        stranded = [order for order in orders if order.unit is lost and order.queued]
+        assert stranded
+        stranded_ids = {order.unit_order_id for order in stranded}
+
+        servers[0].stop()
+        await coordinator.poll()
+
+        assert not lost.alive
+        assert lost.rerouted == stranded_ids
+        waiting = set(servers[1].cocktail_maker.scheduler.waiting_ids())
+        for order in stranded:
+            assert order.unit is remaining and order.moves == 1 and not order.failed
+            assert order.unit_order_id in waiting
+        code, menu = await http(coordinator, 'GET', '/menu')
+        assert code == 200 and 'Rum & Coke' in menu
+
+    run_fleet(tmp_path, monkeypatch, scenario)
+
+
+def test_malformed_orders_get_an_answer(tmp_path, monkeypatch):
+    async def scenario(coordinator, units, servers):
+        assert (await http(coordinator, 'POST', '/orders', b'{"drink": ["x"]}'))[0] == 400
+        assert (await http(coordinator, 'POST', '/orders', b'{}', {'Content-Length': 'abc'}))[0] == 400
+        assert (await http(coordinator, 'POST', '/orders', b'{"drink": "Nothing"}'))[0] == 409
+
+    run_fleet(tmp_path, monkeypatch, scenario, count=1)
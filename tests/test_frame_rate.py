@@ -0,0 +1,19 @@
+from frame_rate import max_fps, set_max_fps
+
+
+class ClockWithCap:
+    _max_fps = 60.0
+
+
+def test_the_cap_is_changed_in_place():
+    clock = ClockWithCap()
+    assert set_max_fps(clock, 10)
+    assert max_fps(clock) == 10
+
+
+def test_a_clock_without_the_cap_is_left_alone(capsys):
+    clock = object()
+    assert not set_max_fps(clock, 10)
+    assert not set_max_fps(clock, 60)
+    assert capsys.readouterr().out.count('_max_fps') <= 1
+    assert max_fps(clock) == 0
@@ -0,0 +1,76 @@
+from inventory import Inventory, read_levels
+
+
+def open_inventory(tmp_path):
+    return Inventory(str(tmp_path / 'inventory.json'), str(tmp_path / 'inventory.log'))
+
+
+def test_pours_leave_unmeasured_bottles_untracked(tmp_path):
+    inventory = open_inventory(tmp_path)
+    inventory.set_level('Rum', 700)
+    inventory.deduct({'Rum': 30, 'Coke': 90})
+    assert inventory.levels == {'Rum': 670}
+    assert inventory.can_pour({'Coke': 1000})
+    inventory.close()
+
+    recovered = open_inventory(tmp_path)
+    assert recovered.levels == {'Rum': 670}
+    recovered.close()
+
+
+def test_over_poured_bottles_stay_empty_after_a_restart(tmp_path):
+    inventory = open_inventory(tmp_path)
+    inventory.set_level('Rum', 20)
+    inventory.deduct({'Rum': 30})  # Priming a dry line can take more than was measured
+    inventory._compact()
+    inventory.close()
+
+    recovered = open_inventory(tmp_path)
+    assert recovered.levels == {'Rum': -10}
+    assert not recovered.can_pour({'Rum': 1})
+    recovered.close()
+
+
+def test_replay_skips_a_torn_last_line(tmp_path):
+    inventory = open_inventory(tmp_path)
+    inventory.set_level('Rum', 700)
+    inventory.deduct({'Rum': 30})
+    inventory.close()
+    with open(tmp_path / 'inventory.log', 'a') as f:
+        f.write('{"op":"pour","ml":{"Rum"')
+
+    recovered = open_inventory(tmp_path)
+    assert recovered.levels == {'Rum': 670}
+    recovered.deduct({'Rum': 30})
+    recovered.close()
+    assert open_inventory(tmp_path).levels == {'Rum': 640}
+
+
+def test_reservations_hold_back_what_queued_orders_pour(tmp_path):
+    inventory = open_inventory(tmp_path)
+    inventory.set_level('Rum', 100)
+    assert inventory.reserve({'Rum': 30})
+    assert inventory.reserve({'Rum': 30})
+    assert inventory.reserve({'Rum': 30})
+    assert not inventory.reserve({'Rum': 30})
+    inventory.release({'Rum': 30})
+    inventory.deduct({'Rum': 30}, reserved={'Rum': 30})
+    assert inventory.levels == {'Rum': 70}
+    assert inventory.available('Rum') == 40
+    inventory.close()
+
+
+def test_read_levels_leaves_the_files_alone(tmp_path):
+    inventory = open_inventory(tmp_path)
+    inventory.set_level('Rum', 500)
+    inventory.deduct({'Rum': 30})
+    inventory.close()
+    log = tmp_path / 'inventory.log'
+    with open(log, 'a') as f:
+        f.write('{"op":"pour","ml":{"Rum":')
+    torn = log.read_bytes()
+
+    assert read_levels(str(tmp_path / 'inventory.json'), str(log)) == {'Rum': 470}
+    assert log.read_bytes() == torn
+    assert read_levels(str(tmp_path / 'missing.json'), str(tmp_path / 'missing.log')) == {}
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['inventory.log']
@@ -0,0 +1,153 @@
+import asyncio
+import base64
+import hashlib
+import json
+
+import pytest
+
+from memory_streams import MemoryWriter, client_frame, http, memory_reader, server_frames
+from order_server import WEBSOCKET_GUID, OrderServer
+
+
+@pytest.fixture
+def server(maker, tmp_path):
+    return OrderServer(maker, path=str(tmp_path / 'orders.sock'))
+
+
+def run(server, scenario):
+    async def main():
+        await server.start()
+        try:
+            await scenario()
+        finally:
+            await server.close()
+    asyncio.run(main())
+
+
+async def settle():
+    # Let orders placed on the executor and callbacks handed over from the
+    # dispense side run
+    for _ in range(5):
+        await asyncio.sleep(0.01)
+
+
+def test_order_is_queued_poured_and_reported(server, maker):
+    async def scenario():
+        code, menu = await http(server, 'GET', '/menu')
+        assert code == 200 and 'Rum & Coke' in menu
+        code, first = await http(server, 'POST', '/orders', b'{"drink": "Rum & Coke"}')
+        assert code == 202 and first['status'] == 'pouring'
+        code, second = await http(server, 'POST', '/orders', b'{"drink": "Rum & Coke"}')
+        assert code == 202 and second['status'] == 'queued' and second['position'] == 1
+        maker.run_until_idle()
+        await settle()
+        code, status = await http(server, 'GET', f"/orders/{second['order']}")
+        assert code == 200 and status['status'] == 'done'
+        assert (await http(server, 'GET', '/orders/999'))[0] == 404
+
+    run(server, scenario)
+
+
+def test_queued_orders_can_be_withdrawn(server, maker):
+    maker.inventory.set_level('Rum', 60)
+
+    async def scenario():
+        _, pouring = await http(server, 'POST', '/orders', b'{"drink": "Rum & Coke"}')
+        _, queued = await http(server, 'POST', '/orders', b'{"drink": "Rum & Coke"}')
+        assert (await http(server, 'POST', '/orders', b'{"drink": "Rum & Coke"}'))[0] == 409
+        assert (await http(server, 'DELETE', f"/orders/{pouring['order']}"))[0] == 409
+        code, status = await http(server, 'DELETE', f"/orders/{queued['order']}")
+        assert code == 200 and status['status'] == 'cancelled'
+        # The rum it had reserved can be ordered again
+        assert (await http(server, 'POST', '/orders', b'{"drink": "Rum & Coke"}'))[0] == 202
+
+    run(server, scenario)
+
+
+@pytest.mark.parametrize('body, headers, code', [
+    (b'{"drink": ["x"]}', None, 400),
+    (b'{"drink": 7}', None, 400),
+    (b'["Rum & Coke"]', None, 400),
+    (b'not json', None, 400),
+    (b'\xff\xfe', None, 400),
+    (b'{}', {'Content-Length': 'abc'}, 400),
+    (b'{}', {'Content-Length': '-5'}, 400),
+    (b'{}', {'Content-Length': '100000'}, 413),
+    (b'{"drink": "Nothing"}', None, 409),
+])
+def test_malformed_orders_get_an_answer(server, body, headers, code):
+    async def scenario():
+        reply_code, reply = await http(server, 'POST', '/orders', body, headers)
+        assert reply_code == code and 'error' in reply
+
+    run(server, scenario)
+
+
+def test_websocket_pushes_every_status_change(server, maker):
+    async def scenario():
+        key = base64.b64encode(b'0123456789abcdef').decode()
+        reader = memory_reader(f'GET /ws HTTP/1.1\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                               f'Sec-WebSocket-Key: {key}\r\n\r\n'.encode(), eof=False)
+        writer = MemoryWriter()
+        task = asyncio.ensure_future(server.serve_connection(reader, writer))
+        await settle()
+        head, _, _ = bytes(writer.data).partition(b'\r\n\r\n')
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest())
+        assert head.startswith(b'HTTP/1.1 101') and accept in head
+        del writer.data[:len(head) + 4]
+
+        reader.feed_data(client_frame(b'{"drink": "Rum & Coke"}') + client_frame(b'{"drink": "Rum & Coke"}')
+                         + client_frame(b'{"drink": 1}'))
+        await settle()
+        maker.run_until_idle()
+        await settle()
+        reader.feed_data(client_frame(b'', 0x8))
+        reader.feed_eof()
+        await task
+
+        frames = server_frames(writer.data)
+        assert frames[-1][0] == 0x8
+        messages = [json.loads(payload) for opcode, payload in frames if opcode == 0x1]
+        assert {'error': 'Expected {"drink": name}'} in messages
+        updates = {}
+        for message in messages:
+            if 'order' in message:
+                # The same state can be pushed twice, e.g. on placing and on starting
+                changes = updates.setdefault(message['order'], [])
+                if not changes or changes[-1] != (message['status'], message['position']):
+                    changes.append((message['status'], message['position']))
+        first, second = sorted(updates)
+        assert updates[first] == [('pouring', 0), ('done', 0)]
+        # The virtual clock pours it in one go, so 'pouring' may already read 'done'
+        assert updates[second][0] == ('queued', 1) and updates[second][-1] == ('done', 0)
+        assert writer.closed
+
+    run(server, scenario)
+
+
+def test_settled_orders_expire_after_the_history(server, maker):
+    server.history = 2
+    maker.inventory.set_level('Rum', 1000)
+
+    async def scenario():
+        _, pouring = await http(server, 'POST', '/orders', b'{"drink": "Rum & Coke"}')
+        _, withdrawn = await http(server, 'POST', '/orders', b'{"drink": "Rum & Coke"}')
+        assert (await http(server, 'DELETE', f"/orders/{withdrawn['order']}"))[0] == 200
+        maker.run_until_idle()
+        await settle()
+        assert set(server.orders) == {pouring['order'], withdrawn['order']}
+        for _ in range(2):
+            await http(server, 'POST', '/orders', b'{"drink": "Rum & Coke"}')
+            maker.run_until_idle()
+            await settle()
+        assert len(server.orders) == 2
+        assert (await http(server, 'GET', f"/orders/{withdrawn['order']}"))[0] == 404
+
+    run(server, scenario)
+
+
+def test_a_slow_websocket_client_loses_the_oldest_message(server):
+    outgoing = asyncio.Queue(2)
+    for message in ('one', 'two', 'three'):
+        server._offer(outgoing, message)
+    assert [outgoing.get_nowait() for _ in range(2)] == ['two', 'three']
@@ -0,0 +1,97 @@
+import pytest
+
+from cocktail_core import OrderRefused, simulated_maker
+from priming import DEFAULT_DEAD_VOLUME, LineState
+
+
+@pytest.fixture
+def dry_maker(tmp_path, catalog):
+    # Bottles just loaded: every line still empty, two relays at a time
+    maker = simulated_maker(str(tmp_path), catalog=catalog, max_active=2)
+    yield maker
+    maker.shutdown()
+
+
+def most_on_at_once(edges):
+    on = set()
+    most = 0
+    for edge in edges:
+        if edge.on:
+            on.add(edge.pin)
+        else:
+            on.discard(edge.pin)
+        most = max(most, len(on))
+    return most
+
+
+def test_line_states_survive_a_restart(tmp_path):
+    path = str(tmp_path / 'lines.json')
+    lines = LineState(path)
+    lines.dead_volumes[9] = 12.0
+    lines.mark_wet([9, 27])
+    lines.mark_dry([27])
+    again = LineState(path)
+    assert again.is_wet(9) and not again.is_wet(27)
+    assert again.dry_pins([9, 27, 2]) == [27, 2]
+    assert (again.dead_volume(9), again.dead_volume(27)) == (12.0, DEFAULT_DEAD_VOLUME)
+
+
+def test_only_the_first_pour_on_a_dry_line_fills_it(dry_maker):
+    dry_maker.inventory.set_level('Rum', 1000)
+    dry_maker.lines.mark_wet([27])
+    fill = dry_maker.lines.fill_times([9], dry_maker.calibration)[9]
+    plain = 30 / dry_maker.calibration.rate(9)
+
+    first = dry_maker.order('Rum & Coke')
+    assert first.durations[9] == pytest.approx(plain + fill)
+    assert first.durations[27] == pytest.approx(90 / dry_maker.calibration.rate(27))
+    dry_maker.run_until_idle()
+    assert dry_maker.lines.is_wet(9)
+    assert dry_maker.inventory.levels['Rum'] == pytest.approx(1000 - 30 - DEFAULT_DEAD_VOLUME)
+
+    second = dry_maker.order('Rum & Coke')
+    assert second.durations[9] == pytest.approx(plain)
+    dry_maker.run_until_idle()
+    assert dry_maker.inventory.levels['Rum'] == pytest.approx(1000 - 60 - DEFAULT_DEAD_VOLUME)
+
+
+def test_prime_all_fills_every_line_under_the_relay_cap(dry_maker, catalog):
+    dry_maker.inventory.set_level('Rum', 100)
+    order = dry_maker.prime_all()
+    dry_maker.run_until_idle()
+    assert order.finished_at is not None
+    assert most_on_at_once(dry_maker.driver.edges) == 2
+    assert {edge.pin for edge in dry_maker.driver.edges} == set(catalog.bottles.values())
+    assert not dry_maker.lines.dry_pins(catalog.bottles.values())
+    assert dry_maker.inventory.levels['Rum'] == pytest.approx(100 - DEFAULT_DEAD_VOLUME)
+    assert dry_maker.prime_all() is None
+
+
+def test_purge_empties_the_lines_under_the_relay_cap(dry_maker, catalog):
+    pins = sorted(catalog.bottles.values())
+    dry_maker.lines.mark_wet(pins)
+    dry_maker.purge(pins)
+    dry_maker.run_until_idle()
+    assert most_on_at_once(dry_maker.driver.edges) == 2
+    assert dry_maker.lines.dry_pins(pins) == pins
+
+
+def test_bottles_are_not_swapped_under_a_running_pump(maker):
+    maker.order('Rum & Coke')
+    queued = maker.order('Rum & Coke')
+    with pytest.raises(OrderRefused):
+        maker.swap_bottle('Gin', 9)
+    with pytest.raises(OrderRefused):
+        maker.swap_bottle('Rum', 5)  # Its old pump is still wanted
+    maker.cancel(queued)
+    maker.run_until_idle()
+    maker.swap_bottle('Gin', 9)
+    assert maker.catalog.bottles['Gin'] == 9
+    assert not maker.lines.is_wet(9)
+
+
+def test_a_dry_line_counts_against_the_menu(dry_maker):
+    dry_maker.inventory.set_level('Rum', 35)
+    assert not dry_maker.can_make('Rum & Coke')  # 30 ml plus the tubing it fills
+    dry_maker.lines.mark_wet([9])
+    assert dry_maker.can_make('Rum & Coke')
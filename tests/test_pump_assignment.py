@@ -0,0 +1,64 @@
+import random
+import time
+
+from calibration import FlowCalibration
+from catalog import Catalog, Drink
+from pump_assignment import recommend
+
+
+def drinks(*recipes):
+    return [Drink(name, None, {beverage: 30 for beverage in beverages}) for name, beverages in recipes]
+
+
+def uncalibrated(tmp_path):
+    return FlowCalibration(str(tmp_path / 'calibration.json'))
+
+
+def test_the_least_used_bottle_makes_room_for_the_busiest_drink(tmp_path):
+    catalog = Catalog(drinks(('Rum & Coke', ['Rum', 'Coke']), ('Coke', ['Coke']), ('Vodka Tonic', ['Vodka', 'Tonic'])),
+                      {'Rum': 1, 'Coke': 2, 'Vodka': 3})
+    demand = {'Rum & Coke': 1, 'Coke': 2, 'Vodka Tonic': 10}
+    result = recommend(catalog, demand, [1, 2, 3], uncalibrated(tmp_path))
+    assert result.swaps == [('Rum', 'Tonic', 1)]
+    assert result.assignment == {'Tonic': 1, 'Coke': 2, 'Vodka': 3}
+    assert (result.served, result.total) == (12, 13)
+
+
+def test_bottles_stay_when_no_swap_pays(tmp_path):
+    catalog = Catalog(drinks(('Rum & Coke', ['Rum', 'Coke']), ('Vodka Tonic', ['Vodka', 'Tonic'])),
+                      {'Rum': 1, 'Coke': 2})
+    result = recommend(catalog, {'Rum & Coke': 3, 'Vodka Tonic': 3}, [1, 2], uncalibrated(tmp_path))
+    assert result.swaps == []
+    assert result.assignment == {'Rum': 1, 'Coke': 2}
+
+
+def test_a_drink_missing_two_bottles_gets_both(tmp_path):
+    # Loading only Gin or only Tonic serves nothing, so no single swap helps
+    catalog = Catalog(drinks(('Rum & Coke', ['Rum', 'Coke']), ('Gin & Tonic', ['Gin', 'Tonic'])),
+                      {'Rum': 1, 'Coke': 2})
+    result = recommend(catalog, {'Rum & Coke': 1, 'Gin & Tonic': 5}, [1, 2], uncalibrated(tmp_path))
+    assert set(result.assignment) == {'Gin', 'Tonic'}
+    assert sorted(pin for _, _, pin in result.swaps) == [1, 2]
+    assert (result.served, result.total) == (5, 6)
+
+
+def test_a_pair_move_keeps_the_bottles_its_drink_shares(tmp_path):
+    catalog = Catalog(drinks(('Mule', ['Vodka', 'Ginger', 'Lime']), ('Vodka Coke', ['Vodka', 'Coke']),
+                             ('Rum & Coke', ['Rum', 'Coke'])),
+                      {'Vodka': 1, 'Coke': 2, 'Rum': 3})
+    result = recommend(catalog, {'Mule': 10, 'Vodka Coke': 1, 'Rum & Coke': 1}, [1, 2, 3], uncalibrated(tmp_path))
+    assert result.assignment['Vodka'] == 1
+    assert set(result.assignment) == {'Vodka', 'Ginger', 'Lime'}
+    assert result.served == 10
+
+
+def test_five_thousand_recipes_take_well_under_a_second(tmp_path):
+    rng = random.Random(7)
+    beverages = [f'Beverage {index}' for index in range(60)]
+    catalog = Catalog(drinks(*[(f'Drink {index}', rng.sample(beverages, rng.randint(2, 4))) for index in range(5000)]),
+                      {beverage: pin for pin, beverage in enumerate(beverages[:8])})
+    demand = {name: rng.randint(0, 20) for name in catalog.drinks}
+    started = time.perf_counter()
+    result = recommend(catalog, demand, list(range(8)), uncalibrated(tmp_path))
+    assert time.perf_counter() - started < 0.5
+    assert result.served > 0
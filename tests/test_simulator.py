@@ -0,0 +1,13 @@
+import os
+import shutil
+
+from conftest import REPO
+from simulator import main
+
+
+def test_simulating_an_event_writes_no_machine_state(tmp_path, monkeypatch, capsys):
+    shutil.copy(os.path.join(REPO, 'catalog.json'), tmp_path)
+    monkeypatch.chdir(tmp_path)
+    assert main(['--rates', '60', '--hours', '1', '--runs', '20', '--flow', '9=2.0']) == 0
+    assert '60 guests/hour' in capsys.readouterr().out
+    assert os.listdir(tmp_path) == ['catalog.json']
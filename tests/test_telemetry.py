@@ -0,0 +1,72 @@
+import pytest
+
+import telemetry
+from pump_driver import VirtualClock
+from telemetry import Telemetry, percentile, read_records, summarize
+
+
+def test_records_reach_the_file_in_order(tmp_path):
+    path = str(tmp_path / 'telemetry.bin')
+    log = Telemetry(VirtualClock(), capacity=8, path=path)
+    log.record(telemetry.PUMP_ON, 1, 9, at=1.0)
+    assert log.flush() == 2
+    log.record(telemetry.PUMP_OFF, 1, 9, at=2.0)
+    assert log.flush() == 1
+    assert log.flush() == 0
+    assert read_records(path) == [(0.0, telemetry.SESSION, 0, 0), (1.0, telemetry.PUMP_ON, 1, 9),
+                                  (2.0, telemetry.PUMP_OFF, 1, 9)]
+
+
+def test_a_wrapped_ring_keeps_the_newest_records_and_counts_the_rest(tmp_path):
+    path = str(tmp_path / 'telemetry.bin')
+    log = Telemetry(VirtualClock(), capacity=4, path=path)
+    for order_id in range(1, 10):
+        log.record(telemetry.DONE, order_id, at=float(order_id))
+    assert log.flush() == 4
+    assert log.dropped == 6
+    assert [record[2] for record in read_records(path)] == [6, 7, 8, 9]
+    # After the wrap the ring carries on from where it was flushed
+    log.record(telemetry.DONE, 10, at=10.0)
+    log.record(telemetry.DONE, 11, at=11.0)
+    assert log.flush() == 2
+    assert log.dropped == 6
+    assert [record[2] for record in read_records(path)] == [6, 7, 8, 9, 10, 11]
+
+
+def test_a_torn_final_record_is_ignored(tmp_path):
+    path = str(tmp_path / 'telemetry.bin')
+    log = Telemetry(VirtualClock(), capacity=4, path=path)
+    log.flush()
+    with open(path, 'ab') as f:
+        f.write(b'\x00' * (telemetry.RECORD.size - 1))
+    assert len(read_records(path)) == 1
+
+
+def test_percentiles_use_the_nearest_rank():
+    values = list(range(1, 21))
+    assert percentile(values, 0.5) == 10
+    assert percentile(values, 0.95) == 19
+    assert percentile(values, 1.0) == 20
+    assert percentile([7], 0.95) == 7
+    assert percentile([], 0.5) is None
+
+
+def test_summary_of_two_sessions():
+    records = [
+        (0.0, telemetry.SESSION, 0, 0),
+        (1.0, telemetry.TOUCH, 1, 0),
+        (1.5, telemetry.PUMP_ON, 1, 9),
+        (1.5, telemetry.PUMP_ON, 1, 27),
+        (4.5, telemetry.PUMP_OFF, 1, 9),
+        (10.0, telemetry.PUMP_OFF, 1, 27),
+        # Order ids start again from 1 after a restart
+        (0.0, telemetry.SESSION, 0, 0),
+        (2.0, telemetry.TOUCH, 1, 0),
+        (2.5, telemetry.PUMP_ON, 1, 9),
+        (10.0, telemetry.PUMP_OFF, 1, 9),
+    ]
+    summary = summarize(records)
+    assert summary['orders'] == 2
+    assert summary['touch_to_pour'] == (0.5, 0.5)
+    assert summary['pour_duration'] == (7.5, 8.5)
+    assert summary['duty_cycle'] == {9: pytest.approx(10.5 / 20), 27: pytest.approx(8.5 / 20)}
@@ -0,0 +1,25 @@
+import pytest
+
+from ui_profiler import UIProfiler
+
+
+def test_stop_leaves_kivy_as_it_was():
+    pytest.importorskip('kivy')
+    from kivy.cache import Cache
+    from kivy.clock import Clock
+
+    append = Cache.__dict__['append']
+    Cache.register('kv.atlas')
+    profiler = UIProfiler()
+    profiler.start()
+    Cache.append('kv.atlas', 'while profiling', object())
+    assert [event['label'] for event in profiler.events] == ['kv.atlas while profiling']
+    scheduled = [event.get_callback() for event in Clock.get_events()]
+    assert profiler._frame in scheduled
+
+    profiler.stop()
+    assert Cache.__dict__['append'] is append
+    Cache.append('kv.atlas', 'after stopping', object())
+    assert len(profiler.events) == 1
+    assert profiler._frame not in [event.get_callback() for event in Clock.get_events()]
+    profiler.stop()  # A second stop does nothing
@@ -0,0 +1,282 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from array import array
+from collections import defaultdict
+
+from frame_rate import max_fps
+from telemetry import percentile
+
+# Frame-time profiling for the touchscreen UI, off unless COCKTAIL_UI_PROFILE
+# is set (to 'overlay' to also draw the numbers on screen). It records every
+# frame's time with the screen it was drawn on; each screen transition from
+# the moment ScreenManager.current changes until its animation has finished;
+# screens built on first use; marks such as the loading animation starting;
+# and every image and texture entering Kivy's cache, i.e. each decode and
+# upload, with the frame it landed in. The numbers go to ui_profile.json when
+# the app stops, tagged with the build, so runs can be compared:
+#   python ui_profiler.py summary [ui_profile.json]
+#   python ui_profiler.py compare before.json after.json
+UI_PROFILE_FILE = 'ui_profile.json'
+JANK_MS = 1000 / 30  # A frame slower than this shows as a stutter
+CACHE_CATEGORIES = ('kv.image', 'kv.texture', 'kv.atlas')
+
+
+def build_id():
+    # COCKTAIL_BUILD, else the git commit being run
+    if os.environ.get('COCKTAIL_BUILD'):
+        return os.environ['COCKTAIL_BUILD']
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def frame_stats(frames):
+    frames = sorted(frames)
+    if not frames:
+        return None
+    return {
+        'frames': len(frames),
+        'mean_ms': sum(frames) / len(frames),
+        'p50_ms': percentile(frames, 0.5),
+        'p95_ms': percentile(frames, 0.95),
+        'p99_ms': percentile(frames, 0.99),
+        'max_ms': frames[-1],
+        'janky': sum(1 for frame in frames if frame > JANK_MS),
+    }
+
+
+class UIProfiler:
+    frame_capacity = 36000  # About ten minutes at 60 fps; older frames are dropped
+    overlay_interval = 0.5  # Seconds between overlay updates
+
+    def __init__(self, path=UI_PROFILE_FILE, overlay=False):
+        self.path = path
+        self.show_overlay = overlay
+        self.frames = array('f')  # Milliseconds per frame
+        self.frame_screens = array('B')  # Index into screens of what each frame showed
+        self.screens = []
+        self.transitions = []
+        self.events = []  # Screen builds, marks and cache loads
+        self.sm = None
+        self.overlay = None
+        self._started = time.perf_counter()
+        self._transition = None
+        self._unresolved = []  # Events waiting for the next frame's time
+        self._current = None
+        self._clock = None
+        self._cache_append = None  # Cache.append as it was before start()
+
+    def start(self):
+        # Before anything is loaded, so the first screen's images count too.
+        # Kivy's Cache has no hook for new entries, so append is wrapped
+        # until stop()
+        from kivy.cache import Cache
+        from kivy.clock import Clock
+
+        append = Cache.append
+        self._cache_append = Cache.__dict__['append']
+
+        def recording_append(category, key, obj, timeout=None):
+            if category in CACHE_CATEGORIES:
+                self._event('load', f'{category} {key}')
+            return append(category, key, obj, timeout)
+
+        Cache.append = staticmethod(recording_append)
+        self._clock = Clock
+        Clock.schedule_interval(self._frame, 0)
+        if self.show_overlay:
+            Clock.schedule_interval(self._update_overlay, self.overlay_interval)
+
+    def stop(self):
+        # Leave Kivy as start() and watch() found it
+        if self._clock is None:
+            return
+        from kivy.cache import Cache
+        Cache.append = self._cache_append
+        self._cache_append = None
+        self._clock.unschedule(self._frame)
+        self._clock.unschedule(self._update_overlay)
+        self._clock = None
+        if self.sm is not None:
+            self.sm.unbind(current=self._transition_started)
+        if self.overlay is not None and self.overlay.parent is not None:
+            self.overlay.parent.remove_widget(self.overlay)
+        self._finish_transition()
+
+    def watch(self, sm):
+        self.sm = sm
+        self._current = sm.current
+        sm.bind(current=self._transition_started)
+        if self.show_overlay:
+            from kivy.core.window import Window
+            from kivy.uix.label import Label
+            self.overlay = Label(font_size='12sp', color=(1, 1, 0, 1), halign='left', valign='top',
+                                 size_hint=(None, None), size=(Window.width, 60), pos=(8, Window.height - 64))
+            self.overlay.bind(size=self.overlay.setter('text_size'))
+            Window.add_widget(self.overlay)
+
+    def screen_built(self, name, seconds):
+        self._event('build', name, seconds * 1000)
+
+    def mark(self, label):
+        # Something worth seeing in the frame that follows it
+        self._event('mark', label)
+
+    def _now_ms(self):
+        return (time.perf_counter() - self._started) * 1000
+
+    def _event(self, kind, label, ms=None):
+        event = {'kind': kind, 'label': label, 'at_ms': self._now_ms(), 'screen': self._current}
+        if ms is not None:
+            event['ms'] = ms
+        self.events.append(event)
+        self._unresolved.append(event)
+
+    def _screen_index(self, name):
+        if name not in self.screens:
+            self.screens.append(name)
+        return self.screens.index(name)
+
+    def _transition_started(self, sm, name):
+        self._finish_transition()
+        self._transition = {'from': self._current, 'to': name, 'started': time.perf_counter(),
+                            'frames': 0, 'worst_frame_ms': 0.0, 'first_frame_ms': None}
+        self._current = name
+
+    def _finish_transition(self):
+        transition = self._transition
+        if transition is None:
+            return
+        self._transition = None
+        transition['ms'] = (time.perf_counter() - transition.pop('started')) * 1000
+        self.transitions.append(transition)
+
+    def _frame(self, dt):
+        ms = dt * 1000
+        if len(self.frames) >= self.frame_capacity:
+            del self.frames[:self.frame_capacity // 2]
+            del self.frame_screens[:self.frame_capacity // 2]
+        self.frames.append(ms)
+        # Frames under the idle frame rate cap are slow on purpose; keep them apart
+        cap = max_fps(self._clock)
+        screen = f'{self._current} (idle)' if 0 < cap < 1000 / JANK_MS else self._current
+        self.frame_screens.append(self._screen_index(screen))
+        for event in self._unresolved:
+            event['frame_ms'] = ms
+        self._unresolved.clear()
+        transition = self._transition
+        if transition is not None:
+            transition['frames'] += 1
+            transition['worst_frame_ms'] = max(transition['worst_frame_ms'], ms)
+            if transition['first_frame_ms'] is None:
+                transition['first_frame_ms'] = ms
+            if not self.sm.transition.is_active:
+                self._finish_transition()
+
+    def _update_overlay(self, dt):
+        if self.overlay is None or not self.frames:
+            return
+        recent = sorted(self.frames[-60:])
+        text = (f'{1000 / (sum(recent) / len(recent)):.0f} fps  p95 {percentile(recent, 0.95):.1f} ms  '
+                f'worst {recent[-1]:.1f} ms  loads {sum(1 for event in self.events if event["kind"] == "load")}')
+        if self.transitions:
+            last = self.transitions[-1]
+            text += f'\n{last["from"]} -> {last["to"]}: {last["ms"]:.0f} ms, worst frame {last["worst_frame_ms"]:.1f} ms'
+        self.overlay.text = text
+        # Stay on top of screens added since
+        parent = self.overlay.parent
+        if parent is not None and parent.children[0] is not self.overlay:
+            parent.remove_widget(self.overlay)
+            parent.add_widget(self.overlay)
+
+    def report(self):
+        by_screen = defaultdict(list)
+        for ms, index in zip(self.frames, self.frame_screens):
+            by_screen[self.screens[index]].append(ms)
+        return {
+            'build': build_id(),
+            'recorded_at': time.time(),
+            'seconds': self._now_ms() / 1000,
+            'frames': frame_stats(self.frames),
+            'screens': {name: frame_stats(frames) for name, frames in by_screen.items()},
+            'transitions': self.transitions,
+            'events': self.events,
+            'frame_ms': [round(ms, 2) for ms in self.frames],
+            'frame_screens': [self.screens[index] for index in self.frame_screens],
+        }
+
+    def save(self, path=None):
+        path = path or self.path
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.report(), f)
+        os.replace(tmp_path, path)
+        return path
+
+
+def transition_stats(report):
+    # (from, to) -> median total ms and the worst frame seen in any of them
+    grouped = defaultdict(list)
+    for transition in report['transitions']:
+        grouped[f"{transition['from']} -> {transition['to']}"].append(transition)
+    stats = {}
+    for name, transitions in sorted(grouped.items()):
+        totals = sorted(transition['ms'] for transition in transitions)
+        stats[name] = {'count': len(transitions), 'p50_ms': percentile(totals, 0.5),
+                       'worst_frame_ms': max(transition['worst_frame_ms'] for transition in transitions)}
+    return stats
+
+
+def print_summary(path=UI_PROFILE_FILE):
+    with open(path) as f:
+        report = json.load(f)
+    print(f"Build {report['build']}, {report['seconds']:.0f} s")
+    for name, stats in [('all frames', report['frames'])] + sorted(report['screens'].items()):
+        if stats:
+            print(f"  {name}: {stats['frames']} frames, p50 {stats['p50_ms']:.1f} ms, p95 {stats['p95_ms']:.1f} ms, "
+                  f"max {stats['max_ms']:.1f} ms, {stats['janky']} over {JANK_MS:.0f} ms")
+    for name, stats in transition_stats(report).items():
+        print(f"  {name}: {stats['count']}x, p50 {stats['p50_ms']:.0f} ms, worst frame {stats['worst_frame_ms']:.1f} ms")
+    for event in report['events']:
+        if event['kind'] != 'load' or event.get('frame_ms', 0) > JANK_MS:
+            print(f"  {event['at_ms'] / 1000:8.2f} s {event['kind']} {event['label']}"
+                  + (f" {event['ms']:.1f} ms" if 'ms' in event else '')
+                  + (f", frame {event['frame_ms']:.1f} ms" if 'frame_ms' in event else ''))
+
+
+def compare(before_path, after_path):
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    print(f"{before['build']} -> {after['build']}")
+
+    def row(name, old, new):
+        if old is None or new is None:
+            return
+        change = (new - old) / old * 100 if old else 0.0
+        print(f"  {name:<48} {old:8.1f} {new:8.1f} ms  {change:+6.1f}%")
+
+    for screen in sorted(set(before['screens']) | set(after['screens'])):
+        for key in ('p95_ms', 'max_ms'):
+            row(f'{screen} {key[:-3]}', (before['screens'].get(screen) or {}).get(key),
+                (after['screens'].get(screen) or {}).get(key))
+    old_transitions, new_transitions = transition_stats(before), transition_stats(after)
+    for name in sorted(set(old_transitions) | set(new_transitions)):
+        for key in ('p50_ms', 'worst_frame_ms'):
+            row(f'{name} {key[:-3]}', old_transitions.get(name, {}).get(key), new_transitions.get(name, {}).get(key))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 2 and sys.argv[1] == 'summary':
+        print_summary(*sys.argv[2:3])
+    elif len(sys.argv) == 4 and sys.argv[1] == 'compare':
+        compare(sys.argv[2], sys.argv[3])
+    else:
+        print(f"Usage: {sys.argv[0]} summary [{UI_PROFILE_FILE}] | compare BEFORE.json AFTER.json")
+        sys.exit(1)